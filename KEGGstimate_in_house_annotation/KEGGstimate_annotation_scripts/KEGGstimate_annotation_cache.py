@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Converts EggNOG .emapper.annotations files into a compact binary cache, stored next to each annotation file as
+*input.emapper.annotations*.columns. The cache holds every column of the annotation lines (gene ids, KEGG ko lists,
+COG categories and all other eggNOG columns) as an array of integer codes, one per line, with the distinct values of
+the column listed once. Reading one column from the cache is much faster than reading and splitting the whole text file.
+
+The module checker, the BRITE checker, the runner, and Misc_scripts/EggNOG_COG_counter.py and EggNOG_to_KEGG.py
+read the cache instead of the text file when it is present and up to date, and give exactly the same output.
+A cache is up to date as long as the size and modification time of its annotation file match those stored in it.
+Unlike the compiled module database, which is checked by its sha256 hash, the cache is deliberately not checked by the
+content of the annotation file: hashing the file would read all of it, which is the cost the cache is there to avoid.
+An annotation file edited in place without changing its size or modification time is therefore not detected; rewrite
+its cache with --force in that case.
+The scripts in Misc_scripts only use the cache when this file is in their directory or on the Python path.
+
+Usage: (python) KEGGstimate_annotation_cache.py input_dir_or_list_or_file [arguments]
+
+The input is a directory containing .emapper.annotations files (searched including subdirectories), a text file
+listing them (one per line), or a single .emapper.annotations file.
+
+Optional arguments:
+    --force: Rewrite the cache of every annotation file, even when it is up to date
+"""
+###################
+#Import statements
+###################
+
+import sys
+import os
+import array
+import struct
+
+###################
+#Functions
+###################
+
+#Cache file layout: a header (see CACHE_HEADER), followed by the position of every column in the file (as 64-bit integers),
+#and the columns. Per column: the number of distinct values and the number of bytes they take (see COLUMN_HEADER), the offsets
+#of the values (number of values + 1), the values themselves encoded as utf-8, and the code of the value of every line.
+#Only lines that do not start with "#" are stored. Values are stored exactly as split from the line by tabs, so the value of the
+#last column of a line ends with its newline. Lines with fewer columns have ABSENT_CODE in the columns they lack.
+#Integers are stored in the byte order of the machine.
+
+#Extension of the cache file
+CACHE_SUFFIX = ".columns"
+#Increase when the format of the cache changes, so that older cache files are not read
+CACHE_VERSION = 1
+#Magic bytes, version, annotation file size, annotation file modification time, number of lines and number of columns
+CACHE_HEADER = struct.Struct("=4sIqqII")
+CACHE_MAGIC = b"KANC"
+COLUMN_HEADER = struct.Struct("=II")
+#Code of a column missing from a line
+ABSENT_CODE = 0xFFFFFFFF
+
+def gen_line_reader(file_path):
+    """
+    Generator function that allows reading a text file line
+    by line, without reading the full file into memory
+    """
+    for line in open(file_path, "r"):
+        yield line
+
+def annotation_files(annotation_input):
+    """
+    Returns the list of annotation files to convert. The input is a directory, which is searched (including subdirectories)
+    for files ending with "emapper.annotations", a text file listing one annotation file per line, or an annotation file.
+    """
+    out_list = []
+    if os.path.isdir(annotation_input):
+        for subdir, dirs, files in os.walk(annotation_input):
+            for file in files:
+                if file.endswith("emapper.annotations"):
+                    out_list.append(os.path.join(subdir, file))
+        out_list.sort()
+    elif annotation_input.endswith("emapper.annotations"):
+        out_list.append(annotation_input)
+    else:
+        for line in gen_line_reader(annotation_input):
+            if line.strip() and not line.startswith("#"):
+                out_list.append(line.strip())
+    return out_list
+
+def cache_path(annotation_path):
+    """
+    Returns the path of the cache of an annotation file
+    """
+    return annotation_path + CACHE_SUFFIX
+
+def annotation_stat(annotation_path):
+    """
+    Returns the size and modification time of an annotation file, used to check whether its cache is up to date.
+    The content is not hashed, since that would read the whole annotation file on every use of the cache.
+    """
+    stat = os.stat(annotation_path)
+    return stat.st_size, stat.st_mtime_ns
+
+def write_annotation_cache(annotation_path):
+    """
+    Reads an annotation file, and writes its cache. The cache is written to a temporary file first, so that an
+    interrupted run never leaves a partial cache behind.
+    """
+    db_stat = annotation_stat(annotation_path)
+    #Per column, the code of every distinct value, and the code per line
+    value_ids = []
+    codes = []
+    lines = 0
+    for line in gen_line_reader(annotation_path):
+        if line.startswith("#"):
+            continue
+        fields = line.split("\t")
+        while len(codes) < len(fields):
+            value_ids.append({})
+            codes.append(array.array("I", [ABSENT_CODE]) * lines)
+        for column in range(len(codes)):
+            if column < len(fields):
+                value = fields[column]
+                if value not in value_ids[column]:
+                    value_ids[column][value] = len(value_ids[column])
+                codes[column].append(value_ids[column][value])
+            else:
+                codes[column].append(ABSENT_CODE)
+        lines += 1
+    temp_path = "{}.tmp{}".format(cache_path(annotation_path), os.getpid())
+    with open(temp_path, "wb") as f:
+        f.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, db_stat[0], db_stat[1], lines, len(codes)))
+        #The column positions are filled in once the columns are written
+        positions = array.array("q", [0]) * len(codes)
+        positions_start = f.tell()
+        positions.tofile(f)
+        for column in range(len(codes)):
+            positions[column] = f.tell()
+            offsets = array.array("I", [0])
+            blob = bytearray()
+            for value in value_ids[column]:
+                blob += value.encode()
+                offsets.append(len(blob))
+            f.write(COLUMN_HEADER.pack(len(value_ids[column]), len(blob)))
+            offsets.tofile(f)
+            f.write(blob)
+            codes[column].tofile(f)
+        f.seek(positions_start)
+        positions.tofile(f)
+    os.replace(temp_path, cache_path(annotation_path))
+
+def read_cache_header(f, annotation_path):
+    """
+    Reads the header of an opened cache file. Returns the number of lines and columns, or None if the cache is not up to date.
+    """
+    magic, version, size, mtime, lines, columns = CACHE_HEADER.unpack(f.read(CACHE_HEADER.size))
+    if magic != CACHE_MAGIC or version != CACHE_VERSION or (size, mtime) != annotation_stat(annotation_path):
+        return None
+    return lines, columns
+
+def cache_up_to_date(annotation_path):
+    """
+    Returns whether the annotation file has an up-to-date cache
+    """
+    try:
+        with open(cache_path(annotation_path), "rb") as f:
+            return read_cache_header(f, annotation_path) is not None
+    except (OSError, struct.error):
+        return False
+
+def read_column_codes(annotation_path, column):
+    """
+    Reads a column (counting from 0) from the cache of an annotation file. Returns a tuple of (list of distinct values,
+    array of the code of the value of every line), in which lines lacking the column have ABSENT_CODE. Returns None if
+    there is no up-to-date cache, so that the annotation file is read instead.
+    """
+    path = cache_path(annotation_path)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            header = read_cache_header(f, annotation_path)
+            if header is None:
+                return None
+            lines, columns = header
+            codes = array.array("I")
+            if column >= columns:
+                #No line has this column
+                codes.extend([ABSENT_CODE] * lines)
+                return [], codes
+            positions = array.array("q")
+            positions.fromfile(f, columns)
+            f.seek(positions[column])
+            value_count, blob_bytes = COLUMN_HEADER.unpack(f.read(COLUMN_HEADER.size))
+            offsets = array.array("I")
+            offsets.fromfile(f, value_count + 1)
+            blob = f.read(blob_bytes)
+            codes.fromfile(f, lines)
+    except (OSError, EOFError, ValueError, struct.error):
+        return None
+    values = []
+    for i in range(value_count):
+        values.append(blob[offsets[i]:offsets[i + 1]].decode())
+    return values, codes
+
+def read_column(annotation_path, column):
+    """
+    Returns the value of a column (counting from 0) for every line of an annotation file that does not start with "#",
+    as split by tabs, or None for lines lacking the column. Returns None if there is no up-to-date cache.
+    """
+    cached = read_column_codes(annotation_path, column)
+    if cached is None:
+        return None
+    values, codes = cached
+    out_list = []
+    for code in codes:
+        if code == ABSENT_CODE:
+            out_list.append(None)
+        else:
+            out_list.append(values[code])
+    return out_list
+
+def annotation_column(annotation_path, column):
+    """
+    Returns the value of a column (counting from 0) for every line of an annotation file that does not start with "#",
+    as split by tabs, or None for lines lacking the column. The column is read from the cache if it is up to date,
+    and from the annotation file otherwise.
+    """
+    cached = read_column(annotation_path, column)
+    if cached is not None:
+        return cached
+    out_list = []
+    for line in gen_line_reader(annotation_path):
+        if line.startswith("#"):
+            continue
+        fields = line.split("\t")
+        if len(fields) > column:
+            out_list.append(fields[column])
+        else:
+            out_list.append(None)
+    return out_list
+
+####################################################################
+#MAIN
+####################################################################
+if __name__ == "__main__":
+    annotation_input = sys.argv[1]
+    force = "--force" in sys.argv
+    written = 0
+    annotation_list = annotation_files(annotation_input)
+    for annotation_path in annotation_list:
+        if not force and cache_up_to_date(annotation_path):
+            continue
+        write_annotation_cache(annotation_path)
+        written += 1
+    print("Wrote the cache of {} of {} annotation files".format(written, len(annotation_list)))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Reads the k terms from EggNOG .emapper.annotations files, lists the annotation files of a batch run, and gives the number
+of CPUs a batch run can use. Used by the module checker, the BRITE checker, the runner and the scripts built on them, so
+that all of them read annotation files in exactly the same way. Only the columns up to the KEGG ko column are split off
+each line. If an annotation file has an up-to-date cache (see KEGGstimate_annotation_cache.py, which is used when it is
+in the same directory), the ko column is read from the cache instead.
+
+Use from Python:
+    import KEGGstimate_annotation_parser as ap
+    kterms_list = ap.eggnog_parser("genome.emapper.annotations")
+"""
+###################
+#Import statements
+###################
+
+import sys
+import os
+try:
+    import KEGGstimate_annotation_cache as annotation_cache
+except ImportError:
+    annotation_cache = None
+
+###################
+#Functions
+###################
+
+def gen_line_reader(file_path):
+    """
+    Generator function that allows reading a text file line
+    by line, without reading the full file into memory
+    """
+    for line in open(file_path, "r"):
+        yield line
+
+def available_threads():
+    """
+    Returns the number of CPUs this process is allowed to use (which follows the SLURM allocation)
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+def batch_input_files(batch_input):
+    """
+    Returns the list of eggnog annotation files for batch mode. The input is either a directory, which is searched
+    (including subdirectories) for files ending with "emapper.annotations", or a text file listing one annotation file per line.
+    """
+    out_list = []
+    if os.path.isdir(batch_input):
+        for subdir, dirs, files in os.walk(batch_input):
+            for file in files:
+                if file.endswith("emapper.annotations"):
+                    out_list.append(os.path.join(subdir, file))
+        out_list.sort()
+    else:
+        for line in gen_line_reader(batch_input):
+            if line.strip() and not line.startswith("#"):
+                out_list.append(line.strip())
+    return out_list
+
+def check_unique_file_names(annotation_files):
+    """
+    Exits if two annotation files of a batch have the same file name. The output of every annotation file is named
+    after its file name only, so such files (for example in different subdirectories) would overwrite each other's output.
+    """
+    file_paths = {}
+    for annotation_file in annotation_files:
+        file_name = os.path.basename(annotation_file)
+        if file_name not in file_paths:
+            file_paths[file_name] = []
+        file_paths[file_name].append(annotation_file)
+    duplicates = []
+    for file_name in file_paths:
+        if len(file_paths[file_name]) > 1:
+            duplicates.append("{}: {}".format(file_name, ", ".join(file_paths[file_name])))
+    if duplicates:
+        sys.exit("Annotation files with the same name would overwrite each other's output. Rename them, or run them "
+                 "in separate batches:\n" + "\n".join(duplicates))
+
+def ko_column_kterms(ko):
+    """
+    Returns the list of k terms in the KEGG ko column of an annotation line
+    """
+    out_list = []
+    #!!!!A comma means there is multiple ko terms. BLASTkoala appears to only save the first one.
+    #This script will include both ko terms
+    if ko == "-":
+        ko = ""
+    elif "," in ko:
+        for i in ko.split(","):
+            i = i.replace("ko:", "")
+            out_list.append(i)
+    else:
+        ko = ko.replace("ko:", "")
+        out_list.append(ko)
+    return out_list
+
+def eggnog_parser(eggnog_path):
+    """
+    Parses an eggnog.annotations output file. Returns a list of all the found k terms.
+    If the file has an up-to-date cache (see KEGGstimate_annotation_cache.py), the ko column is read from the cache instead.
+    """
+    if annotation_cache is not None:
+        cached = annotation_cache.read_column_codes(eggnog_path, 11)
+        #Lines lacking the ko column are left to the text parser below, which fails on them as before
+        if cached is not None and annotation_cache.ABSENT_CODE not in cached[1]:
+            values, codes = cached
+            #Every distinct value of the column is only parsed once
+            value_kterms = [ko_column_kterms(ko) for ko in values]
+            out_list = []
+            for code in codes:
+                out_list.extend(value_kterms[code])
+            return out_list
+    out_list = []
+    for line in gen_line_reader(eggnog_path):
+        if line.startswith("#"):
+            continue
+        #Only split off the columns up to the KEGG ko column, rather than the whole line
+        out_list.extend(ko_column_kterms(line.split("\t", 12)[11]))
+    return out_list
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Synthetic stress benchmark for the module checker. Generates KEGG-style module definitions with a controlled nesting
+depth, number of comma alternatives (fan-out) and fraction of non-essential genes, together with EggNOG annotation
+files with a controlled number of k terms. No network connection or KEGG data is needed.
+
+For every scale, the following are timed:
+    parse_expand: retrieve_all_possible_pathways, listing every combination of each module
+    exhaustive: pathway_completion_checker, checking every combination
+    best_first: pathway_completion_checker with the best-first search
+    compiled: compiled_completion_checker, evaluating the compiled modules
+    matrix: matrix_completion_checker of KEGGstimate_module_matrix.py, if numpy is installed
+The number of combinations per second and the peak memory (measured by tracemalloc in a separate run) are reported.
+Modules with more combinations than --max_combinations are only used by the compiled and matrix benchmarks.
+
+Usage: (python) KEGGstimate_benchmark.py [arguments]
+
+Optional arguments:
+    --quick: Only run the smallest scales
+    --seed: Seed of the random generator. Default is 1
+    --genomes: Number of annotation files generated per scale. Default is 3
+    --max_combinations: Largest number of combinations of a module used by the enumerating benchmarks. Default is 2000
+    --out_dir: Directory to keep the generated databases and annotation files. By default these are removed afterwards
+    --json: Also write the results as JSON to the given file
+
+KEGGstimate_module_checker.py (and KEGGstimate_module_matrix.py for the matrix benchmark) need to be in the same directory.
+"""
+###################
+#Import statements
+###################
+
+import sys
+import os
+import time
+import json
+import copy
+import random
+import shutil
+import tempfile
+import tracemalloc
+import KEGGstimate_module_checker as mc
+import KEGGstimate_annotation_parser as ap
+try:
+    import KEGGstimate_module_matrix as mm
+except ImportError:
+    mm = None
+
+###################
+#Functions for generating synthetic data
+###################
+
+#Each scale is a tuple of (name, number of modules, nesting depth, fan-out, fraction of non-essential genes, k terms per genome)
+SCALES = [("small", 40, 1, 3, 0.05, 300),
+          ("medium", 40, 2, 3, 0.1, 600),
+          ("wide", 40, 1, 8, 0.1, 600),
+          ("deep", 40, 3, 2, 0.1, 1000),
+          ("large", 40, 3, 3, 0.1, 1500)]
+
+QUICK_SCALES = 2
+
+#Number of k terms the synthetic modules and annotation files are drawn from
+GENE_POOL = 3000
+
+def random_gene(rnd, used_set=None):
+    """
+    Returns a random k term from the gene pool. If a used_set is given, returns a k term not in it, and adds it to the set.
+    """
+    gene = "K{:05d}".format(rnd.randrange(GENE_POOL))
+    if used_set is not None:
+        while gene in used_set:
+            gene = "K{:05d}".format(rnd.randrange(GENE_POOL))
+        used_set.add(gene)
+    return gene
+
+def generate_expression(rnd, depth, fan_out, optional_rate, used_set):
+    """
+    Generates part of a KEGG definition: two to four genes or bracketed groups joined by spaces or pluses.
+    While the depth is above 0, a group consists of fan_out alternatives separated by commas, each of which is generated
+    with one less depth. Genes or groups are marked non-essential with a minus at the given rate.
+    Genes are not repeated within a module (tracked in used_set), so that every module can be evaluated exactly (see compile_module).
+    """
+    out_string = ""
+    for i in range(rnd.randint(2, 4)):
+        if i > 0:
+            out_string += rnd.choice([" ", " ", "+"])
+        if i > 0 and rnd.random() < optional_rate:
+            #The minus also joins the non-essential gene or group to the previous one
+            out_string = out_string[:-1] + "-"
+        if depth > 0 and rnd.random() < 0.6:
+            alternatives = []
+            for j in range(fan_out):
+                alternatives.append(generate_expression(rnd, depth - 1, fan_out, optional_rate, used_set))
+            out_string += "(" + ",".join(alternatives) + ")"
+        else:
+            out_string += random_gene(rnd, used_set)
+    return out_string
+
+def generate_module_db(path, modules, depth, fan_out, optional_rate, rnd):
+    """
+    Writes a synthetic module database in the format of KEGG_module_db_generate.py. Every definition starts with
+    a gene used nowhere else, so that every combination has at least one essential gene.
+    """
+    out = open(path, "w")
+    for i in range(modules):
+        out.write("Module: M9{:04d} Synthetic module {}\n".format(i, i))
+        used_set = set()
+        for j in range(rnd.choice([1, 1, 1, 2])):
+            out.write("Definition: K9{:04d}{} {}\n".format(i, j, generate_expression(rnd, depth, fan_out, optional_rate, used_set)))
+        out.write("Class: Synthetic modules\n")
+    out.close()
+
+def generate_annotation(path, kterms, rnd):
+    """
+    Writes a synthetic EggNOG .annotations file containing the given number of (not necessarily distinct) k terms
+    """
+    out = open(path, "w")
+    out.write("## Synthetic emapper annotations\n")
+    out.write("#query\tseed_ortholog\tevalue\tscore\teggNOG_OGs\tmax_annot_lvl\tCOG_category\tDescription\tPreferred_name\tGOs\tEC\tKEGG_ko\tKEGG_Pathway\tKEGG_Module\tKEGG_Reaction\tKEGG_rclass\tBRITE\tKEGG_TC\tCAZy\tBiGG_Reaction\tPFAMs\n")
+    written = 0
+    gene = 0
+    while written < kterms:
+        gene += 1
+        if rnd.random() < 0.1:
+            ko = "ko:{},ko:{}".format(random_gene(rnd), random_gene(rnd))
+            written += 2
+        else:
+            ko = "ko:" + random_gene(rnd)
+            written += 1
+        out.write("gene_{}\t-\t1e-50\t100\t-\t-\tS\t-\t-\t-\t-\t{}\t-\t-\t-\t-\t-\t-\t-\t-\t-\n".format(gene, ko))
+    out.close()
+
+###################
+#Benchmark functions
+###################
+
+def measure(function):
+    """
+    Runs the function twice: once to measure the time in seconds, and once to measure the peak memory in kilobytes
+    with tracemalloc, which slows down the function. Returns a tuple of (seconds, peak memory).
+    """
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak // 1024
+
+def benchmark_scale(scale, work_dir, genomes, max_combinations, rnd):
+    """
+    Generates the data of a single scale, and runs every benchmark on it. Returns a list with a dictionary per benchmark.
+    """
+    name, modules, depth, fan_out, optional_rate, kterms = scale
+    db_path = os.path.join(work_dir, name + "_module_db")
+    generate_module_db(db_path, modules, depth, fan_out, optional_rate, rnd)
+    kterms_lists = []
+    for i in range(genomes):
+        annotation_path = os.path.join(work_dir, "{}_{}.emapper.annotations".format(name, i))
+        generate_annotation(annotation_path, kterms, rnd)
+        kterms_lists.append(ap.eggnog_parser(annotation_path))
+    KEGG_dict = mc.KEGG_module_reader(db_path)
+    compiled_dict = mc.compile_KEGG_modules(KEGG_dict)
+    kterm_index = mc.build_kterm_index(compiled_dict)
+    #Only modules that can be enumerated in reasonable time are used by the enumerating benchmarks
+    small_dict = {}
+    small_combinations = 0
+    all_combinations = 0
+    for module_name in compiled_dict:
+        all_combinations += compiled_dict[module_name]["tree"][2]
+        if compiled_dict[module_name]["tree"][2] <= max_combinations:
+            small_dict[module_name] = KEGG_dict[module_name]
+            small_combinations += compiled_dict[module_name]["tree"][2]
+
+    def parse_expand():
+        for module_name in small_dict:
+            mc.retrieve_all_possible_pathways(small_dict[module_name])
+
+    def exhaustive():
+        for kterms_list in kterms_lists:
+            mc.pathway_completion_checker(copy.deepcopy(small_dict), kterms_list)
+
+    def best_first():
+        for kterms_list in kterms_lists:
+            mc.pathway_completion_checker(small_dict, kterms_list, "best_first")
+
+    def compiled():
+        for kterms_list in kterms_lists:
+            mc.compiled_completion_checker(compiled_dict, kterms_list, kterm_index)
+
+    def matrix():
+        mm.matrix_completion_checker(compiled_dict, kterms_lists, kterm_index)
+
+    benchmark_list = [("parse_expand", parse_expand, len(small_dict), 1, small_combinations),
+                      ("exhaustive", exhaustive, len(small_dict), genomes, small_combinations),
+                      ("best_first", best_first, len(small_dict), genomes, small_combinations),
+                      ("compiled", compiled, len(compiled_dict), genomes, all_combinations)]
+    if mm is not None:
+        benchmark_list.append(("matrix", matrix, len(compiled_dict), genomes, all_combinations))
+    out_list = []
+    for benchmark, function, module_count, genome_count, combinations in benchmark_list:
+        seconds, peak = measure(function)
+        out_list.append({"scale": name, "benchmark": benchmark, "modules": module_count, "genomes": genome_count,
+                         "combinations": combinations * genome_count, "seconds": seconds,
+                         "combinations_per_second": combinations * genome_count / max(seconds, 1e-9), "peak_memory_kb": peak})
+    return out_list
+
+def print_results(result_list):
+    """
+    Prints the benchmark results as a table
+    """
+    print("Scale\tBenchmark\tModules\tGenomes\tCombinations\tSeconds\tCombinations/s\tPeak_memory_kb")
+    for result in result_list:
+        print("{}\t{}\t{}\t{}\t{}\t{:.4f}\t{:.4g}\t{}".format(result["scale"], result["benchmark"], result["modules"], result["genomes"],
+              result["combinations"], result["seconds"], result["combinations_per_second"], result["peak_memory_kb"]))
+
+####################################################################
+#MAIN
+####################################################################
+if __name__ == "__main__":
+    #Optional arguments
+    scales = SCALES
+    if "--quick" in sys.argv:
+        scales = SCALES[:QUICK_SCALES]
+    seed = 1
+    if "--seed" in sys.argv:
+        seed = int(sys.argv[sys.argv.index("--seed") + 1])
+    genomes = 3
+    if "--genomes" in sys.argv:
+        genomes = int(sys.argv[sys.argv.index("--genomes") + 1])
+    max_combinations = 2000
+    if "--max_combinations" in sys.argv:
+        max_combinations = int(sys.argv[sys.argv.index("--max_combinations") + 1])
+    out_dir = None
+    if "--out_dir" in sys.argv:
+        out_dir = sys.argv[sys.argv.index("--out_dir") + 1]
+    json_path = None
+    if "--json" in sys.argv:
+        json_path = sys.argv[sys.argv.index("--json") + 1]
+    #Generate the data in the output directory, or in a temporary directory that is removed afterwards
+    if out_dir is None:
+        work_dir = tempfile.mkdtemp(prefix="KEGGstimate_benchmark_")
+    else:
+        work_dir = out_dir
+        if not os.path.isdir(work_dir):
+            os.makedirs(work_dir)
+    rnd = random.Random(seed)
+    result_list = []
+    try:
+        for scale in scales:
+            result_list += benchmark_scale(scale, work_dir, genomes, max_combinations, rnd)
+    finally:
+        if out_dir is None:
+            shutil.rmtree(work_dir)
+    print_results(result_list)
+    if json_path is not None:
+        with open(json_path, "w") as out:
+            json.dump({"seed": seed, "genomes": genomes, "max_combinations": max_combinations, "results": result_list}, out, indent=2)
+            out.write("\n")
@@ -3,13 +3,26 @@
 Parses the K number from an Eggnog .annotation file. Uses a database of KEGG k term entries to both
 find to which (sub)category each k term belongs, and to reconstruct the KEGG hierarchy of nested
 categories. Then per (sub)category checks which k terms are present based on the EggNOG output.
+The categories and their k terms are compiled into an index file on the first run, which later runs map into memory.
 
-Usage: (python) KEGGstand_BRITE_checker.py input.emapper.annotations output_file KEGG_k_term_database
+Usage: (python) KEGGstand_BRITE_checker.py input.emapper.annotations output_file KEGG_k_term_database [arguments]
+
+Optional arguments:
+    --index: Path of the BRITE index. Default is the k term database path followed by ".index"
+    --no_index: Always parse the k term database, without reading or writing the index
+    --batch: Count a cohort of annotation files at once. The input is then a directory containing .emapper.annotations files,
+             or a text file listing them (one per line), and the output file is an output directory. Requires numpy and scipy.
+    --profile: Write the wall time and memory use of each phase as JSON to the given file.
+               See KEGGstimate_profiler.py.
 
 Output:
 Writes a tab-delimited file that lists each KEGG category along with its subcategories. After
 a tab, the number of genes found for the (sub)category is given, along with the total number of
 genes known for this category. 
+With --batch, writes this file for every annotation file (as *annotation file*_pathway_and_BRITE), and BRITE_count_matrix.tsv:
+a tab-delimited file with a row per category, giving the total number of genes and the number of genes found per sample.
+
+KEGGstimate_annotation_parser.py, which reads the k terms from the annotation files, and KEGGstimate_profiler.py need to be in the same directory.
 """
 
 ###################
@@ -17,6 +30,16 @@ genes known for this category.
 ################### 
 import sys
 import os
+import mmap
+import array
+import struct
+import KEGGstimate_annotation_parser as ap
+import KEGGstimate_profiler as profiler
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    sparse = None
 
 ###################
 #Functions
@@ -43,28 +66,112 @@ def leading_space_counter(string):
             break
     return spaces
     
+#The KEGG hierarchy is stored as a prefix tree of categories with integer node ids. Node 0 is the root, above the top level categories.
+#The same category names occur in many places of the database, so every name is stored once, and nodes refer to it by its name id.
+#Per node id, the arrays of the hierarchy dictionary hold the number of leading spaces of the category, its name id, the id of its parent,
+#and the ids of its first subcategory, last subcategory and next sibling (-1 if there is none), so that the subcategories are kept in the
+#order they were found. "node_ids" finds the id of a subcategory from its parent, leading spaces and name id, combined into a single
+#integer key (see node_key), which takes far less memory than a tuple.
+#
+#The k terms are stored per category path: the names of a category and all categories above it. Different nodes can have the same path,
+#for example when a category is found with different numbers of leading spaces. Paths are interned like nodes: path 0 is the empty path,
+#and "path_ids" finds the id of a path from the id of the path without its last name and the name id (see path_key). "node_paths" holds
+#the path id of every node.
+
+def node_key(parent, leading_spaces, name_id):
+    """
+    Returns the key of a subcategory in "node_ids". Node and name ids are below 2**32, and leading spaces below 2**16 - 1.
+    """
+    return (parent << 48) | (name_id << 16) | (leading_spaces + 1)
+
+def path_key(parent_path, name_id):
+    """
+    Returns the key of a path in "path_ids"
+    """
+    return (parent_path << 32) | name_id
+
+def new_hierarchy():
+    """
+    Returns an empty hierarchy, containing only the root node
+    """
+    return {"names": [], "name_ids": {}, "spaces": array.array("i", [0]), "name_of": array.array("i", [-1]), "parents": array.array("i", [-1]),
+            "first_child": array.array("i", [-1]), "last_child": array.array("i", [-1]), "next_sibling": array.array("i", [-1]),
+            "node_ids": {}, "node_paths": array.array("I", [0]), "path_ids": {}}
+
+def intern_name(hierarchy, KEGG_cat):
+    """
+    Returns the name id of a category name, adding the name to the hierarchy if it is new
+    """
+    name_id = hierarchy["name_ids"].get(KEGG_cat)
+    if name_id is None:
+        name_id = len(hierarchy["names"])
+        hierarchy["name_ids"][KEGG_cat] = name_id
+        hierarchy["names"].append(KEGG_cat)
+    return name_id
+
+def hierarchy_child(hierarchy, parent, leading_spaces, name_id):
+    """
+    Returns the id of the subcategory of the parent node, adding it to the hierarchy if it is new
+    """
+    key = node_key(parent, leading_spaces, name_id)
+    node = hierarchy["node_ids"].get(key)
+    if node is None:
+        node = len(hierarchy["spaces"])
+        hierarchy["node_ids"][key] = node
+        hierarchy["spaces"].append(leading_spaces)
+        hierarchy["name_of"].append(name_id)
+        hierarchy["parents"].append(parent)
+        hierarchy["first_child"].append(-1)
+        hierarchy["last_child"].append(-1)
+        hierarchy["next_sibling"].append(-1)
+        if hierarchy["first_child"][parent] < 0:
+            hierarchy["first_child"][parent] = node
+        else:
+            hierarchy["next_sibling"][hierarchy["last_child"][parent]] = node
+        hierarchy["last_child"][parent] = node
+        #The path of the node extends the path of its parent with its name
+        path = path_key(hierarchy["node_paths"][parent], name_id)
+        if path not in hierarchy["path_ids"]:
+            hierarchy["path_ids"][path] = len(hierarchy["path_ids"]) + 1
+        hierarchy["node_paths"].append(hierarchy["path_ids"][path])
+    return node
+
+def iterate_hierarchy(hierarchy):
+    """
+    Generator giving the ids of all categories in the hierarchy, each followed by its subcategories (depth-first)
+    """
+    first_child = hierarchy["first_child"]
+    next_sibling = hierarchy["next_sibling"]
+    stack = [first_child[0]]
+    while stack:
+        node = stack.pop()
+        if node < 0:
+            continue
+        yield node
+        stack.append(next_sibling[node])
+        stack.append(first_child[node])
+
 def parse_KEGG_kterm_db(k_term_db):
     """
-    Reads provided file and creates a list of all KEGG entries
-    within. 
+    Reads provided file, and creates the k terms per category path, and the hierarchy
+    of nested categories of all KEGG entries within. The k terms are returned as a dictionary of the
+    k term vocabulary ("ko_names"), and the arrays "entry_paths" and "entry_kos": the path id and k term id
+    of every k term found in a category, in the order of the database.
     """
     #Initiate variables
-    K_term_dict = {}
-    hierarchy_list = []
+    K_term_paths = {"ko_names": [], "entry_paths": array.array("I"), "entry_kos": array.array("I")}
+    ko_ids = {}
+    hierarchy = new_hierarchy()
     entry = False
     read = False
-    temp_list = []
-    k_term_temp_list = []
+    cat_stack = []
     #Iterate over each line in the database
     for line in gen_line_reader(k_term_db):
         #Parse out the K term from the entry line
         if line.startswith("ENTRY"):
             entry = line.split()[1]
             read = False
-            if temp_list != []:
-                hierarchy_list.append(temp_list)
-                temp_list = []
-                k_term_temp_list = []
+            cat_stack = []
         #Only read once the read variable is true, which happens only in the BRITE section
         if read:
             #Ignore the lines that starts with the entry itself
@@ -74,194 +181,307 @@ def parse_KEGG_kterm_db(k_term_db):
             KEGG_cat = line.strip()
             #Enzyme category has the fewest leading spaces, making it seem like an all-encompassing category during parsing. 
             #This can be resolved by adding an additional leading space
-            if line.strip().startswith("0"):
+            if KEGG_cat.startswith("0"):
                 leading_spaces = leading_spaces - 1
-            #Per entry, create a list of tuples (temp_list) that is added to the "hierarchy_list". Each tuple
-            #will be (number of leading spaces, KEGG category). This information will be used downstream
-            #to reconstruct the KEGG hierarchy
-            temp_list.append((leading_spaces, line.strip()))
-            #maintain a list of previous overarching categories so that kterms will be stored in the dictionary accounting for 
-            #category hierarchy. This is necessary for categories with identical names, but different hierarchies. (eg small subunit in eukaryote and prokaryote ribosomes)
-            new_list = k_term_temp_list[:]
-            for cat in k_term_temp_list:
-                if leading_spaces <= cat[0]:
-                    new_list.remove(cat)
-            k_term_temp_list = new_list[:]
-            #Add the current item to the previous cat list
-            k_term_temp_list.append((leading_spaces, KEGG_cat))
-            #Make a temp list of the previous and current category, used to find the corresponding kterms from the dictionary
-            new_list = []
-            for cat in k_term_temp_list:
-                new_list.append(cat[1])
-            if tuple(new_list) not in K_term_dict:
-                K_term_dict[tuple(new_list)] = [entry]
-            else:
-                K_term_dict[tuple(new_list)].append(entry)
+            #Maintain a stack of the overarching categories as tuples of (leading spaces, node id). Categories with
+            #at least as many leading spaces as the current one are not overarching, and are removed. Kterms are stored
+            #by the path of category names, accounting for category hierarchy. This is necessary for categories with identical names,
+            #but different hierarchies. (eg small subunit in eukaryote and prokaryote ribosomes)
+            while cat_stack and leading_spaces <= cat_stack[-1][0]:
+                cat_stack.pop()
+            parent = 0
+            if cat_stack:
+                parent = cat_stack[-1][1]
+            node = hierarchy_child(hierarchy, parent, leading_spaces, intern_name(hierarchy, KEGG_cat))
+            cat_stack.append((leading_spaces, node))
+            #Use the path of the previous and current categories to store the kterm
+            if entry not in ko_ids:
+                ko_ids[entry] = len(K_term_paths["ko_names"])
+                K_term_paths["ko_names"].append(entry)
+            K_term_paths["entry_paths"].append(hierarchy["node_paths"][node])
+            K_term_paths["entry_kos"].append(ko_ids[entry])
         if line.startswith("BRITE"):
             read = True
-    
-    if temp_list != []:
-        hierarchy_list.append(temp_list)
-    return K_term_dict, hierarchy_list
+    return K_term_paths, hierarchy
+
+def group_values(keys, values, key_count):
+    """
+    Groups the values by their key (an integer below key_count), keeping their order. Returns an array of offsets and an
+    array of the grouped values: the values of key i are at offsets[i]:offsets[i+1].
+    """
+    offsets = array.array("I", [0]) * (key_count + 1)
+    for key in keys:
+        offsets[key + 1] += 1
+    for key in range(key_count):
+        offsets[key + 1] += offsets[key]
+    grouped = array.array(values.typecode, [0]) * len(values)
+    position = offsets[:-1]
+    for key, value in zip(keys, values):
+        grouped[position[key]] = value
+        position[key] += 1
+    return offsets, grouped
+
+###################
+#Functions for the precompiled BRITE index
+###################
+
+#Parsing the k term database is the slowest part of a run, so the categories are compiled once into a binary index file (by default
+#the database path followed by ".index"), which later runs map into memory rather than reading. The index holds a row per category
+#in the order of the output: the number of dashes written before the name, the row of its parent category (-1 for top level categories),
+#its name, and the ids of the k terms associated with it. K term ids refer to the k term vocabulary, also stored in the index.
+#The k term ids of row i are row_kos[row_offsets[i]:row_offsets[i+1]].
+#
+#A k term is usually associated with a category and with every category above it, so rather than counting the k terms of every category,
+#the counts of subcategories are added to their parent category. To keep this exact when a k term occurs more or less often in a category
+#than in its subcategories together, each k term has a weight per category: the number of times it is associated with the category, minus
+#the number of times it is associated with its subcategories. Only nonzero weights are stored, per k term: the rows and weights of k term j
+#are ko_rows and ko_weights[ko_offsets[j]:ko_offsets[j+1]]. The number of found genes of a category is then the sum of the weights of the
+#present k terms for the category, plus the number of found genes of its subcategories.
+#
+#File layout: a header (see BRITE_INDEX_HEADER), followed by the integer arrays in the order of BRITE_INDEX_ARRAYS, the k term vocabulary
+#and the category names, both separated by newlines. Integers are stored in the byte order of the machine.
 
+#Increase when the format of the index changes, so that older index files are rebuilt
+BRITE_INDEX_VERSION = 2
+#Magic bytes, version, database size, database modification time, number of k terms, rows, k term ids, k term weights, and bytes of the vocabulary and names
+BRITE_INDEX_HEADER = struct.Struct("=4sIqqIIIIII")
+BRITE_INDEX_MAGIC = b"KBRI"
+#Integer arrays of the index, with their type and the header field giving their length
+BRITE_INDEX_ARRAYS = [("row_dashes", "i", "rows"), ("row_parents", "i", "rows"), ("row_offsets", "I", "row_offsets"), ("row_kos", "I", "row_kos"),
+                      ("ko_offsets", "I", "ko_offsets"), ("ko_rows", "I", "weights"), ("ko_weights", "i", "weights")]
 
-def branching_dict_helper(in_dict, in_list):
+def build_brite_index(K_term_paths, hierarchy):
     """
-    Helper function to create an empty branching dictionary, used to store branching hierarchy. 
-    
-    Note:
-    I am aware there exist more elegant recursive solutions. However, I do not fully understand their logic,
-    and thus chose to instead implement a more direct solution which will function exactly as I expect. At the time 
-    of writing (18-10-24), the highest level of nestedness in the KEGG entries is 5. This function can deal with 
-    a level of nestedness of 10, which is unlikely to ever occur. Therefore, while this solution is sub-optimal, 
-    it should be quite robust. 
-    """
-    i = 0
-    while i < len(in_list): #Highest level of nestedness is 5, so will do 10 levels to be sure
-        if i == 0 and in_list[i] not in in_dict:
-            in_dict[in_list[i]] = {}
-        elif i == 1 and in_list[i] not in in_dict[in_list[0]]:
-            in_dict[in_list[0]][in_list[i]] = {}
-        elif i == 2 and in_list[i] not in in_dict[in_list[0]][in_list[1]]:
-            in_dict[in_list[0]][in_list[1]][in_list[i]] = {}
-        elif i == 3 and in_list[i] not in in_dict[in_list[0]][in_list[1]][in_list[2]]:
-            in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[i]] = {}
-        elif i == 4 and in_list[i] not in in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]]:
-            in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[i]] = {}
-        elif i == 5 and in_list[i] not in in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]]:
-            in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[i]] = {}
-        elif i == 6 and in_list[i] not in in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]]:
-            in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]][in_list[i]] = {}
-        elif i == 7 and in_list[i] not in in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]][in_list[6]]:
-            in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]][in_list[6]][in_list[i]] = {}
-        elif i == 8 and in_list[i] not in in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]][in_list[6]][in_list[7]]:
-            in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]][in_list[6]][in_list[7]][in_list[i]] = {}
-        elif i == 9 and in_list[i] not in in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]][in_list[6]][in_list[7]][in_list[8]]:
-            in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]][in_list[6]][in_list[7]][in_list[8]][in_list[i]] = {}
-        elif i == 10 and in_list[i] not in in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]][in_list[6]][in_list[7]][in_list[8]][in_list[9]]:
-            in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]][in_list[6]][in_list[7]][in_list[8]][in_list[9]][in_list[i]] = {}
-        i += 1
-    return in_dict
-    
-def reconstruct_KEGG_hierarchy(hierarchy_list):
+    Creates the index from the output of parse_KEGG_kterm_db. Returns a dictionary of the k term vocabulary ("ko_names"),
+    the category names ("row_names"), and the arrays "row_dashes", "row_parents", "row_offsets" and "row_kos".
     """
-    Reconstructs the hierarchy list generated by "parse_KEGG_kterm_db" into a branching dictionary 
-    correctly representing the hierarchical structures of categories and subcategories. 
-    
-    The output is a dictionary with multiple levels of dictionaries within dictionary. The key of each dictionary
-    represents a KEGG category while the values represent the subcategories. 
-    """
-    hierarchy_dict = {}
-    #Iterate over each item in the hierarchy list, which each represent the hierarchical categories found for a 
-    #k term
-    for entry in hierarchy_list:
-        #Make temporary list to store potential nestedness
-        temp_list = []
-        for tup in entry:
-            if temp_list != []:
-                #If the number of leading spaces is equal or lesser than previous categories, than this is a new nested group
-                #It'll get a new entry at the lowest level of nestedness
-                if tup[0] <= temp_list[0][0]:
-                    temp_list = []
-                    if tup not in hierarchy_dict:
-                        hierarchy_dict[tup] = {}
-                    temp_list.append(tup)
-                #If the number of leading spaces is not equal or lesser than all previous categories, then it is part of the nested
-                #group of previous tuples. Check at which level of nestedness by comparing leading spaces against all tuples in the nested list.
-                #A new list is made to replace temp_list, since all nested tuples below the relevant level can be discarded.
-                else:
-                    new_temp_list = []
-                    for item in temp_list:
-                        if item[0] < tup[0]:
-                            new_temp_list.append(item)
-                    temp_list = new_temp_list[:]
-                    #Add the current category to the end of the temp_list, which is it's correct level of nestedness
-                    temp_list.append(tup)
-                    #Make a list of just the category names (without the number of leading spaces) and add them to the dictionary
-                    hierarchy_dict = branching_dict_helper(hierarchy_dict, temp_list)
-            else:
-                if tup not in hierarchy_dict:
-                    hierarchy_dict[tup] = {}
-                temp_list.append(tup)
-    return hierarchy_dict
-
-def eggnog_parser(eggnog_path):
-    """
-    Parses an eggnog.annotations output file. Returns a list of all the found k terms.
-    """
-    out_list = []
-    for line in gen_line_reader(eggnog_path):
-        if line.startswith("#"):
-            continue
-        ko = line.split("\t")[11]
-        #!!!!A comma means there is multiple ko terms. BLASTkoala appears to only save the first one.
-        #This script will include both ko terms
-        if ko == "-":
-            ko = ""
-        elif "," in ko: 
-            for i in ko.split(","):
-                i = i.replace("ko:", "")
-                out_list.append(i)             
-        else:
-            ko = ko.replace("ko:", "")
-            out_list.append(ko)
-    return out_list   
+    path_ids = hierarchy["path_ids"]
+    path_offsets, path_kos = group_values(K_term_paths["entry_paths"], K_term_paths["entry_kos"], len(path_ids) + 1)
+    index = {"ko_names": K_term_paths["ko_names"], "row_names": [], "row_dashes": array.array("i"), "row_parents": array.array("i"),
+             "row_offsets": array.array("I", [0]), "row_kos": array.array("I")}
+    #Row of each node of the hierarchy, to find the parent rows
+    node_rows = array.array("i", [-1]) * len(hierarchy["spaces"])
+    previous_cats = []
+    for node in iterate_hierarchy(hierarchy):
+        leading_spaces = hierarchy["spaces"][node] - 12
+        name_id = hierarchy["name_of"][node]
+        #The k terms of a category are found with the path of the overarching categories, as in output_hierarchical_gene_count
+        while previous_cats and leading_spaces <= previous_cats[-1][0]:
+            previous_cats.pop()
+        parent_path = 0
+        if previous_cats:
+            parent_path = previous_cats[-1][1]
+        path = path_ids[path_key(parent_path, name_id)]
+        previous_cats.append((leading_spaces, path))
+        node_rows[node] = len(index["row_names"])
+        index["row_names"].append(hierarchy["names"][name_id])
+        index["row_dashes"].append(leading_spaces)
+        index["row_parents"].append(node_rows[hierarchy["parents"][node]])
+        index["row_kos"].extend(path_kos[path_offsets[path]:path_offsets[path + 1]])
+        index["row_offsets"].append(len(index["row_kos"]))
+    add_ko_weights(index)
+    return index
 
-def recursive_dict_iteration(dictionary):
+def add_ko_weights(index):
     """
-    Iterates over a dictionary containing multiple levels
-    of nested dictionaries. 
-    
-    Returns a list in which the contained values are the keys and values in the dictionaries, in the 
-    encountered order. This order is the same as what is found left to right if the dictionary was printed. 
-    """
-    out_list = []
-    for key, value in dictionary.items():
-        out_list.append(key)
-        if isinstance(value, dict):
-            for item in recursive_dict_iteration(value):
-                out_list.append(item)
-    return out_list
-    
-def output_hierarchical_gene_count(hierarchy_dict, K_term_dict, K_term_present, outfile):
+    Adds the weights of the k terms per category (see above) to the index, as the arrays "ko_offsets", "ko_rows" and "ko_weights"
+    """
+    rows = len(index["row_names"])
+    row_offsets = index["row_offsets"]
+    row_kos = index["row_kos"]
+    #Subcategories of every category, to subtract their k terms from it
+    child_rows = array.array("I", [row for row in range(rows) if index["row_parents"][row] >= 0])
+    child_offsets, child_rows = group_values(array.array("I", [index["row_parents"][row] for row in child_rows]), child_rows, rows)
+    weight_rows = array.array("I")
+    weight_kos = array.array("I")
+    weights = array.array("i")
+    for row in range(rows):
+        weight_dict = {}
+        for ko in row_kos[row_offsets[row]:row_offsets[row + 1]]:
+            weight_dict[ko] = weight_dict.get(ko, 0) + 1
+        for child in child_rows[child_offsets[row]:child_offsets[row + 1]]:
+            for ko in row_kos[row_offsets[child]:row_offsets[child + 1]]:
+                weight_dict[ko] = weight_dict.get(ko, 0) - 1
+        #Only the nonzero weights are stored
+        for ko, weight in weight_dict.items():
+            if weight != 0:
+                weight_rows.append(row)
+                weight_kos.append(ko)
+                weights.append(weight)
+    #Store the weights per k term
+    index["ko_offsets"], index["ko_rows"] = group_values(weight_kos, weight_rows, len(index["ko_names"]))
+    index["ko_weights"] = group_values(weight_kos, weights, len(index["ko_names"]))[1]
+
+def database_stat(k_term_db):
+    """
+    Returns the size and modification time of the k term database, used to check whether an index is up to date
+    """
+    stat = os.stat(k_term_db)
+    return stat.st_size, stat.st_mtime_ns
+
+def write_brite_index(index_path, index, db_stat):
+    """
+    Writes the index to a file. The file is first written under a temporary name and then renamed,
+    so that jobs started at the same time never read a partially written index.
+    """
+    ko_blob = "\n".join(index["ko_names"]).encode()
+    name_blob = "\n".join(index["row_names"]).encode()
+    temp_path = "{}.{}.tmp".format(index_path, os.getpid())
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(BRITE_INDEX_HEADER.pack(BRITE_INDEX_MAGIC, BRITE_INDEX_VERSION, db_stat[0], db_stat[1], len(index["ko_names"]),
+                                            len(index["row_names"]), len(index["row_kos"]), len(index["ko_rows"]), len(ko_blob), len(name_blob)))
+            for key, typecode, length in BRITE_INDEX_ARRAYS:
+                index[key].tofile(f)
+            f.write(ko_blob)
+            f.write(name_blob)
+        os.replace(temp_path, index_path)
+    except OSError:
+        print("Could not write the BRITE index to {}, continuing without it".format(index_path))
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+
+def read_brite_index(index_path, db_stat):
+    """
+    Maps an index file into memory. Returns the same dictionary as build_brite_index, in which the integer arrays are
+    memoryviews of the file, or None if the index does not match the version of this script or the database.
+    """
+    with open(index_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < BRITE_INDEX_HEADER.size:
+            return None
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, db_size, db_mtime, kos, rows, incidences, weights, ko_bytes, name_bytes = BRITE_INDEX_HEADER.unpack_from(mapped)
+    if magic != BRITE_INDEX_MAGIC or version != BRITE_INDEX_VERSION or (db_size, db_mtime) != db_stat:
+        mapped.close()
+        return None
+    lengths = {"rows": rows, "row_offsets": rows + 1, "row_kos": incidences, "ko_offsets": kos + 1, "weights": weights}
+    view = memoryview(mapped)
+    index = {}
+    position = BRITE_INDEX_HEADER.size
+    for key, typecode, length in BRITE_INDEX_ARRAYS:
+        end = position + lengths[length] * array.array(typecode).itemsize
+        index[key] = view[position:end].cast(typecode)
+        position = end
+    #The names are small compared to the arrays, and are read into lists
+    index["ko_names"] = split_names(view[position:position + ko_bytes])
+    position += ko_bytes
+    index["row_names"] = split_names(view[position:position + name_bytes])
+    return index
+
+def split_names(name_view):
+    """
+    Returns the list of newline separated names in part of an index
+    """
+    if len(name_view) == 0:
+        return []
+    return bytes(name_view).decode().split("\n")
+
+def load_brite_index(k_term_db, index_path=None, use_index=True):
+    """
+    Returns the index of the k term database. The index file (by default the database path followed by ".index") is used
+    as long as the size and modification time of the database match those stored in it. Otherwise, the database is parsed,
+    and the index is rebuilt and written. If use_index is False, the database is always parsed, and no file is read or written.
+    """
+    if index_path is None:
+        index_path = k_term_db + ".index"
+    db_stat = database_stat(k_term_db)
+    if use_index and os.path.isfile(index_path):
+        try:
+            index = read_brite_index(index_path, db_stat)
+        except (OSError, ValueError, struct.error, UnicodeDecodeError):
+            print("Could not read the BRITE index {}, it will be rebuilt".format(index_path))
+            index = None
+        if index is not None:
+            return index
+    K_term_paths, hierarchy = parse_KEGG_kterm_db(k_term_db)
+    index = build_brite_index(K_term_paths, hierarchy)
+    if use_index:
+        write_brite_index(index_path, index, db_stat)
+    return index
+
+def hierarchical_gene_count(index, K_term_present):
+    """
+    Counts per category of the index how many of the associated genes are present in the K_term_present list.
+    Returns a list with the number of found genes per row of the index.
     """
-    Converts the hierarchical dictionary of categories into an ordered list. Per category,
-    finds the associated genes from the K_term_dict, and finds which ones of these are present 
-    using the K_term_present list. Outputs the number of found genes per category to the outfile.
+    K_term_present = set(K_term_present)
+    ko_offsets = index["ko_offsets"]
+    ko_rows = index["ko_rows"]
+    ko_weights = index["ko_weights"]
+    row_parents = index["row_parents"]
+    #Add the weights of the present genes to their categories
+    found = [0] * len(index["row_names"])
+    for ko, kterm in enumerate(index["ko_names"]):
+        if kterm in K_term_present:
+            for i in range(ko_offsets[ko], ko_offsets[ko + 1]):
+                found[ko_rows[i]] += ko_weights[i]
+    #Add the found genes of each category to its parent. Subcategories come after their parent, so going backwards
+    #every category is complete before it is added to its parent
+    for row in range(len(found) - 1, -1, -1):
+        if row_parents[row] >= 0:
+            found[row_parents[row]] += found[row]
+    return found
+
+def write_gene_count(index, found, outfile):
+    """
+    Outputs the number of found genes and the total number of genes per category to the outfile, in hierarchical fashion
     """
     out = open(outfile, "w")
-    #Iterate over the hierarchical dictionary to find the contained items
-    #in the appropriate hierarchical order
-    hierarchical_tup_list = recursive_dict_iteration(hierarchy_dict)
-    #Iterate over this ordered list of categories, checking the associated genes,
-    #and whether these genes are present in the provided EggNOG output. Then write 
-    #this per category
-    previous_cats = []
-    for item in hierarchical_tup_list:
-        leading_spaces = item[0]
-        KEGG_cat = item[1]
-        leading_spaces = leading_spaces - 12
-        #Keep track of previous categories to be able to call the kterm dict in an hierarchical fashion.
-        #This is critical, since otherwise categories with identical names but different hierarchy (eg small subunit in eukaryote and prokaryote ribosomes)
-        #will be counted as the same. 
-        #First remove any category in the previous category list that is not an overarching category
-        new_list = previous_cats[:]
-        for cat in previous_cats:
-            if leading_spaces <= cat[0]:
-                new_list.remove(cat)
-        previous_cats = new_list[:]
-        #Add the current item to the previous cat list
-        previous_cats.append((leading_spaces, KEGG_cat))
-        #Make a temp list of the previous and current category, used to find the corresponding kterms from the dictionary
-        temp_list = []
-        for cat in previous_cats:
-            temp_list.append(cat[1])
-        associated_kterms = K_term_dict[tuple(temp_list)]
-        associated_kterms_present = []
-        for kterm in associated_kterms:
-            if kterm in K_term_present:
-                associated_kterms_present.append(kterm)
-        out.write("{}{}\t{}/{}\n".format((leading_spaces*"-"), item[1], len(associated_kterms_present), len(associated_kterms)))
+    row_offsets = index["row_offsets"]
+    for row, KEGG_cat in enumerate(index["row_names"]):
+        out.write("{}{}\t{}/{}\n".format((index["row_dashes"][row]*"-"), KEGG_cat, found[row], row_offsets[row + 1] - row_offsets[row]))
+    out.close()
+
+def output_hierarchical_gene_count(index, K_term_present, outfile):
+    """
+    Walks the categories of the index in order. Per category, counts how many of the associated genes are
+    present in the K_term_present list. Outputs the number of found genes per category to the outfile.
+    """
+    write_gene_count(index, hierarchical_gene_count(index, K_term_present), outfile)
+
+###################
+#Functions for counting a cohort of annotation files
+###################
+
+def brite_count_matrix(index, K_term_lists):
+    """
+    Counts the found genes per category for several lists of present k terms at once. The k terms of the categories
+    form a sparse category x k term incidence matrix, and the present k terms a sparse k term x sample matrix. Their
+    product holds the number of found genes of every category (rows) for every sample (columns), as a sparse matrix.
+    """
+    rows = len(index["row_names"])
+    kos = len(index["ko_names"])
+    #A k term listed more than once for a category is counted as often, like the totals
+    incidence = sparse.csr_matrix((np.ones(len(index["row_kos"]), dtype=np.int64), np.asarray(index["row_kos"]),
+                                   np.asarray(index["row_offsets"])), shape=(rows, kos))
+    incidence.sum_duplicates()
+    ko_ids = {}
+    for ko, kterm in enumerate(index["ko_names"]):
+        ko_ids[kterm] = ko
+    present_kos = []
+    present_samples = []
+    for sample, K_term_present in enumerate(K_term_lists):
+        for kterm in set(K_term_present):
+            if kterm in ko_ids:
+                present_kos.append(ko_ids[kterm])
+                present_samples.append(sample)
+    presence = sparse.csc_matrix((np.ones(len(present_kos), dtype=np.int64), (present_kos, present_samples)), shape=(kos, len(K_term_lists)))
+    return (incidence @ presence).tocsc()
+
+def output_count_matrix(index, samples, count_matrix, outfile):
+    """
+    Outputs a tab-delimited matrix of the total number of genes and the number of found genes per sample (columns) for every category (rows)
+    """
+    out = open(outfile, "w")
+    out.write("#Category\tTotal\t" + "\t".join(samples) + "\n")
+    count_matrix = count_matrix.tocsr()
+    row_offsets = index["row_offsets"]
+    for row, KEGG_cat in enumerate(index["row_names"]):
+        out.write("{}{}\t{}".format((index["row_dashes"][row]*"-"), KEGG_cat, row_offsets[row + 1] - row_offsets[row]))
+        for count in count_matrix[row].toarray()[0]:
+            out.write("\t{}".format(int(count)))
+        out.write("\n")
+    out.close()
 
 ####################################################################
 #MAIN
@@ -271,13 +491,52 @@ if __name__ == "__main__":
     input_eggnog = sys.argv[1]
     out_file = sys.argv[2]
     k_term_db = sys.argv[3]
-    #Parse the kterms per category into a dictionary
-    K_term_dict, hierarchy_list = parse_KEGG_kterm_db(k_term_db)
-    #Reconstruct the KEGG hierarchy
-    hierarchy_dict = reconstruct_KEGG_hierarchy(hierarchy_list)
-    #Parse the k terms found by EggNOG
-    K_term_present = eggnog_parser(input_eggnog)
-    #Output k terms found per category in hierarchical fashion, in full format
-    output_hierarchical_gene_count(hierarchy_dict,K_term_dict, K_term_present, out_file)
+    #Optional arguments for the BRITE index
+    index_path = None
+    use_index = True
+    if "--index" in sys.argv:
+        index_path = sys.argv[sys.argv.index("--index") + 1]
+    if "--no_index" in sys.argv:
+        use_index = False
+    batch = "--batch" in sys.argv
+    if batch and sparse is None:
+        sys.exit("--batch requires numpy and scipy")
+    #Optional profiling of the run
+    profile = None
+    if "--profile" in sys.argv:
+        profile_path = sys.argv[sys.argv.index("--profile") + 1]
+        profile = profiler.new_profile("KEGGstimate_brite_checker.py")
+    #Map the index of the kterms per category into memory, or parse the database and build the index
+    with profiler.profile_phase(profile, "db_load"):
+        index = load_brite_index(k_term_db, index_path, use_index)
+    if batch:
+        #Parse the k terms of every annotation file, count all samples with a single matrix product, and write
+        #the output of every annotation file, followed by the matrix of all samples
+        with profiler.profile_phase(profile, "annotation_parse"):
+            annotation_files = ap.batch_input_files(input_eggnog)
+            ap.check_unique_file_names(annotation_files)
+            K_term_lists = []
+            for annotation_file in annotation_files:
+                K_term_lists.append(ap.eggnog_parser(annotation_file))
+        with profiler.profile_phase(profile, "scoring_and_output"):
+            count_matrix = brite_count_matrix(index, K_term_lists)
+            if not os.path.isdir(out_file):
+                os.makedirs(out_file)
+            samples = []
+            for sample, annotation_file in enumerate(annotation_files):
+                write_gene_count(index, count_matrix[:, sample].toarray()[:, 0],
+                                 os.path.join(out_file, os.path.basename(annotation_file) + "_pathway_and_BRITE"))
+                #The sample is named as in the tables of KEGGstimate_tsv_maker.py
+                samples.append(os.path.basename(annotation_file).partition(".emapper")[0])
+            output_count_matrix(index, samples, count_matrix, os.path.join(out_file, "BRITE_count_matrix.tsv"))
+    else:
+        #Parse the k terms found by EggNOG
+        with profiler.profile_phase(profile, "annotation_parse"):
+            K_term_present = ap.eggnog_parser(input_eggnog)
+        #Output k terms found per category in hierarchical fashion, in full format
+        with profiler.profile_phase(profile, "scoring_and_output"):
+            output_hierarchical_gene_count(index, K_term_present, out_file)
+    if profile is not None:
+        profiler.write_profile(profile, profile_path, k_term_db)
     
     
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Calculates the KEGG module completion of the union of the k terms of genome pairs (and optionally of chosen groups of
+genomes), for example to find which pathways a symbiont and its host, or the members of a co-culture, complete together.
+Rather than running the module checker on concatenated annotation files for every pair, the k terms of each genome are
+stored as a row of bits per module, one bit per gene in the module. The union of a pair is the OR of two rows, and all
+pairs are evaluated in blocks with the matrix functions of KEGGstimate_module_matrix.py, only keeping what is needed for the completion.
+
+Requires numpy. KEGGstimate_module_checker.py and KEGGstimate_module_matrix.py need to be in the same directory as this script.
+
+Usage: (python) KEGGstimate_consortium.py input_dir_or_list output_dir path/to/KEGG_module_db [arguments]
+
+The input is a directory containing .emapper.annotations files, or a text file listing them (one per line).
+Genomes are named after their annotation file, up to ".emapper".
+
+Optional arguments:
+    --groups: Tab-delimited file with a group per line: the group name, and a comma-separated list of its genomes
+    --cache: Path of the compiled module cache. Default is the module database path followed by ".compiled"
+    --no_cache: Always read and compile the module database, without reading or writing the cache
+
+Output:
+consortium_genome_completion.tsv: the completion of each genome (columns) by itself per module (rows).
+consortium_pair_gains.tsv: the pairs of genomes (each pair once) for which the union of their k terms completes a module
+further than either genome by itself, with the completion of both genomes and of the pair. For every pair not listed, the
+completion of the pair is that of the more complete genome, so this list holds the genome x genome matrix of every module
+without writing the N x N values that add nothing.
+consortium_complementary_pairs.tsv: the pairs of genomes completing a module together that neither completes by itself.
+With --groups, consortium_group_completion.tsv: the highest completion of the union of each group (columns) per module (rows).
+"""
+###################
+#Import statements
+###################
+
+import sys
+import os
+import numpy as np
+import KEGGstimate_module_checker as mc
+import KEGGstimate_annotation_parser as ap
+import KEGGstimate_module_matrix as mm
+
+###################
+#Functions for the k term bitsets
+###################
+
+def sample_name(annotation_file):
+    """
+    Returns the name of a genome, as used in the tables of KEGGstimate_tsv_maker.py
+    """
+    return os.path.basename(annotation_file).partition(".emapper")[0]
+
+def module_columns(compiled_module):
+    """
+    Returns a dictionary with the column of every gene of a compiled module
+    """
+    gene_set = set()
+    mc.tree_genes(compiled_module["tree"], gene_set)
+    columns = {}
+    for gene in sorted(gene_set):
+        columns[gene] = len(columns)
+    return columns
+
+def module_bitsets(kterms_sets, columns):
+    """
+    Creates a boolean matrix with a row per genome, holding which genes of a module (the columns) the genome has
+    """
+    matrix = np.zeros((len(kterms_sets), len(columns)), dtype=bool)
+    for gene, column in columns.items():
+        for row, kterms_set in enumerate(kterms_sets):
+            if gene in kterms_set:
+                matrix[row, column] = True
+    return matrix
+
+def read_groups(groups_path, samples):
+    """
+    Reads the groups file. Returns a list of (group name, [row of every genome in the group]).
+    """
+    rows = {}
+    for row, sample in enumerate(samples):
+        rows[sample] = row
+    out_list = []
+    for line in mc.gen_line_reader(groups_path):
+        if line.startswith("#") or not line.strip():
+            continue
+        group, tab, members = line.rstrip("\n").partition("\t")
+        member_rows = []
+        for member in members.split(","):
+            if member.strip() not in rows:
+                sys.exit("Genome {} of group {} is not among the annotation files".format(member.strip(), group))
+            member_rows.append(rows[member.strip()])
+        out_list.append((group, member_rows))
+    return out_list
+
+###################
+#Functions for the union completion
+###################
+
+#Largest number of genome pairs evaluated at once
+PAIR_BLOCK_ROWS = 4096
+
+def union_completion(module_name, compiled_module, union_matrix, columns):
+    """
+    Returns an array with the highest completion of the module for every row of union_matrix,
+    or -1.0 for rows without any combination of essential genes
+    """
+    if not compiled_module["exact"]:
+        #Fall back on the single genome functions, which enumerate the combinations for these modules
+        out_array = np.full(union_matrix.shape[0], -1.0)
+        for row in range(union_matrix.shape[0]):
+            kterms_list = []
+            for gene, column in columns.items():
+                if union_matrix[row, column]:
+                    kterms_list.append(gene)
+            result = mc.compiled_completion_checker({module_name: compiled_module}, kterms_list).get(module_name)
+            if result is not None:
+                out_array[row] = result[0]
+        return out_array
+    P = mm.evaluate_matrix_completion(compiled_module["tree"], union_matrix, columns)
+    n = np.arange(P.shape[0])[:, None]
+    completion = np.where((P >= 0) & (n > 0), P / np.maximum(n, 1), -1.0)
+    return completion.max(axis=0)
+
+def pair_blocks(genomes, block_rows=PAIR_BLOCK_ROWS):
+    """
+    Generator giving the pairs of different genomes (i, j) with j > i in blocks, as a tuple of two arrays (i, j). Every block
+    holds all partners of one or more consecutive genomes i, and at most block_rows pairs unless a single genome has more partners.
+    """
+    start = 0
+    while start < genomes - 1:
+        end = start + 1
+        rows = genomes - start - 1
+        while end < genomes - 1 and rows + genomes - end - 1 <= block_rows:
+            rows += genomes - end - 1
+            end += 1
+        first = np.repeat(np.arange(start, end), genomes - np.arange(start, end) - 1)
+        second = np.concatenate([np.arange(i + 1, genomes) for i in range(start, end)])
+        yield first, second
+        start = end
+
+def genome_completion(module_name, compiled_module, kterms_sets, columns=None):
+    """
+    Calculates the completion of the module for each genome by itself. Returns an array with a value per genome,
+    where -1.0 means there is no combination of essential genes.
+    """
+    if columns is None:
+        columns = module_columns(compiled_module)
+    return union_completion(module_name, compiled_module, module_bitsets(kterms_sets, columns), columns)
+
+def pair_gains(module_name, compiled_module, kterms_sets, genome_array, columns=None):
+    """
+    Generator giving the pairs of genomes whose union completes the module further than both genomes by itself, given the
+    genome_array of genome_completion. The pairs are evaluated in blocks (see pair_blocks), and per block a tuple of three
+    arrays is given: the first genome, the second genome and the completion of the pair. Since the pairs are not kept,
+    memory use does not grow with the square of the number of genomes.
+    """
+    if columns is None:
+        columns = module_columns(compiled_module)
+    matrix = module_bitsets(kterms_sets, columns)
+    for first, second in pair_blocks(len(kterms_sets)):
+        completion = union_completion(module_name, compiled_module, matrix[first] | matrix[second], columns)
+        gain = completion > np.maximum(genome_array[first], genome_array[second])
+        yield first[gain], second[gain], completion[gain]
+
+def group_completion(module_name, compiled_module, kterms_sets, group_list, columns=None):
+    """
+    Calculates the completion of the module for the union of every group of genomes. Returns an array with a value per group.
+    """
+    if columns is None:
+        columns = module_columns(compiled_module)
+    matrix = module_bitsets(kterms_sets, columns)
+    union_matrix = np.zeros((len(group_list), len(columns)), dtype=bool)
+    for row, group in enumerate(group_list):
+        union_matrix[row] = matrix[group[1]].any(axis=0)
+    return union_completion(module_name, compiled_module, union_matrix, columns)
+
+###################
+#Output functions
+###################
+
+def pair_gain_lines(module_name, samples, genome_array, first_array, second_array, completion_array):
+    """
+    Returns the lines of consortium_pair_gains.tsv for a block of pairs of a module, as given by pair_gains
+    """
+    out_list = []
+    for first, second, completion in zip(first_array.tolist(), second_array.tolist(), completion_array.tolist()):
+        out_list.append("{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(module_name.partition(" ")[0], module_name.partition(" ")[2], samples[first],
+                        samples[second], float(genome_array[first]), float(genome_array[second]), completion))
+    return out_list
+
+def complementary_pairs(module_name, samples, genome_array, first_array, second_array, completion_array):
+    """
+    Returns the lines of consortium_complementary_pairs.tsv for a block of pairs of a module, as given by pair_gains:
+    the pairs of genomes that complete the module together, while neither genome completes it by itself
+    """
+    out_list = []
+    #The pairs complete the module further than both genomes, so a complete pair is never completed by either genome alone
+    for first, second, completion in zip(first_array.tolist(), second_array.tolist(), completion_array.tolist()):
+        if completion == 1:
+            out_list.append("{}\t{}\t{}\t{}\t{}\t{}\n".format(module_name.partition(" ")[0], module_name.partition(" ")[2], samples[first],
+                            samples[second], float(genome_array[first]), float(genome_array[second])))
+    return out_list
+
+####################################################################
+#MAIN
+####################################################################
+if __name__ == "__main__":
+    #Obtain inputs
+    eggnog_input = sys.argv[1]
+    outdir = sys.argv[2]
+    KEGG_db = sys.argv[3]
+    cache_path = None
+    use_cache = True
+    if "--cache" in sys.argv:
+        cache_path = sys.argv[sys.argv.index("--cache") + 1]
+    if "--no_cache" in sys.argv:
+        use_cache = False
+    #Load the compiled modules, and the k terms of every annotation file
+    compiled_dict = mc.load_compiled_db(KEGG_db, cache_path, use_cache)[0]
+    annotation_files = ap.batch_input_files(eggnog_input)
+    ap.check_unique_file_names(annotation_files)
+    samples = []
+    kterms_sets = []
+    for annotation_file in annotation_files:
+        samples.append(sample_name(annotation_file))
+        kterms_sets.append(set(ap.eggnog_parser(annotation_file)))
+    group_list = []
+    if "--groups" in sys.argv:
+        group_list = read_groups(sys.argv[sys.argv.index("--groups") + 1], samples)
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    #Calculate and write the completion of every genome, pair (and group) per module
+    genomes_out = open(os.path.join(outdir, "consortium_genome_completion.tsv"), "w")
+    genomes_out.write("#Module\t" + "\t".join(samples) + "\n")
+    gains_out = open(os.path.join(outdir, "consortium_pair_gains.tsv"), "w")
+    gains_out.write("#Entry\tName\tGenome_1\tGenome_2\tCompletion_1\tCompletion_2\tPair_completion\n")
+    pairs_out = open(os.path.join(outdir, "consortium_complementary_pairs.tsv"), "w")
+    pairs_out.write("#Entry\tName\tGenome_1\tGenome_2\tCompletion_1\tCompletion_2\n")
+    if group_list:
+        groups_out = open(os.path.join(outdir, "consortium_group_completion.tsv"), "w")
+        groups_out.write("#Module\t" + "\t".join(group[0] for group in group_list) + "\n")
+    for module_name in compiled_dict:
+        columns = module_columns(compiled_dict[module_name])
+        genome_array = genome_completion(module_name, compiled_dict[module_name], kterms_sets, columns)
+        #Modules without any combination of essential genes are left out, as by the module checker
+        if (genome_array < 0).all():
+            continue
+        genomes_out.write(module_name + "".join("\t{}".format(float(value)) for value in genome_array) + "\n")
+        for first_array, second_array, completion_array in pair_gains(module_name, compiled_dict[module_name], kterms_sets, genome_array, columns):
+            for line in pair_gain_lines(module_name, samples, genome_array, first_array, second_array, completion_array):
+                gains_out.write(line)
+            for line in complementary_pairs(module_name, samples, genome_array, first_array, second_array, completion_array):
+                pairs_out.write(line)
+        if group_list:
+            group_array = group_completion(module_name, compiled_dict[module_name], kterms_sets, group_list, columns)
+            groups_out.write(module_name + "".join("\t{}".format(float(value)) for value in group_array) + "\n")
+    genomes_out.close()
+    gains_out.close()
+    pairs_out.close()
+    if group_list:
+        groups_out.close()
@@ -0,0 +1,1016 @@
+#!/usr/bin/env python3
+"""
+Checks that faster engines of the module and BRITE checkers give byte-identical output to the reference implementations.
+The reference and each candidate engine are run on the same module database, annotation files and (optionally) k term
+database. Their _KEGG_completion.tsv, _KEGG_complete_modules.tsv and _pathway_and_BRITE files are compared line by line,
+and the mismatches and the speedup of each engine over the reference are reported.
+
+Module engines:
+    reference: the module checker functions before the module definitions were compiled into trees, kept in this script,
+               checking every combination
+    compiled: compiled_completion_checker, as used by KEGGstimate_module_checker.py by default
+    best_first: pathway_completion_checker with the best-first search
+    matrix: KEGGstimate_module_matrix.py, if numpy is installed
+BRITE engines:
+    reference: the BRITE checker functions before the KEGG hierarchy was stored as a prefix tree, kept in this script
+    trie: KEGGstimate_brite_checker.py, parsing the k term database
+    index: KEGGstimate_brite_checker.py, using the BRITE index next to the k term database (built if it does not exist yet)
+
+Usage: (python) KEGGstimate_equivalence.py input_dir_or_list output_dir path/to/KEGG_module_db [arguments]
+
+The input is a directory containing .emapper.annotations files, or a text file listing them (one per line).
+
+Usage without KEGG data: (python) KEGGstimate_equivalence.py output_dir --synthetic [arguments]
+
+With --synthetic, a module database and annotation files are generated in output_dir/synthetic_corpus with the generators of
+KEGGstimate_benchmark.py: modules of several nesting depths and numbers of alternatives, with non-essential genes.
+
+Optional arguments:
+    --brite_db: Path of the KEGG k term database. If given, the BRITE engines are compared as well
+    --engines: Comma-separated list of the candidate engines to run. Default is all available engines
+    --write_golden: Directory to store the reference output (and its run time) as golden output
+    --golden: Compare against the golden output in the given directory, rather than running the reference
+    --json: Also write the report as JSON to the given file
+    --synthetic: Generate the module database and annotation files, rather than reading them (see above)
+    --seed: Seed of the random generator of --synthetic. Default is 1
+    --genomes: Number of annotation files generated by --synthetic. Default is 3
+
+Output:
+The output of each engine is written to a subdirectory of the output directory named after the engine.
+A report is printed listing per engine the run time, speedup, and mismatching lines. The exit status is 1 if any
+engine does not match the reference.
+
+KEGGstimate_module_checker.py, KEGGstimate_brite_checker.py and KEGGstimate_annotation_parser.py need to be in the same
+directory, and KEGGstimate_benchmark.py for --synthetic.
+"""
+###################
+#Import statements
+###################
+
+import sys
+import os
+import time
+import json
+import copy
+import shutil
+import random
+import KEGGstimate_module_checker as mc
+import KEGGstimate_brite_checker as bc
+import KEGGstimate_annotation_parser as ap
+try:
+    import KEGGstimate_module_matrix as mm
+except ImportError:
+    mm = None
+try:
+    import KEGGstimate_benchmark as bm
+except ImportError:
+    bm = None
+
+###################
+#Reference BRITE functions
+###################
+
+#The functions of KEGGstimate_brite_checker.py before the KEGG hierarchy was stored as a prefix tree. They are kept unchanged here
+#as the reference the BRITE engines are compared with.
+
+def parse_KEGG_kterm_db(k_term_db):
+    """
+    Reads provided file and creates a list of all KEGG entries
+    within. 
+    """
+    #Initiate variables
+    K_term_dict = {}
+    hierarchy_list = []
+    entry = False
+    read = False
+    temp_list = []
+    k_term_temp_list = []
+    #Iterate over each line in the database
+    for line in bc.gen_line_reader(k_term_db):
+        #Parse out the K term from the entry line
+        if line.startswith("ENTRY"):
+            entry = line.split()[1]
+            read = False
+            if temp_list != []:
+                hierarchy_list.append(temp_list)
+                temp_list = []
+                k_term_temp_list = []
+        #Only read once the read variable is true, which happens only in the BRITE section
+        if read:
+            #Ignore the lines that starts with the entry itself
+            if line.strip().startswith(entry):
+                continue
+            leading_spaces = bc.leading_space_counter(line)
+            KEGG_cat = line.strip()
+            #Enzyme category has the fewest leading spaces, making it seem like an all-encompassing category during parsing. 
+            #This can be resolved by adding an additional leading space
+            if line.strip().startswith("0"):
+                leading_spaces = leading_spaces - 1
+            #Per entry, create a list of tuples (temp_list) that is added to the "hierarchy_list". Each tuple
+            #will be (number of leading spaces, KEGG category). This information will be used downstream
+            #to reconstruct the KEGG hierarchy
+            temp_list.append((leading_spaces, line.strip()))
+            #maintain a list of previous overarching categories so that kterms will be stored in the dictionary accounting for 
+            #category hierarchy. This is necessary for categories with identical names, but different hierarchies. (eg small subunit in eukaryote and prokaryote ribosomes)
+            new_list = k_term_temp_list[:]
+            for cat in k_term_temp_list:
+                if leading_spaces <= cat[0]:
+                    new_list.remove(cat)
+            k_term_temp_list = new_list[:]
+            #Add the current item to the previous cat list
+            k_term_temp_list.append((leading_spaces, KEGG_cat))
+            #Make a temp list of the previous and current category, used to find the corresponding kterms from the dictionary
+            new_list = []
+            for cat in k_term_temp_list:
+                new_list.append(cat[1])
+            if tuple(new_list) not in K_term_dict:
+                K_term_dict[tuple(new_list)] = [entry]
+            else:
+                K_term_dict[tuple(new_list)].append(entry)
+        if line.startswith("BRITE"):
+            read = True
+    
+    if temp_list != []:
+        hierarchy_list.append(temp_list)
+    return K_term_dict, hierarchy_list
+
+
+def branching_dict_helper(in_dict, in_list):
+    """
+    Helper function to create an empty branching dictionary, used to store branching hierarchy. 
+    
+    Note:
+    I am aware there exist more elegant recursive solutions. However, I do not fully understand their logic,
+    and thus chose to instead implement a more direct solution which will function exactly as I expect. At the time 
+    of writing (18-10-24), the highest level of nestedness in the KEGG entries is 5. This function can deal with 
+    a level of nestedness of 10, which is unlikely to ever occur. Therefore, while this solution is sub-optimal, 
+    it should be quite robust. 
+    """
+    i = 0
+    while i < len(in_list): #Highest level of nestedness is 5, so will do 10 levels to be sure
+        if i == 0 and in_list[i] not in in_dict:
+            in_dict[in_list[i]] = {}
+        elif i == 1 and in_list[i] not in in_dict[in_list[0]]:
+            in_dict[in_list[0]][in_list[i]] = {}
+        elif i == 2 and in_list[i] not in in_dict[in_list[0]][in_list[1]]:
+            in_dict[in_list[0]][in_list[1]][in_list[i]] = {}
+        elif i == 3 and in_list[i] not in in_dict[in_list[0]][in_list[1]][in_list[2]]:
+            in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[i]] = {}
+        elif i == 4 and in_list[i] not in in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]]:
+            in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[i]] = {}
+        elif i == 5 and in_list[i] not in in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]]:
+            in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[i]] = {}
+        elif i == 6 and in_list[i] not in in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]]:
+            in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]][in_list[i]] = {}
+        elif i == 7 and in_list[i] not in in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]][in_list[6]]:
+            in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]][in_list[6]][in_list[i]] = {}
+        elif i == 8 and in_list[i] not in in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]][in_list[6]][in_list[7]]:
+            in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]][in_list[6]][in_list[7]][in_list[i]] = {}
+        elif i == 9 and in_list[i] not in in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]][in_list[6]][in_list[7]][in_list[8]]:
+            in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]][in_list[6]][in_list[7]][in_list[8]][in_list[i]] = {}
+        elif i == 10 and in_list[i] not in in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]][in_list[6]][in_list[7]][in_list[8]][in_list[9]]:
+            in_dict[in_list[0]][in_list[1]][in_list[2]][in_list[3]][in_list[4]][in_list[5]][in_list[6]][in_list[7]][in_list[8]][in_list[9]][in_list[i]] = {}
+        i += 1
+    return in_dict
+    
+def reconstruct_KEGG_hierarchy(hierarchy_list):
+    """
+    Reconstructs the hierarchy list generated by "parse_KEGG_kterm_db" into a branching dictionary 
+    correctly representing the hierarchical structures of categories and subcategories. 
+    
+    The output is a dictionary with multiple levels of dictionaries within dictionary. The key of each dictionary
+    represents a KEGG category while the values represent the subcategories. 
+    """
+    hierarchy_dict = {}
+    #Iterate over each item in the hierarchy list, which each represent the hierarchical categories found for a 
+    #k term
+    for entry in hierarchy_list:
+        #Make temporary list to store potential nestedness
+        temp_list = []
+        for tup in entry:
+            if temp_list != []:
+                #If the number of leading spaces is equal or lesser than previous categories, than this is a new nested group
+                #It'll get a new entry at the lowest level of nestedness
+                if tup[0] <= temp_list[0][0]:
+                    temp_list = []
+                    if tup not in hierarchy_dict:
+                        hierarchy_dict[tup] = {}
+                    temp_list.append(tup)
+                #If the number of leading spaces is not equal or lesser than all previous categories, then it is part of the nested
+                #group of previous tuples. Check at which level of nestedness by comparing leading spaces against all tuples in the nested list.
+                #A new list is made to replace temp_list, since all nested tuples below the relevant level can be discarded.
+                else:
+                    new_temp_list = []
+                    for item in temp_list:
+                        if item[0] < tup[0]:
+                            new_temp_list.append(item)
+                    temp_list = new_temp_list[:]
+                    #Add the current category to the end of the temp_list, which is it's correct level of nestedness
+                    temp_list.append(tup)
+                    #Make a list of just the category names (without the number of leading spaces) and add them to the dictionary
+                    hierarchy_dict = branching_dict_helper(hierarchy_dict, temp_list)
+            else:
+                if tup not in hierarchy_dict:
+                    hierarchy_dict[tup] = {}
+                temp_list.append(tup)
+    return hierarchy_dict
+
+def recursive_dict_iteration(dictionary):
+    """
+    Iterates over a dictionary containing multiple levels
+    of nested dictionaries. 
+    
+    Returns a list in which the contained values are the keys and values in the dictionaries, in the 
+    encountered order. This order is the same as what is found left to right if the dictionary was printed. 
+    """
+    out_list = []
+    for key, value in dictionary.items():
+        out_list.append(key)
+        if isinstance(value, dict):
+            for item in recursive_dict_iteration(value):
+                out_list.append(item)
+    return out_list
+    
+def output_hierarchical_gene_count(hierarchy_dict, K_term_dict, K_term_present, outfile):
+    """
+    Converts the hierarchical dictionary of categories into an ordered list. Per category,
+    finds the associated genes from the K_term_dict, and finds which ones of these are present 
+    using the K_term_present list. Outputs the number of found genes per category to the outfile.
+    """
+    out = open(outfile, "w")
+    #Iterate over the hierarchical dictionary to find the contained items
+    #in the appropriate hierarchical order
+    hierarchical_tup_list = recursive_dict_iteration(hierarchy_dict)
+    #Iterate over this ordered list of categories, checking the associated genes,
+    #and whether these genes are present in the provided EggNOG output. Then write 
+    #this per category
+    previous_cats = []
+    for item in hierarchical_tup_list:
+        leading_spaces = item[0]
+        KEGG_cat = item[1]
+        leading_spaces = leading_spaces - 12
+        #Keep track of previous categories to be able to call the kterm dict in an hierarchical fashion.
+        #This is critical, since otherwise categories with identical names but different hierarchy (eg small subunit in eukaryote and prokaryote ribosomes)
+        #will be counted as the same. 
+        #First remove any category in the previous category list that is not an overarching category
+        new_list = previous_cats[:]
+        for cat in previous_cats:
+            if leading_spaces <= cat[0]:
+                new_list.remove(cat)
+        previous_cats = new_list[:]
+        #Add the current item to the previous cat list
+        previous_cats.append((leading_spaces, KEGG_cat))
+        #Make a temp list of the previous and current category, used to find the corresponding kterms from the dictionary
+        temp_list = []
+        for cat in previous_cats:
+            temp_list.append(cat[1])
+        associated_kterms = K_term_dict[tuple(temp_list)]
+        associated_kterms_present = []
+        for kterm in associated_kterms:
+            if kterm in K_term_present:
+                associated_kterms_present.append(kterm)
+        out.write("{}{}\t{}/{}\n".format((leading_spaces*"-"), item[1], len(associated_kterms_present), len(associated_kterms)))
+
+###################
+#Reference module functions
+###################
+
+#The functions of KEGGstimate_module_checker.py before the module definitions were tokenized and compiled into trees, which
+#list every combination by rewriting the brackets of the definitions. They are kept here as the reference the module engines
+#are compared with, so that a change to the parser shared by the engines shows up as a mismatch. eggnog_parser is also used
+#by the BRITE reference. They are unchanged, except that KEGG_module_reader no longer prints every module name, and for the
+#three corrections made together with the single-pass parser (marked "Correction" below): a repeated bracket group is no
+#longer collapsed, a space before a minus no longer adds an empty gene, and a minus before brackets marks every gene inside
+#as non-essential.
+
+def KEGG_module_reader(KEGG_module_file_path):
+    """
+    Reads a database of KEGG module definitions and outputs a dictionary
+    where the key is "Modulenumber Modulename" and the value is the definition.
+    
+    Since some modules have multiple definitions, the value is given as a list.
+    """
+    KEGG_dict = {}
+    name = False
+    for line in mc.gen_line_reader(KEGG_module_file_path):
+        if line.startswith("#"):
+            continue
+        if not line.strip():
+            continue
+        if line.startswith("Module:"):
+            name = line.partition("Module:")[2].strip()
+            if name not in KEGG_dict:
+                KEGG_dict[name] = []
+        if line.startswith("Definition:"):
+            KEGG_dict[name].append(line.partition("Definition:")[2].strip())
+    return KEGG_dict
+
+def output_tsv(outputname, output_dict, minimum_completion):
+    """
+    Outputs a tsv containing per column the module name, the highest completion 
+    found for the module (as a fraction 0-1), and the k numbers of the genes that 
+    comprise this highest completion.
+    """
+    out = open(outputname, "w")
+    out.write("#Entry\tName\tHighest_completion\tMost_complete_pathway\tNon-essential_genes_found\n")
+    for modulename in output_dict:
+        if float(output_dict[modulename][0]) >= float(minimum_completion):
+            out.write("{}\t{}\t{}\t".format(modulename.partition(" ")[0], modulename.partition(" ")[2],output_dict[modulename][0]))
+            out.write(",".join(output_dict[modulename][1]))
+            out.write("\t")
+            if len(output_dict[modulename][2]) > 0:
+                out.write(",".join(output_dict[modulename][2]))
+            else:
+                out.write("None")
+            out.write("\n")
+    out.close()
+
+def eggnog_parser(eggnog_path):
+    """
+    Parses an eggnog.annotations output file. Returns a list of all the found k terms.
+    """
+    out_list = []
+    for line in mc.gen_line_reader(eggnog_path):
+        if line.startswith("#"):
+            continue
+        ko = line.split("\t")[11]
+        #!!!!A comma means there is multiple ko terms. BLASTkoala appears to only save the first one.
+        #This script will include both ko terms
+        if ko == "-":
+            ko = ""
+        elif "," in ko: 
+            for i in ko.split(","):
+                i = i.replace("ko:", "")
+                out_list.append(i)             
+        else:
+            ko = ko.replace("ko:", "")
+            out_list.append(ko)
+    return out_list
+
+#Wrapper for KEGG definition parsing
+def retrieve_all_possible_pathways(KEGG_definition):
+    """
+    Finds the different possible combinations of genes that complete the module in the KEGG_definition
+    """
+    final_list = [[]]
+    #The "for reaction" structure is required since sometimes KEGG gives 2 definitions for the same module. 
+    #It seems these are merging pathways required to for example generate substrates. Therefore, they will be treated as prerequisites for completion.
+    for reaction in KEGG_definition:
+        #Pluses and dashes are functionally the same
+        if " " in reaction:
+            reaction = reaction.replace(" ", "+")
+        #Minuses denote non-essential genes. They will be considered here for calculating the gene combinations
+        #but their absence will not count as pathway incompletion later. 
+        if "-" in reaction:
+            reaction = reaction.replace("-", "+")
+        #To deal with nested brackets, first find the possible combination WITHIN each bracket, so these
+        #can then be substituted into the appropriate brackets when parsing the complete definitions.
+        #These possible combinations are put into poss_dict
+        poss_dict = {}
+        if "(" in reaction:
+            #If there is brackets in the definition, first find the possibilities contained therein.
+            poss_dict = find_bracket_possibilities(reaction)
+        #Parse the different pathways
+        poss_list = parse_possibilities(reaction, poss_dict)
+        temp_list = []
+        for option in final_list:
+            for poss in poss_list:
+                new_option = option[:] + poss
+                temp_list.append(new_option)
+        final_list = temp_list[:]   
+    return final_list
+
+#Wrapper for parsing (nested) brackets
+def find_bracket_possibilities(KEGG_definition):
+    """
+    Finds all (nested) brackets, and iterates through each level of brackets to find the possibilties.
+    Returns a completed dictionary of possibilities for the lowest level of brackets, which can be used to 
+    analyze the KEGG_definition
+    """
+    #Finds the brackets and their level of nestedness
+    brackets_list = find_bracket_contents(KEGG_definition)
+    #Find the highest level of nested brackets
+    highest = 0
+    for element in brackets_list:
+        if element[0] > highest:
+            highest = element[0]
+    poss_dict = {}
+    #Iterate over each bracket level
+    #For each bracket, make a list of lists representing each possible option and store them in the poss_dict
+    for level in reversed(range(highest+1)):
+        #iterate over each bracket pair in the KEGG definition
+        for bracket_pair in brackets_list:
+            #starting at the highest level of brackets, start searching for options
+            if bracket_pair[0] == level:
+                poss_dict["({})".format(bracket_pair[1])] = parse_possibilities(bracket_pair[1],poss_dict)
+    return poss_dict
+
+#Main parsing function    
+def parse_possibilities(string, poss_dict):
+    """
+    Returns a list of lists, representing the options possible in the string
+    according to the KEGG definitions. 
+    
+    Utilizes the poss_dict to resolve brackets
+    """
+    #To prevent parsing mistakes, replace brackets with empty brackets.
+    #The removed contents of the brackets are present in the bracket_list,
+    #in the order that they occur in the string
+    bracket_list = []
+    if "(" in string:
+        string, bracket_list  = empty_brackets(string)
+    #If the string has commas in it, it is a bracketed substring. Comma's will take priority
+    #over plusses and spaces, and will thus be considered first    
+    if "," in string:
+        option_list = []
+        for alternative in string.split(","):
+            if alternative == "":
+                continue
+            elif "+" in alternative:
+                poss_list = parse_pluses(alternative, bracket_list, poss_dict)
+                #Since considered parts are separated by commas, each combination in the poss_list here 
+                #denotes a branching path ALTERNATIVE to the other parts of the string being parsed here.
+                #Therefore, add each possibility as a separate one to the option_list
+                for poss in poss_list:
+                    option_list.append(poss)     
+            elif alternative == "()":
+                #Again, since this is in a comma string, each possibility is an entirely different option
+                bracket_possibilities = parse_bracket_possibilities(bracket_list.pop(0), poss_dict)
+                for poss in bracket_possibilities:
+                    option_list.append(poss)     
+            #If there is only spaces, simply add the genes to existing options
+            else:
+                option_list.append([alternative])
+    #If there is no commas in the string, then it is only comprised of additions.
+    #simply add each addition, and add the options contained in each bracket
+    else:
+        option_list = [[]]
+        for addition in string.split("+"):
+            if addition == "":
+                continue
+            elif addition == "()":
+                poss_list = parse_bracket_possibilities(bracket_list.pop(0), poss_dict)
+                temp_list = []
+                for poss in poss_list:
+                    for option in option_list:
+                        new_option = option[:]
+                        for item in poss:
+                            new_option.append(item)   
+                        temp_list.append(new_option)
+                option_list = temp_list[:]        
+            #If there is only spaces, simply add the genes to existing options
+            else:
+                if len(option_list) == 0:
+                    option_list = []
+                for option in option_list:
+                    option.append(addition)
+    return option_list
+
+#Secondary functions    
+def parse_pluses(plus_string, bracket_list, poss_dict):
+    """
+    Parses a plus-containing substring found in brackets, or between 
+    comma's. 
+    
+    Returns a list of lists where each nested list represents a possible combination
+    of genes following the KEGG definition
+    """
+    out_list = [[]]
+    for part in plus_string.split("+"):
+        #Correction 2: a space before a minus gives two pluses in a row, which is not an empty gene
+        if part == "":
+            continue
+        #If a part of the pluses are brackets, remove them and add the possibilities contained
+        if part == "()":
+            bracket_possibilities = parse_bracket_possibilities(bracket_list.pop(0), poss_dict)
+            temp_list = []
+            for poss in bracket_possibilities:
+                for option in out_list:
+                    new_option = option[:]
+                    for item in poss:
+                        new_option.append(item)   
+                    temp_list.append(new_option)
+            out_list = temp_list[:]        
+        #If there is no brackets, simply add each part of the chain of pluses as a an addition to the existing combinations
+        else:
+            temp_list = []
+            for option in out_list:
+                new_option = option[:]
+                new_option.append(part)   
+                temp_list.append(new_option)
+            out_list = temp_list[:]   
+    return out_list
+
+def find_bracket_pairs(string):
+    """
+    Returns a dictionary for each bracket pair, where the first bracket
+    is the dict key, and the second is the value
+    """
+    match_bracket_index_dict = {}
+    stack_list = []
+    for index, char in enumerate(string):
+        if char == "(":
+            stack_list.append(index)
+        elif char == ")":
+            match_bracket_index_dict[stack_list.pop()] = index
+    return dict(sorted(match_bracket_index_dict.items()))
+    #return match_bracket_index_dict
+
+def find_bracket_contents(string):
+    """
+    returns a list of tuples for each bracket pair in the string.
+    Each tuple contains (bracket nestedness level, bracket contents).
+    """
+    stack = []
+    bracket_list = []
+    out_dict = {}
+    for index, char in enumerate(string):
+        if char == '(':
+            stack.append(index)
+        elif char == ')' and stack:
+            start = stack.pop()
+            bracket_list.append((len(stack), string[start + 1: index]))
+    return bracket_list
+
+def parse_bracket_possibilities(bracket_string, poss_dict):
+    """
+    If brackets are found, tries to find them in the poss_dict to give 
+    the options they represent. The options are not added to an option list
+    since from the brackets itself its impossible to tell if it is an addition or
+    a branch.
+    """
+    if bracket_string in poss_dict:
+        return poss_dict[bracket_string]
+    else:
+        print("Error, could not find {} in poss_dict".format(bracket_string))
+
+def empty_brackets(string):
+    """
+    Returns the provided string, but with the brackets replaced with empty brackets. In addition, 
+    returns a list containing the removed bracketed contents, so these can be retrieved later from 
+    the poss_dict
+    
+    Only considers the lowest level of bracket present, assuming nested brackets are already included in 
+    its possibilities
+    """
+    out_list = []
+    #Make dictionary of bracket pairs
+    bracket_dict = find_bracket_pairs(string)
+    #Only consider the lowest level of brackets, ignoring any nested ones
+    lowest_list = []
+    for key in bracket_dict:
+        lower_exists = False
+        for key2 in bracket_dict:
+            if key > key2 and bracket_dict[key] < bracket_dict[key2]:
+                lower_exists = True
+        if not lower_exists:
+            lowest_list.append(key)
+    #Store the lowest brackets in the out_list, so they can be called later
+    for key in lowest_list:
+        out_list.append(string[key:bracket_dict[key]+1])
+    #Replace the lowest level brackets with empty brackets
+    for key in reversed(lowest_list):
+        #Correction 1: replaced by position, since str.replace also replaced other copies of a repeated bracket group
+        string = string[:key] + "()" + string[bracket_dict[key]+1:]
+    return string, out_list
+
+def non_essential_finder(KEGG_definition):
+    """
+    In KEGG definitions, minuses denote non-essential genes. These will be parsed here, and returned as a list.
+    """
+    out_list = []
+    if "-" in KEGG_definition:
+        #Find all minuses in the string
+        i = 0
+        minus_indices = []
+        while i < len(KEGG_definition):
+            if KEGG_definition[i] == "-":
+                minus_indices.append(i)
+            i+= 1
+        #Find the genes after the minus, counting multiple if they are bracketed. 
+        for i in minus_indices:
+            string = KEGG_definition[i+1:]
+            #If the minus is followed by brackets, inside are all non-essential genes
+            if string.startswith("("):
+                #Correction 3: all genes up to the matching closing bracket, including nested and space-separated ones
+                depth = 0
+                for end, char in enumerate(string):
+                    if char == "(":
+                        depth += 1
+                    elif char == ")":
+                        depth -= 1
+                        if depth == 0:
+                            break
+                string = string[1:end]
+                for char in "() -,":
+                    string = string.replace(char, "+")
+                for plus_split in string.split("+"):
+                    if plus_split:
+                        out_list.append(plus_split)
+            #Several instances of double minuses exist, such as M00814, M00840 or M00890.
+            #Their meaning is unclear, but they do not seem to denote non-essential genes
+            elif string.startswith("-"):
+                continue
+            #If it is not followed by brackets or minus, simply take the gene following the minus
+            else:
+                string = string.partition("+")[0].partition(",")[0].partition(" ")[0].partition("(")[0].partition(")")[0].partition("-")[0]
+                if string.strip():
+                    out_list.append(string)
+    return out_list
+
+def pathway_completion_checker(KEGG_dict, kterms_list):
+    """
+    Uses several functions to find all potential combinations of genes that complete a KEGG module.
+    Then find which of those combinations is most complete for the given genes in kterms_list.
+    
+    Returns a dictionary with the KEGG module name as key, and a tuple as value. The tuple
+    contains the highest completion value found (as a 0-1 float),the combination of genes
+    amounting to that completion as a list, and a list genes missing from the pathway that were still
+    included during completion calculation because they were non-essential: (0.5, [gene1,gene2,gene3], [gene2])
+    """
+    out_dict = {}
+    #Make a dictionary containing lists of all non-essential genes per module
+    non_essential_dict = {}
+    for module_name in KEGG_dict:
+        for reaction in KEGG_dict[module_name]:
+            #Since there can be multiple reactions, check if the dictionary entry already exists, if so append to it
+            if module_name in non_essential_dict:
+                for i in non_essential_finder(reaction):
+                    non_essential_dict[module_name].append(i)
+            else:
+                non_essential_dict[module_name] = non_essential_finder(reaction)
+    #Make a dictionary containing all the possible combinations of genes to complete the pathway
+    for module_name in KEGG_dict:
+        possible_combinations = retrieve_all_possible_pathways(KEGG_dict[module_name])
+        if possible_combinations != [[]]:
+            KEGG_dict[module_name] = possible_combinations
+    #Iterate over the dictionary to check every pathway
+    for module_name in KEGG_dict:
+        #Iterate over each possible combinations, to check which is most complete
+        highest_completion = -1
+        best_pathway = []
+        non_essential_found = []
+        for combination in KEGG_dict[module_name]:
+            gene_is_present = []
+            #Check for each gene in the combination if it non-essential and if it is present in the tested organism
+            for gene in combination:
+                #If the gene is non-essential it will not be counted towards the completion of the combination
+                #While not factored into the calculation, any non-essential gene associated with the module will be mentioned in the output if it was found to be present in the organism
+                if gene in non_essential_dict[module_name]:
+                    if gene in kterms_list and gene not in non_essential_found:
+                        non_essential_found.append(gene)
+                else: 
+                    if gene in kterms_list:
+                        gene_is_present.append(gene)
+            #To accurately calculate the completion of essential genes, non-essential genes are removed from the combination
+            for gene in non_essential_dict[module_name]:
+                if gene in combination:
+                    combination.remove(gene)
+            number_of_genes = len(combination)
+            completion = len(gene_is_present)/number_of_genes
+            if completion > highest_completion:
+                highest_completion = completion
+                best_pathway = gene_is_present[:]
+                out_dict[module_name] = (highest_completion, best_pathway, non_essential_found)
+    return out_dict
+
+###################
+#Synthetic corpus functions
+###################
+
+#Scales of the synthetic corpus, as in KEGGstimate_benchmark.py: (name, number of modules, nesting depth, fan-out, fraction of non-essential genes)
+SYNTHETIC_SCALES = [("shallow", 30, 1, 3, 0.1),
+                    ("nested", 30, 2, 2, 0.15),
+                    ("wide", 20, 1, 5, 0.1)]
+#Largest number of combinations of a synthetic module, so that the reference can check every combination in reasonable time
+SYNTHETIC_MAX_COMBINATIONS = 300
+#Number of k terms drawn from the gene pool of KEGGstimate_benchmark.py per annotation file
+SYNTHETIC_KTERMS = 600
+
+def generate_synthetic_corpus(work_dir, genomes, rnd):
+    """
+    Generates a module database and annotation files with the generators of KEGGstimate_benchmark.py, so that the engines
+    can be compared without KEGG data. Modules with more combinations than SYNTHETIC_MAX_COMBINATIONS are generated again.
+    Besides random k terms, every annotation file carries the first genes of a random half of the modules, so that some
+    modules are complete. Returns a tuple of (module database path, directory of the annotation files).
+    """
+    db_path = os.path.join(work_dir, "synthetic_module_db")
+    annotation_dir = os.path.join(work_dir, "synthetic_annotations")
+    if not os.path.isdir(annotation_dir):
+        os.makedirs(annotation_dir)
+    first_genes = []
+    out = open(db_path, "w")
+    for scale_number, scale in enumerate(SYNTHETIC_SCALES):
+        name, modules, depth, fan_out, optional_rate = scale
+        for i in range(modules):
+            #Every definition starts with a gene used nowhere else, as in KEGGstimate_benchmark.py
+            while True:
+                definitions = []
+                used_set = set()
+                for j in range(rnd.choice([1, 1, 1, 2])):
+                    definitions.append("K8{}{:03d}{} {}".format(scale_number, i, j, bm.generate_expression(rnd, depth, fan_out, optional_rate, used_set)))
+                if mc.compile_module(definitions)["tree"][2] <= SYNTHETIC_MAX_COMBINATIONS:
+                    break
+            out.write("Module: M8{}{:03d} Synthetic {} module {}\n".format(scale_number, i, name, i))
+            for definition in definitions:
+                out.write("Definition: {}\n".format(definition))
+            out.write("Class: Synthetic modules\n")
+            first_genes.append([definition.partition(" ")[0] for definition in definitions])
+    out.close()
+    for genome in range(genomes):
+        annotation_path = os.path.join(annotation_dir, "synthetic_{}.emapper.annotations".format(genome))
+        bm.generate_annotation(annotation_path, SYNTHETIC_KTERMS, rnd)
+        out = open(annotation_path, "a")
+        for module, genes in enumerate(first_genes):
+            if rnd.random() < 0.5:
+                out.write("first_{}\t-\t1e-50\t100\t-\t-\tS\t-\t-\t-\t-\t{}\t-\t-\t-\t-\t-\t-\t-\t-\t-\n".format(module, ",".join("ko:" + gene for gene in genes)))
+        out.close()
+    return db_path, annotation_dir
+
+###################
+#Engine functions
+###################
+
+#Every engine takes the database, the list of annotation files and the output directory, and writes its output
+#for every annotation file to the output directory, using the name of the annotation file as prefix.
+
+def module_outprefix(out_dir, annotation_file):
+    """
+    Returns the output prefix of an annotation file
+    """
+    return os.path.join(out_dir, os.path.basename(annotation_file))
+
+def module_reference(KEGG_db, annotation_files, out_dir):
+    """
+    Module engine running the reference module functions, which check every combination, for every annotation file
+    """
+    KEGG_dict = KEGG_module_reader(KEGG_db)
+    for annotation_file in annotation_files:
+        #pathway_completion_checker replaces the definitions by their combinations, so it is given a copy
+        completion_dict = pathway_completion_checker(copy.deepcopy(KEGG_dict), eggnog_parser(annotation_file))
+        outprefix = module_outprefix(out_dir, annotation_file)
+        output_tsv(outprefix + "_KEGG_completion.tsv", completion_dict, 0)
+        output_tsv(outprefix + "_KEGG_complete_modules.tsv", completion_dict, 1)
+
+def module_compiled(KEGG_db, annotation_files, out_dir):
+    """
+    Module engine evaluating the compiled modules. The compiled module cache is not used, so compiling is included in the time.
+    """
+    compiled_dict, kterm_index = mc.load_compiled_db(KEGG_db, use_cache=False)
+    for annotation_file in annotation_files:
+        completion_dict = mc.compiled_completion_checker(compiled_dict, ap.eggnog_parser(annotation_file), kterm_index)
+        mc.write_completion_output(module_outprefix(out_dir, annotation_file), completion_dict)
+
+def module_best_first(KEGG_db, annotation_files, out_dir):
+    """
+    Module engine using the best-first search
+    """
+    KEGG_dict = mc.KEGG_module_reader(KEGG_db)
+    for annotation_file in annotation_files:
+        completion_dict = mc.pathway_completion_checker(KEGG_dict, ap.eggnog_parser(annotation_file), "best_first")
+        mc.write_completion_output(module_outprefix(out_dir, annotation_file), completion_dict)
+
+def module_matrix(KEGG_db, annotation_files, out_dir):
+    """
+    Module engine evaluating all annotation files at once with KEGGstimate_module_matrix.py
+    """
+    compiled_dict, kterm_index = mc.load_compiled_db(KEGG_db, use_cache=False)
+    kterms_lists = []
+    for annotation_file in annotation_files:
+        kterms_lists.append(ap.eggnog_parser(annotation_file))
+    completion_list = mm.matrix_completion_checker(compiled_dict, kterms_lists, kterm_index)
+    for annotation_file, completion_dict in zip(annotation_files, completion_list):
+        mc.write_completion_output(module_outprefix(out_dir, annotation_file), completion_dict)
+
+def brite_reference(k_term_db, annotation_files, out_dir):
+    """
+    BRITE engine running the reference BRITE functions for every annotation file
+    """
+    K_term_dict, hierarchy_list = parse_KEGG_kterm_db(k_term_db)
+    hierarchy_dict = reconstruct_KEGG_hierarchy(hierarchy_list)
+    for annotation_file in annotation_files:
+        output_hierarchical_gene_count(hierarchy_dict, K_term_dict, eggnog_parser(annotation_file),
+                                       module_outprefix(out_dir, annotation_file) + "_pathway_and_BRITE")
+
+def brite_trie(k_term_db, annotation_files, out_dir):
+    """
+    BRITE engine running the steps of KEGGstimate_brite_checker.py for every annotation file, parsing the database
+    """
+    index = bc.load_brite_index(k_term_db, use_index=False)
+    for annotation_file in annotation_files:
+        bc.output_hierarchical_gene_count(index, ap.eggnog_parser(annotation_file),
+                                          module_outprefix(out_dir, annotation_file) + "_pathway_and_BRITE")
+
+def brite_index(k_term_db, annotation_files, out_dir):
+    """
+    BRITE engine running the steps of KEGGstimate_brite_checker.py for every annotation file, using the index file
+    next to the database (which is built if it does not exist yet)
+    """
+    index = bc.load_brite_index(k_term_db)
+    for annotation_file in annotation_files:
+        bc.output_hierarchical_gene_count(index, ap.eggnog_parser(annotation_file),
+                                          module_outprefix(out_dir, annotation_file) + "_pathway_and_BRITE")
+
+MODULE_ENGINES = {"compiled": module_compiled, "best_first": module_best_first}
+if mm is not None:
+    MODULE_ENGINES["matrix"] = module_matrix
+
+BRITE_ENGINES = {"trie": brite_trie, "index": brite_index}
+
+#Output files written per annotation file by each kind of engine
+MODULE_SUFFIXES = ["_KEGG_completion.tsv", "_KEGG_complete_modules.tsv"]
+BRITE_SUFFIXES = ["_pathway_and_BRITE"]
+
+###################
+#Comparison functions
+###################
+
+#Number of mismatching lines stored per engine
+MAX_MISMATCHES = 50
+
+def run_engine(engine_function, database, annotation_files, out_dir):
+    """
+    Runs an engine, writing to an emptied out_dir. Returns the time in seconds.
+    """
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+    start = time.perf_counter()
+    engine_function(database, annotation_files, out_dir)
+    return time.perf_counter() - start
+
+def compare_outputs(expected_dir, found_dir, annotation_files, suffixes):
+    """
+    Compares the output files of two engines line by line. Returns a tuple of (number of files compared,
+    number of mismatching files, list of mismatches). Each mismatch is a dictionary with the file, line number,
+    and the expected and found line (None if the line is missing).
+    """
+    files = 0
+    mismatched_files = 0
+    mismatch_list = []
+    for annotation_file in annotation_files:
+        for suffix in suffixes:
+            file_name = os.path.basename(annotation_file) + suffix
+            files += 1
+            expected_lines = read_lines(os.path.join(expected_dir, file_name))
+            found_lines = read_lines(os.path.join(found_dir, file_name))
+            if expected_lines == found_lines:
+                continue
+            mismatched_files += 1
+            for i in range(max(len(expected_lines), len(found_lines))):
+                expected = None
+                found = None
+                if i < len(expected_lines):
+                    expected = expected_lines[i]
+                if i < len(found_lines):
+                    found = found_lines[i]
+                if expected != found and len(mismatch_list) < MAX_MISMATCHES:
+                    mismatch_list.append({"file": file_name, "line": i + 1, "expected": expected, "found": found})
+    return files, mismatched_files, mismatch_list
+
+def read_lines(file_path):
+    """
+    Returns the lines of a file, or an empty list if it does not exist
+    """
+    if not os.path.isfile(file_path):
+        return []
+    with open(file_path, "r") as f:
+        return f.read().split("\n")
+
+def print_report(report_dict):
+    """
+    Prints the comparison of every engine with the reference
+    """
+    print("Kind\tEngine\tSeconds\tSpeedup\tFiles\tMismatching_files")
+    for kind in ("module", "brite"):
+        if kind not in report_dict:
+            continue
+        reference_seconds = report_dict[kind]["reference_seconds"]
+        reference_name = "reference"
+        if report_dict[kind]["golden"]:
+            reference_name = "golden"
+        print("{}\t{}\t{}\t1.0\t-\t-".format(kind, reference_name, format_seconds(reference_seconds)))
+        for engine, result in report_dict[kind]["engines"].items():
+            speedup = "-"
+            if reference_seconds is not None and result["seconds"] > 0:
+                speedup = "{:.1f}".format(reference_seconds/result["seconds"])
+            print("{}\t{}\t{}\t{}\t{}\t{}".format(kind, engine, format_seconds(result["seconds"]), speedup, result["files"], result["mismatched_files"]))
+    for kind in ("module", "brite"):
+        if kind not in report_dict:
+            continue
+        for engine, result in report_dict[kind]["engines"].items():
+            for mismatch in result["mismatches"]:
+                print("MISMATCH {} {}: {} line {}\n  expected: {}\n  found:    {}".format(kind, engine, mismatch["file"], mismatch["line"], mismatch["expected"], mismatch["found"]))
+
+def format_seconds(seconds):
+    """
+    Formats a number of seconds for the report, or "-" if unknown
+    """
+    if seconds is None:
+        return "-"
+    return "{:.3f}".format(seconds)
+
+def compare_kind(kind, database, annotation_files, out_dir, engine_dict, reference_function, suffixes, golden_dir, write_golden_dir, engine_names):
+    """
+    Runs (or loads from the golden output) the reference of a kind of engine, then runs and compares every selected
+    candidate engine. Returns a dictionary with the reference time and the results per engine.
+    """
+    golden_times = {}
+    if golden_dir is not None:
+        reference_dir = golden_dir
+        if os.path.isfile(os.path.join(golden_dir, "golden_times.json")):
+            with open(os.path.join(golden_dir, "golden_times.json")) as f:
+                golden_times = json.load(f)
+        reference_seconds = golden_times.get(kind)
+    else:
+        reference_dir = os.path.join(out_dir, kind + "_reference")
+        reference_seconds = run_engine(reference_function, database, annotation_files, reference_dir)
+        if write_golden_dir is not None:
+            write_golden(reference_dir, write_golden_dir, kind, reference_seconds)
+    out_dict = {"golden": golden_dir is not None, "reference_seconds": reference_seconds, "engines": {}}
+    for engine in engine_dict:
+        if engine_names is not None and engine not in engine_names:
+            continue
+        engine_dir = os.path.join(out_dir, kind + "_" + engine)
+        seconds = run_engine(engine_dict[engine], database, annotation_files, engine_dir)
+        files, mismatched_files, mismatch_list = compare_outputs(reference_dir, engine_dir, annotation_files, suffixes)
+        out_dict["engines"][engine] = {"seconds": seconds, "files": files, "mismatched_files": mismatched_files, "mismatches": mismatch_list}
+    #When comparing against the golden output, the reference itself is checked as well
+    if golden_dir is not None:
+        engine_dir = os.path.join(out_dir, kind + "_reference")
+        seconds = run_engine(reference_function, database, annotation_files, engine_dir)
+        files, mismatched_files, mismatch_list = compare_outputs(reference_dir, engine_dir, annotation_files, suffixes)
+        out_dict["engines"]["reference"] = {"seconds": seconds, "files": files, "mismatched_files": mismatched_files, "mismatches": mismatch_list}
+    return out_dict
+
+def write_golden(reference_dir, golden_dir, kind, seconds):
+    """
+    Copies the reference output to the golden directory, and stores the run time of the reference
+    """
+    if not os.path.isdir(golden_dir):
+        os.makedirs(golden_dir)
+    for file_name in os.listdir(reference_dir):
+        shutil.copyfile(os.path.join(reference_dir, file_name), os.path.join(golden_dir, file_name))
+    golden_times = {}
+    times_path = os.path.join(golden_dir, "golden_times.json")
+    if os.path.isfile(times_path):
+        with open(times_path) as f:
+            golden_times = json.load(f)
+    golden_times[kind] = seconds
+    with open(times_path, "w") as out:
+        json.dump(golden_times, out, indent=2)
+        out.write("\n")
+
+####################################################################
+#MAIN
+####################################################################
+if __name__ == "__main__":
+    #Obtain inputs. With --synthetic, only the output directory is given, and the module database and annotation files are generated
+    if "--synthetic" in sys.argv:
+        if bm is None:
+            sys.exit("--synthetic requires KEGGstimate_benchmark.py in the same directory as this script")
+        out_dir = sys.argv[1]
+        seed = 1
+        if "--seed" in sys.argv:
+            seed = int(sys.argv[sys.argv.index("--seed") + 1])
+        genomes = 3
+        if "--genomes" in sys.argv:
+            genomes = int(sys.argv[sys.argv.index("--genomes") + 1])
+        KEGG_db, eggnog_input = generate_synthetic_corpus(os.path.join(out_dir, "synthetic_corpus"), genomes, random.Random(seed))
+    else:
+        eggnog_input = sys.argv[1]
+        out_dir = sys.argv[2]
+        KEGG_db = sys.argv[3]
+    brite_db = None
+    if "--brite_db" in sys.argv:
+        brite_db = sys.argv[sys.argv.index("--brite_db") + 1]
+    engine_names = None
+    if "--engines" in sys.argv:
+        engine_names = sys.argv[sys.argv.index("--engines") + 1].split(",")
+    golden_dir = None
+    if "--golden" in sys.argv:
+        golden_dir = sys.argv[sys.argv.index("--golden") + 1]
+    write_golden_dir = None
+    if "--write_golden" in sys.argv:
+        write_golden_dir = sys.argv[sys.argv.index("--write_golden") + 1]
+    json_path = None
+    if "--json" in sys.argv:
+        json_path = sys.argv[sys.argv.index("--json") + 1]
+    annotation_files = ap.batch_input_files(eggnog_input)
+    ap.check_unique_file_names(annotation_files)
+    #Compare the module engines, and the BRITE engines if the k term database is given
+    report_dict = {}
+    report_dict["module"] = compare_kind("module", KEGG_db, annotation_files, out_dir, MODULE_ENGINES, module_reference,
+                                         MODULE_SUFFIXES, golden_dir, write_golden_dir, engine_names)
+    if brite_db is not None:
+        report_dict["brite"] = compare_kind("brite", brite_db, annotation_files, out_dir, BRITE_ENGINES, brite_reference,
+                                            BRITE_SUFFIXES, golden_dir, write_golden_dir, engine_names)
+    print_report(report_dict)
+    if json_path is not None:
+        with open(json_path, "w") as out:
+            json.dump(report_dict, out, indent=2)
+            out.write("\n")
+    for kind in report_dict:
+        for engine, result in report_dict[kind]["engines"].items():
+            if result["mismatched_files"] > 0:
+                sys.exit(1)
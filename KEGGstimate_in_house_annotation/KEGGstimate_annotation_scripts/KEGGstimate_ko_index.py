@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Builds an inverted index of which samples carry which k terms, over a whole collection of EggNOG annotation files,
+and answers queries such as "which genomes carry K00370" or "which genomes carry both K00370 and K00371" without
+reading the annotation files again. Per k term, the index stores a bitmap with a bit per sample. New annotation files
+are added to an existing index without reading the files already in it.
+
+Usage: (python) KEGGstimate_ko_index.py index_file [arguments]
+
+Optional arguments:
+    --update: Directory containing .emapper.annotations files, or a text file listing them (one per line). Creates the
+              index, or adds the annotation files that are new or changed since the index was written.
+    --threads: Number of processes reading annotation files. Default is the number of available CPUs.
+    --query: Comma-separated list of k terms. Prints the samples carrying all of them (one per line).
+    --any: Print the samples carrying any of the queried k terms instead.
+    --count: Only print the number of samples found.
+
+Samples are named after their annotation file, up to ".emapper", as in the tables of KEGGstimate_tsv_maker.py.
+The k terms of an annotation file are read as by the module checker (including its annotation cache, see
+KEGGstimate_annotation_cache.py). KEGGstimate_annotation_parser.py needs to be in the same directory.
+
+Use from Python:
+    import KEGGstimate_ko_index as ki
+    index = ki.load_ko_index("collection.koindex")
+    print(ki.query_samples(index, ["K00370", "K00371"], "all"))
+"""
+###################
+#Import statements
+###################
+
+import sys
+import os
+import mmap
+import bisect
+import struct
+import multiprocessing
+import KEGGstimate_annotation_parser as ap
+
+###################
+#Index file functions
+###################
+
+#The index file holds a header (see KO_INDEX_HEADER), the samples, the sorted k terms, and a bitmap per k term in the same order.
+#Per sample, its name, annotation file path, and the size and modification time of the annotation file are stored, separated by
+#tabs, one sample per line. The k terms are separated by newlines. Every bitmap takes (number of samples + 7) // 8 bytes, with the
+#bit of sample i at bit i of the little-endian integer. Queries only read the bitmaps of the queried k terms from the mapped file.
+
+#Increase when the format of the index changes
+KO_INDEX_VERSION = 1
+#Magic bytes, version, number of samples, number of k terms, and bytes of the samples and the k terms
+KO_INDEX_HEADER = struct.Struct("=4sIIIII")
+KO_INDEX_MAGIC = b"KKOI"
+
+def sample_name(annotation_file):
+    """
+    Returns the name of a sample, as used in the tables of KEGGstimate_tsv_maker.py
+    """
+    return os.path.basename(annotation_file).partition(".emapper")[0]
+
+def annotation_stat(annotation_file):
+    """
+    Returns the size and modification time of an annotation file, used to find changed files when updating the index
+    """
+    stat = os.stat(annotation_file)
+    return stat.st_size, stat.st_mtime_ns
+
+def bitmap_bytes(samples):
+    """
+    Returns the number of bytes of the bitmap of a k term
+    """
+    return (samples + 7) // 8
+
+def write_ko_index(index_path, samples, bitmaps):
+    """
+    Writes the index. samples is a list of (name, annotation file, size, modification time), and bitmaps a dictionary
+    of {k term: integer with a bit per sample}. The file is first written under a temporary name and then renamed,
+    so that queries never read a partially written index.
+    """
+    sample_blob = "\n".join("{}\t{}\t{}\t{}".format(*sample) for sample in samples).encode()
+    kterms = sorted(bitmaps)
+    ko_blob = "\n".join(kterms).encode()
+    row_bytes = bitmap_bytes(len(samples))
+    temp_path = "{}.{}.tmp".format(index_path, os.getpid())
+    with open(temp_path, "wb") as f:
+        f.write(KO_INDEX_HEADER.pack(KO_INDEX_MAGIC, KO_INDEX_VERSION, len(samples), len(kterms), len(sample_blob), len(ko_blob)))
+        f.write(sample_blob)
+        f.write(ko_blob)
+        for kterm in kterms:
+            f.write(bitmaps[kterm].to_bytes(row_bytes, "little"))
+    os.replace(temp_path, index_path)
+
+def load_ko_index(index_path):
+    """
+    Maps an index file into memory. Returns a dictionary of the samples ("samples", as in write_ko_index), their names
+    ("sample_names"), the sorted k terms ("kterms"), and the bitmaps of all k terms ("bitmaps", a memoryview of the file).
+    """
+    with open(index_path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, sample_count, ko_count, sample_bytes, ko_bytes = KO_INDEX_HEADER.unpack_from(mapped)
+    if magic != KO_INDEX_MAGIC or version != KO_INDEX_VERSION:
+        sys.exit("{} is not a k term index of this version of the script, rebuild it with --update".format(index_path))
+    view = memoryview(mapped)
+    position = KO_INDEX_HEADER.size
+    samples = []
+    if sample_bytes:
+        for line in bytes(view[position:position + sample_bytes]).decode().split("\n"):
+            name, annotation_file, size, mtime = line.split("\t")
+            samples.append((name, annotation_file, int(size), int(mtime)))
+    position += sample_bytes
+    kterms = []
+    if ko_bytes:
+        kterms = bytes(view[position:position + ko_bytes]).decode().split("\n")
+    position += ko_bytes
+    return {"samples": samples, "sample_names": [sample[0] for sample in samples], "kterms": kterms,
+            "row_bytes": bitmap_bytes(sample_count), "bitmaps": view[position:position + ko_count * bitmap_bytes(sample_count)]}
+
+def ko_bitmap(index, kterm):
+    """
+    Returns the bitmap of the samples carrying a k term, as an integer with a bit per sample
+    """
+    row = bisect.bisect_left(index["kterms"], kterm)
+    if row == len(index["kterms"]) or index["kterms"][row] != kterm:
+        return 0
+    row_bytes = index["row_bytes"]
+    return int.from_bytes(index["bitmaps"][row * row_bytes:(row + 1) * row_bytes], "little")
+
+def index_bitmaps(index):
+    """
+    Returns the bitmaps of all k terms in the index, as a dictionary of {k term: integer}
+    """
+    bitmaps = {}
+    for kterm in index["kterms"]:
+        bitmaps[kterm] = ko_bitmap(index, kterm)
+    return bitmaps
+
+###################
+#Query functions
+###################
+
+def query_bitmap(index, kterms, mode="all"):
+    """
+    Returns the bitmap of the samples carrying all (mode "all") or any (mode "any") of the k terms
+    """
+    if mode not in ("all", "any"):
+        raise ValueError("Unknown query mode: {}. Use all or any".format(mode))
+    #Without k terms, mode "all" would match every sample
+    if not kterms:
+        raise ValueError("No k terms given to query")
+    if mode == "all":
+        bitmap = (1 << len(index["samples"])) - 1
+        for kterm in kterms:
+            bitmap &= ko_bitmap(index, kterm)
+    else:
+        bitmap = 0
+        for kterm in kterms:
+            bitmap |= ko_bitmap(index, kterm)
+    return bitmap
+
+def bitmap_samples(index, bitmap):
+    """
+    Returns the names of the samples set in a bitmap, in the order of the index
+    """
+    out_list = []
+    sample = 0
+    while bitmap:
+        if bitmap & 1:
+            out_list.append(index["sample_names"][sample])
+        bitmap >>= 1
+        sample += 1
+    return out_list
+
+def query_samples(index, kterms, mode="all"):
+    """
+    Returns the names of the samples carrying all (mode "all") or any (mode "any") of the k terms
+    """
+    return bitmap_samples(index, query_bitmap(index, kterms, mode))
+
+###################
+#Update functions
+###################
+
+def annotation_kterms(annotation_file):
+    """
+    Returns the set of k terms of an annotation file, as found by the module checker
+    """
+    kterm_set = set()
+    for kterm in ap.eggnog_parser(annotation_file):
+        #The ko column can be the last column of a line, in which case it ends with the newline
+        kterm = kterm.strip()
+        if kterm:
+            kterm_set.add(kterm)
+    return annotation_file, kterm_set
+
+def update_ko_index(index_path, annotation_files, threads=1):
+    """
+    Adds the annotation files to the index, creating it if it does not exist. Files already in the index are only read
+    again if their size or modification time changed. Samples whose annotation file is no longer listed are kept.
+    Returns the number of annotation files read.
+    """
+    samples = []
+    bitmaps = {}
+    if os.path.isfile(index_path):
+        index = load_ko_index(index_path)
+        samples = index["samples"]
+        bitmaps = index_bitmaps(index)
+    sample_ids = {}
+    for sample, sample_info in enumerate(samples):
+        sample_ids[sample_info[1]] = sample
+    #Find the annotation files that are new, or changed since they were added
+    read_files = []
+    for annotation_file in annotation_files:
+        #Files are identified by their absolute path, so that relative and absolute paths to a file are the same sample
+        annotation_file = os.path.abspath(annotation_file)
+        size, mtime = annotation_stat(annotation_file)
+        if annotation_file in sample_ids:
+            sample = sample_ids[annotation_file]
+            if samples[sample][2:] == (size, mtime):
+                continue
+            #Clear the k terms of the old version of a changed file
+            for kterm in bitmaps:
+                bitmaps[kterm] &= ~(1 << sample)
+        else:
+            sample_ids[annotation_file] = len(samples)
+            samples.append(None)
+        samples[sample_ids[annotation_file]] = (sample_name(annotation_file), annotation_file, size, mtime)
+        read_files.append(annotation_file)
+    if not read_files and os.path.isfile(index_path):
+        return 0
+    if threads <= 1 or len(read_files) <= 1:
+        results = map(annotation_kterms, read_files)
+    else:
+        pool = multiprocessing.Pool(threads)
+        results = pool.imap_unordered(annotation_kterms, read_files)
+    for annotation_file, kterm_set in results:
+        bit = 1 << sample_ids[annotation_file]
+        for kterm in kterm_set:
+            bitmaps[kterm] = bitmaps.get(kterm, 0) | bit
+    if threads > 1 and len(read_files) > 1:
+        pool.close()
+        pool.join()
+    #K terms no longer carried by any sample are left out
+    for kterm in [kterm for kterm in bitmaps if bitmaps[kterm] == 0]:
+        del bitmaps[kterm]
+    write_ko_index(index_path, samples, bitmaps)
+    return len(read_files)
+
+####################################################################
+#MAIN
+####################################################################
+if __name__ == "__main__":
+    #Obtain inputs
+    index_path = sys.argv[1]
+    threads = ap.available_threads()
+    if "--threads" in sys.argv:
+        threads = int(sys.argv[sys.argv.index("--threads") + 1])
+    if "--update" in sys.argv:
+        annotation_files = ap.batch_input_files(sys.argv[sys.argv.index("--update") + 1])
+        read_count = update_ko_index(index_path, annotation_files, threads)
+        print("Read {} of {} annotation files into {}".format(read_count, len(annotation_files), index_path))
+    if "--query" in sys.argv:
+        kterms = []
+        for kterm in sys.argv[sys.argv.index("--query") + 1].split(","):
+            if kterm.strip():
+                kterms.append(kterm.strip())
+        if not kterms:
+            sys.exit("--query requires at least one k term")
+        mode = "all"
+        if "--any" in sys.argv:
+            mode = "any"
+        found_samples = query_samples(load_ko_index(index_path), kterms, mode)
+        if "--count" in sys.argv:
+            print(len(found_samples))
+        else:
+            for found_sample in found_samples:
+                print(found_sample)
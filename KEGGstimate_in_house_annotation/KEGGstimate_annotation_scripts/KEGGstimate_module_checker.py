@@ -3,13 +3,39 @@
 Parses the K number from an Eggnog .annotation file. Uses a database of KEGG modules to find 
 all possible combinations of genes that complete the pathway. Using the parsed K number,
 checks which combination is most complete, and gives the highest completion per KEGG module.
+The combinations are compiled into a tree of AND/OR nodes, so the most complete combination 
+is found without listing every combination.
 
-Usage: (python) KEGGsstimate_module_checker input.emapper.annotations Output_prefix path/to/KEGG_module_db
+Usage: (python) KEGGsstimate_module_checker input.emapper.annotations Output_prefix path/to/KEGG_module_db [arguments]
+
+Optional arguments:
+    --cache: Path of the compiled module cache. Default is the module database path followed by ".compiled"
+    --no_cache: Always read and compile the module database, without reading or writing the cache
+    --batch: Batch mode. The first argument is a directory containing .emapper.annotations files, or a text file listing
+             them (one per line). The second argument is the output directory, where the output of each file is written
+             using the annotation file name as prefix.
+    --threads: Number of processes used in batch mode. Default is the number of available CPUs.
+    --shard: In batch mode, only process shard i of N (given as i/N, counting from 1) of the annotation files, divided by
+             file size. The output is written to the subdirectory shard_i_of_N of the output directory, and can be
+             combined with KEGGstimate_shard_merge.py
+    --memo_stats: Report how often results of parts shared between modules were reused
+    --search: Search used outside batch mode: "compiled" (default), "best_first" to stop searching once no remaining
+              combination can be more complete, or "exhaustive" to check every combination
+    --top_k: Also write the given number of most complete combinations with a distinct set of genes per module
+    --marginal_gain: Also write the k terms absent from the genome, ranked by how much they would raise the completion of all modules
+    --incremental: Only recalculate modules whose definition changed since the existing output was written,
+                   or all modules if the k terms of the genome changed
+    --profile: Write the wall time and memory use of each phase, and the modules with the most combinations,
+               as JSON to the given file. See KEGGstimate_profiler.py.
 
 Output:
 Writes a .tsv file following the name: *input.emapper.annotations*_KEGG_completion.tsv. 
 This tsv file contains a column containing the module name, the highest completion found for the module (as a fraction 0-1), 
 and the k numbers of the genes that comprise this highest completion.
+With --top_k, *input.emapper.annotations*_KEGG_top_pathways.tsv lists the most complete combinations per module.
+With --marginal_gain, *input.emapper.annotations*_KEGG_marginal_gain.tsv ranks the absent k terms by their completion gain.
+
+KEGGstimate_annotation_parser.py, which reads the k terms from the annotation files, and KEGGstimate_profiler.py need to be in the same directory.
 """
 ###################
 #Import statements
@@ -17,6 +43,13 @@ and the k numbers of the genes that comprise this highest completion.
 
 import sys
 import os
+import hashlib
+import pickle
+import multiprocessing
+import heapq
+import time
+import KEGGstimate_annotation_parser as ap
+import KEGGstimate_profiler as profiler
 
 ###################
 #File handling functions
@@ -41,7 +74,6 @@ def KEGG_module_reader(KEGG_module_file_path):
             continue
         if line.startswith("Module:"):
             name = line.partition("Module:")[2].strip()
-            print(name)
             if name not in KEGG_dict:
                 KEGG_dict[name] = []
         if line.startswith("Definition:"):
@@ -68,303 +100,767 @@ def output_tsv(outputname, output_dict, minimum_completion):
             out.write("\n")
     out.close()
     
-def eggnog_parser(eggnog_path):
+def write_completion_output(outprefix, completion_dict):
     """
-    Parses an eggnog.annotations output file. Returns a list of all the found k terms.
+    Writes both the completion of all modules and the complete modules, using the output prefix
     """
-    out_list = []
-    for line in gen_line_reader(eggnog_path):
-        if line.startswith("#"):
-            continue
-        ko = line.split("\t")[11]
-        #!!!!A comma means there is multiple ko terms. BLASTkoala appears to only save the first one.
-        #This script will include both ko terms
-        if ko == "-":
-            ko = ""
-        elif "," in ko: 
-            for i in ko.split(","):
-                i = i.replace("ko:", "")
-                out_list.append(i)             
-        else:
-            ko = ko.replace("ko:", "")
-            out_list.append(ko)
-    return out_list
+    output_tsv(outprefix + "_KEGG_completion.tsv", completion_dict, 0)
+    output_tsv(outprefix + "_KEGG_complete_modules.tsv", completion_dict, 1)
+
+def output_top_tsv(outputname, top_dict):
+    """
+    Outputs a tsv listing per module the most complete distinct combinations found by top_pathways_checker, ranked
+    from most to least complete. For each, the genes of the combination found present and missing are given.
+    """
+    out = open(outputname, "w")
+    out.write("#Entry\tName\tRank\tCompletion\tGenes_present\tGenes_missing\n")
+    for modulename in top_dict:
+        for rank, pathway in enumerate(top_dict[modulename]):
+            out.write("{}\t{}\t{}\t{}\t".format(modulename.partition(" ")[0], modulename.partition(" ")[2], rank + 1, pathway[0]))
+            if len(pathway[1]) > 0:
+                out.write(",".join(pathway[1]))
+            else:
+                out.write("None")
+            out.write("\t")
+            if len(pathway[2]) > 0:
+                out.write(",".join(pathway[2]))
+            else:
+                out.write("None")
+            out.write("\n")
+    out.close()
+
     
 ###################
 #Functions for parsing KEGG definitions
-###################  
+###################
+
+#KEGG definitions are parsed in a single pass into a tree of AND/OR nodes. Every node is a tuple: (kind, payload, number of combinations).
+#Kinds are "gene" and "opt" (non-essential gene) for leaves, where the payload is the k term, and "and", "or" and "all" for nodes,
+#where the payload is a tuple of child nodes. "all" joins multiple definitions of the same module.
+#Spaces, pluses and minuses all join genes that are required together, while commas separate alternatives. A minus directly followed by a gene
+#or by brackets marks that gene, or all genes within the brackets, as non-essential.
+
+#Characters that separate the k terms in a KEGG definition
+DEFINITION_SEPARATORS = set("(),+- ")
+
+def tokenize_definition(KEGG_definition):
+    """
+    Splits a KEGG definition into a list of tokens. Each token is either a k term, or one
+    of the separating characters "(", ")", ",", "+", "-" and " ".
+    """
+    tokens = []
+    start = 0
+    for index, char in enumerate(KEGG_definition):
+        if char in DEFINITION_SEPARATORS:
+            if index > start:
+                tokens.append(KEGG_definition[start:index])
+            tokens.append(char)
+            start = index + 1
+    if len(KEGG_definition) > start:
+        tokens.append(KEGG_definition[start:])
+    return tokens
+
+def parse_definition(KEGG_definition):
+    """
+    Parses a single KEGG definition into a tree. Returns the tree, and a list of the non-essential
+    genes in the order in which they occur in the definition.
+    """
+    non_essential_list = []
+    tree, position = parse_group(tokenize_definition(KEGG_definition.strip()), 0, 0, non_essential_list)
+    return tree, non_essential_list
+
+def parse_group(tokens, position, depth, non_essential_list):
+    """
+    Recursive descent parser for a group of a KEGG definition: either the complete definition (depth 0), or the
+    contents of a pair of brackets. Starts at the token after the opening bracket, and returns the node of the
+    group together with the position after the closing bracket. Non-essential genes are added to the non_essential_list.
+    """
+    alternatives = []
+    operands = []
+    optional = False
+    while position < len(tokens):
+        token = tokens[position]
+        position += 1
+        if token == "(":
+            node, position = parse_group(tokens, position, depth + 1, non_essential_list)
+            if optional:
+                tree_gene_list(node, non_essential_list)
+            operands.append(node)
+            optional = False
+        elif token == ")":
+            #A closing bracket without opening bracket is ignored
+            if depth > 0:
+                break
+        elif token == ",":
+            alternatives.append(operands)
+            operands = []
+            optional = False
+        elif token == "-":
+            #Several instances of double minuses exist, such as M00814, M00840 or M00890.
+            #Their meaning is unclear, so the gene following the second minus is considered non-essential
+            optional = True
+        elif token == " " or token == "+":
+            optional = False
+        else:
+            if optional:
+                non_essential_list.append(token)
+            operands.append(("gene", token, 1))
+            optional = False
+    alternatives.append(operands)
+    #Without commas, the group is a single addition of all its genes and brackets
+    if len(alternatives) == 1:
+        return make_node("and", operands), position
+    children = []
+    for operands in alternatives:
+        if len(operands) == 1:
+            children.append(operands[0])
+        elif len(operands) > 1:
+            children.append(make_node("and", operands))
+    return make_node("or", children), position
+
+def make_node(kind, children):
+    """
+    Creates an "and", "or" or "all" node, calculating the number of combinations it represents
+    """
+    children = tuple(children)
+    if kind == "or":
+        count = 0
+        for child in children:
+            count += child[2]
+    else:
+        count = 1
+        for child in children:
+            count = count * child[2]
+    return (kind, children, count)
+
+def tree_gene_list(node, gene_list):
+    """
+    Adds the k terms in the leaves of a tree to the gene_list, in the order in which they occur in the definition
+    """
+    if node[0] == "gene" or node[0] == "opt":
+        gene_list.append(node[1])
+    else:
+        for child in node[1]:
+            tree_gene_list(child, gene_list)
+
+def tree_combinations(node):
+    """
+    Lists every combination of genes represented by the tree as a list of lists. Within a definition,
+    the genes later in the definition change slowest, while of multiple definitions the first one changes slowest.
+    """
+    kind = node[0]
+    if kind == "gene" or kind == "opt":
+        return [[node[1]]]
+    if kind == "or":
+        out_list = []
+        for child in node[1]:
+            for poss in tree_combinations(child):
+                out_list.append(poss)
+        return out_list
+    out_list = [[]]
+    for child in node[1]:
+        child_list = tree_combinations(child)
+        temp_list = []
+        if kind == "and":
+            for poss in child_list:
+                for option in out_list:
+                    temp_list.append(option + poss)
+        else:
+            for option in out_list:
+                for poss in child_list:
+                    temp_list.append(option + poss)
+        out_list = temp_list
+    return out_list
 
 #Wrapper for KEGG definition parsing
 def retrieve_all_possible_pathways(KEGG_definition):
     """
     Finds the different possible combinations of genes that complete the module in the KEGG_definition
     """
-    final_list = [[]]
     #The "for reaction" structure is required since sometimes KEGG gives 2 definitions for the same module. 
     #It seems these are merging pathways required to for example generate substrates. Therefore, they will be treated as prerequisites for completion.
+    definition_nodes = []
     for reaction in KEGG_definition:
-        #Pluses and dashes are functionally the same
-        if " " in reaction:
-            reaction = reaction.replace(" ", "+")
-        #Minuses denote non-essential genes. They will be considered here for calculating the gene combinations
-        #but their absence will not count as pathway incompletion later. 
-        if "-" in reaction:
-            reaction = reaction.replace("-", "+")
-        #To deal with nested brackets, first find the possible combination WITHIN each bracket, so these
-        #can then be substituted into the appropriate brackets when parsing the complete definitions.
-        #These possible combinations are put into poss_dict
-        poss_dict = {}
-        if "(" in reaction:
-            #If there is brackets in the definition, first find the possibilities contained therein.
-            poss_dict = find_bracket_possibilities(reaction)
-        #Parse the different pathways
-        poss_list = parse_possibilities(reaction, poss_dict)
-        temp_list = []
-        for option in final_list:
-            for poss in poss_list:
-                new_option = option[:] + poss
-                temp_list.append(new_option)
-        final_list = temp_list[:]   
-    return final_list
-
-#Wrapper for parsing (nested) brackets
-def find_bracket_possibilities(KEGG_definition):
-    """
-    Finds all (nested) brackets, and iterates through each level of brackets to find the possibilties.
-    Returns a completed dictionary of possibilities for the lowest level of brackets, which can be used to 
-    analyze the KEGG_definition
-    """
-    #Finds the brackets and their level of nestedness
-    brackets_list = find_bracket_contents(KEGG_definition)
-    #Find the highest level of nested brackets
-    highest = 0
-    for element in brackets_list:
-        if element[0] > highest:
-            highest = element[0]
-    poss_dict = {}
-    #Iterate over each bracket level
-    #For each bracket, make a list of lists representing each possible option and store them in the poss_dict
-    for level in reversed(range(highest+1)):
-        #iterate over each bracket pair in the KEGG definition
-        for bracket_pair in brackets_list:
-            #starting at the highest level of brackets, start searching for options
-            if bracket_pair[0] == level:
-                poss_dict["({})".format(bracket_pair[1])] = parse_possibilities(bracket_pair[1],poss_dict)
-    return poss_dict
-
-#Main parsing function    
-def parse_possibilities(string, poss_dict):
-    """
-    Returns a list of lists, representing the options possible in the string
-    according to the KEGG definitions. 
-    
-    Utilizes the poss_dict to resolve brackets
-    """
-    #To prevent parsing mistakes, replace brackets with empty brackets.
-    #The removed contents of the brackets are present in the bracket_list,
-    #in the order that they occur in the string
-    bracket_list = []
-    if "(" in string:
-        string, bracket_list  = empty_brackets(string)
-    #If the string has commas in it, it is a bracketed substring. Comma's will take priority
-    #over plusses and spaces, and will thus be considered first    
-    if "," in string:
-        option_list = []
-        for alternative in string.split(","):
-            if alternative == "":
-                continue
-            elif "+" in alternative:
-                poss_list = parse_pluses(alternative, bracket_list, poss_dict)
-                #Since considered parts are separated by commas, each combination in the poss_list here 
-                #denotes a branching path ALTERNATIVE to the other parts of the string being parsed here.
-                #Therefore, add each possibility as a separate one to the option_list
-                for poss in poss_list:
-                    option_list.append(poss)     
-            elif alternative == "()":
-                #Again, since this is in a comma string, each possibility is an entirely different option
-                bracket_possibilities = parse_bracket_possibilities(bracket_list.pop(0), poss_dict)
-                for poss in bracket_possibilities:
-                    option_list.append(poss)     
-            #If there is only spaces, simply add the genes to existing options
-            else:
-                option_list.append([alternative])
-    #If there is no commas in the string, then it is only comprised of additions.
-    #simply add each addition, and add the options contained in each bracket
+        definition_nodes.append(parse_definition(reaction)[0])
+    return tree_combinations(make_node("all", definition_nodes))
+
+def non_essential_finder(KEGG_definition):
+    """
+    In KEGG definitions, minuses denote non-essential genes. These will be parsed here, and returned as a list.
+    """
+    return parse_definition(KEGG_definition)[1]
+
+###################
+#Functions for compiling KEGG definitions into expression trees
+###################
+
+#Rather than listing every combination of genes, which grows exponentially with the number of comma alternatives, each module
+#is compiled into a single tree in which the non-essential genes are marked. The number of combinations of each node is kept
+#to reproduce the order in which the combinations are listed, so that ties are resolved in the same way as by pathway_completion_checker.
+
+def compile_module(KEGG_definition, intern_dict=None, parse_dict=None):
+    """
+    Compiles the list of definitions of a single module into an expression tree. Returns a dictionary
+    with the tree, the non-essential genes of the module, and whether the tree can be evaluated exactly.
+
+    The tree can not be evaluated exactly when a non-essential gene can occur more often in a single combination
+    than it was listed as non-essential. This is not the case for any module in the KEGG database at the time
+    of writing, but these modules are still supported by falling back on the enumeration of all combinations.
+
+    To share identical parts of the trees between modules, the same intern_dict (see intern_node) and parse_dict
+    (storing the parsed tree of each definition) can be given when compiling every module.
+    """
+    if intern_dict is None:
+        intern_dict = {}
+    if parse_dict is None:
+        parse_dict = {}
+    non_essential_list = []
+    definition_nodes = []
+    for reaction in KEGG_definition:
+        if reaction not in parse_dict:
+            parse_dict[reaction] = parse_definition(reaction)
+        node, non_essential = parse_dict[reaction]
+        definition_nodes.append(node)
+        for i in non_essential:
+            non_essential_list.append(i)
+    non_essential_set = set(non_essential_list)
+    tree = mark_non_essential(make_node("all", definition_nodes), non_essential_set, intern_dict)
+    exact = True
+    for gene in non_essential_set:
+        if max_gene_occurrence(tree, gene) > non_essential_list.count(gene):
+            exact = False
+    compiled_module = {"definition": KEGG_definition, "tree": tree, "non_essential": non_essential_list, "exact": exact,
+                       "hash": definition_hash(KEGG_definition)}
+    #Store the result for a genome without any of the module genes, which is used for modules without hits
+    if exact:
+        compiled_module["empty_result"] = evaluate_compiled_module(compiled_module, set())
+    return compiled_module
+
+def definition_hash(KEGG_definition):
+    """
+    Returns the sha256 hash of the definitions of a module, used to find modules that changed between database versions
+    """
+    return hashlib.sha256("\n".join(KEGG_definition).encode()).hexdigest()
+
+def mark_non_essential(node, non_essential_set, intern_dict):
+    """
+    Returns a copy of the tree in which the leaves of non-essential genes are "opt" leaves. As in
+    pathway_completion_checker, a gene marked non-essential anywhere in the module is non-essential everywhere.
+    """
+    if node[0] == "gene" or node[0] == "opt":
+        if node[1] in non_essential_set:
+            return intern_node(("opt", node[1], 1), intern_dict)
+        return intern_node(("gene", node[1], 1), intern_dict)
+    children = []
+    for child in node[1]:
+        children.append(mark_non_essential(child, non_essential_set, intern_dict))
+    return intern_node((node[0], tuple(children), node[2]), intern_dict)
+
+def intern_node(node, intern_dict):
+    """
+    Returns the single shared copy of the node. Nodes are interned from the leaves up, so identical (sub)trees in
+    different modules become the same object. This way they are stored once, and evaluate_node can reuse their results.
+    """
+    if node[0] == "gene" or node[0] == "opt":
+        key = node
     else:
-        option_list = [[]]
-        for addition in string.split("+"):
-            if addition == "":
-                continue
-            elif addition == "()":
-                poss_list = parse_bracket_possibilities(bracket_list.pop(0), poss_dict)
-                temp_list = []
-                for poss in poss_list:
-                    for option in option_list:
-                        new_option = option[:]
-                        for item in poss:
-                            new_option.append(item)   
-                        temp_list.append(new_option)
-                option_list = temp_list[:]        
-            #If there is only spaces, simply add the genes to existing options
-            else:
-                if len(option_list) == 0:
-                    option_list = []
-                for option in option_list:
-                    option.append(addition)
-    return option_list
+        #The children are already interned, so they can be identified by their id
+        key = (node[0], tuple(id(child) for child in node[1]))
+    if key not in intern_dict:
+        intern_dict[key] = node
+    return intern_dict[key]
 
-#Secondary functions    
-def parse_pluses(plus_string, bracket_list, poss_dict):
+def max_gene_occurrence(node, gene):
     """
-    Parses a plus-containing substring found in brackets, or between 
-    comma's. 
-    
-    Returns a list of lists where each nested list represents a possible combination
-    of genes following the KEGG definition
+    Returns the highest number of times the gene can occur in a single combination of the tree
     """
-    out_list = [[]]
-    for part in plus_string.split("+"):
-        #If a part of the pluses are brackets, remove them and add the possibilities contained
-        if part == "()":
-            bracket_possibilities = parse_bracket_possibilities(bracket_list.pop(0), poss_dict)
-            temp_list = []
-            for poss in bracket_possibilities:
-                for option in out_list:
-                    new_option = option[:]
-                    for item in poss:
-                        new_option.append(item)   
-                    temp_list.append(new_option)
-            out_list = temp_list[:]        
-        #If there is no brackets, simply add each part of the chain of pluses as a an addition to the existing combinations
-        else:
-            temp_list = []
-            for option in out_list:
-                new_option = option[:]
-                new_option.append(part)   
-                temp_list.append(new_option)
-            out_list = temp_list[:]   
+    kind = node[0]
+    if kind == "gene" or kind == "opt":
+        if node[1] == gene:
+            return 1
+        return 0
+    occurrences = []
+    for child in node[1]:
+        if child[2] > 0:
+            occurrences.append(max_gene_occurrence(child, gene))
+    if kind == "or":
+        return max(occurrences, default=0)
+    return sum(occurrences)
+
+def tree_genes(node, gene_set):
+    """
+    Adds all the k terms in the leaves of a compiled tree to the gene_set
+    """
+    if node[0] == "gene" or node[0] == "opt":
+        gene_set.add(node[1])
+    else:
+        for child in node[1]:
+            tree_genes(child, gene_set)
+
+def build_kterm_index(compiled_dict):
+    """
+    Creates an inverted index of the compiled modules: a dictionary where the key is a k term,
+    and the value a list of the modules containing this k term (as essential or non-essential gene)
+    """
+    kterm_index = {}
+    for module_name in compiled_dict:
+        gene_set = set()
+        tree_genes(compiled_dict[module_name]["tree"], gene_set)
+        for gene in gene_set:
+            if gene not in kterm_index:
+                kterm_index[gene] = []
+            kterm_index[gene].append(module_name)
+    return kterm_index
+
+def compile_KEGG_modules(KEGG_dict):
+    """
+    Compiles all modules in the dictionary made by KEGG_module_reader
+    """
+    compiled_dict = {}
+    intern_dict = {}
+    parse_dict = {}
+    for module_name in KEGG_dict:
+        compiled_dict[module_name] = compile_module(KEGG_dict[module_name], intern_dict, parse_dict)
+    return compiled_dict
+
+###################
+#Functions for caching the compiled module database
+###################
+
+#Increase when the format of the compiled modules changes, so that older cache files are rebuilt
+COMPILED_DB_VERSION = 5
+
+def file_hash(file_path):
+    """
+    Returns the sha256 hash of the contents of a file
+    """
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1048576), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def load_compiled_db(KEGG_db, cache_path=None, use_cache=True, profile=None):
+    """
+    Returns the compiled modules of the KEGG module database, and the k term to module index made by build_kterm_index.
+    These are stored in a binary cache file (by default the database path followed by ".compiled"), which is used as long as
+    the hash of the database matches the hash stored in the cache. Otherwise, the database is read and compiled, and the cache is rewritten.
+    If a profile is given, reading the database (or cache) and compiling it are recorded as separate phases.
+    """
+    if cache_path is None:
+        cache_path = KEGG_db + ".compiled"
+    with profiler.profile_phase(profile, "db_load"):
+        db_hash = file_hash(KEGG_db)
+        cache = None
+        if use_cache and os.path.isfile(cache_path):
+            try:
+                with open(cache_path, "rb") as f:
+                    cache = pickle.load(f)
+                if cache["version"] != COMPILED_DB_VERSION or cache["hash"] != db_hash:
+                    cache = None
+            except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError):
+                print("Could not read the compiled module cache {}, it will be rebuilt".format(cache_path))
+                cache = None
+        if cache is None:
+            KEGG_dict = KEGG_module_reader(KEGG_db)
+    if cache is not None:
+        return cache["modules"], cache["index"]
+    with profiler.profile_phase(profile, "combination_expansion"):
+        compiled_dict = compile_KEGG_modules(KEGG_dict)
+        kterm_index = build_kterm_index(compiled_dict)
+    if use_cache:
+        write_compiled_db(cache_path, compiled_dict, kterm_index, db_hash)
+    return compiled_dict, kterm_index
+
+def write_compiled_db(cache_path, compiled_dict, kterm_index, db_hash):
+    """
+    Writes the compiled modules to the cache file. The file is first written under a temporary name and then renamed,
+    so that jobs started at the same time never read a partially written cache.
+    """
+    temp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+    try:
+        with open(temp_path, "wb") as f:
+            pickle.dump({"version": COMPILED_DB_VERSION, "hash": db_hash, "modules": compiled_dict, "index": kterm_index}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        print("Could not write the compiled module cache to {}, continuing without it".format(cache_path))
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+
+###################
+#Functions for evaluating compiled expression trees
+###################
+
+#Rather than checking every combination, each node keeps the best option per number of essential genes.
+#Per node this is a dictionary: {number of essential genes: (number present, combination index, genes present)}
+#Since identical parts of modules are the same (interned) node, these dictionaries can be stored in a memo and reused
+#for every module containing the node. The memo is a dictionary: {"nodes": {id of node: result}, "hits": 0, "misses": 0}
+#The combination index is the position of the combination in the order of pathway_completion_checker,
+#and is used to keep the first combination found when two are equally complete.
+
+def new_memo():
+    """
+    Returns an empty memo for evaluate_node. A memo is only valid for a single set of k terms.
+    """
+    return {"nodes": {}, "hits": 0, "misses": 0}
+
+def evaluate_node(node, kterms_set, memo=None):
+    """
+    Returns the best options of the node for the given set of k terms, as a dictionary where the key
+    is the number of essential genes, and the value a tuple of (genes present, combination index, list of genes present).
+    If a memo is given, results of earlier evaluated (shared) nodes are reused.
+    """
+    kind = node[0]
+    if kind == "opt":
+        return {0: (0, 0, ())}
+    if kind == "gene":
+        if node[1] in kterms_set:
+            return {1: (1, 0, (node[1],))}
+        return {1: (0, 0, ())}
+    if memo is not None:
+        if id(node) in memo["nodes"]:
+            memo["hits"] += 1
+            return memo["nodes"][id(node)]
+        memo["misses"] += 1
+    if kind == "or":
+        out_dict = {}
+        offset = 0
+        for child in node[1]:
+            for n, option in evaluate_node(child, kterms_set, memo).items():
+                if n not in out_dict or option[0] > out_dict[n][0]:
+                    out_dict[n] = (option[0], offset + option[1], option[2])
+            offset += child[2]
+        if memo is not None:
+            memo["nodes"][id(node)] = out_dict
+        return out_dict
+    #"and" and "all" nodes combine the options of every child. Within a definition the later genes are enumerated
+    #in the outer loop, whereas multiple definitions are enumerated with the first definition in the outer loop.
+    out_dict = {0: (0, 0, ())}
+    count = 1
+    for child in node[1]:
+        child_dict = evaluate_node(child, kterms_set, memo)
+        new_dict = {}
+        for n1, option1 in out_dict.items():
+            for n2, option2 in child_dict.items():
+                present = option1[0] + option2[0]
+                if kind == "and":
+                    index = option2[1] * count + option1[1]
+                else:
+                    index = option1[1] * child[2] + option2[1]
+                n = n1 + n2
+                if n not in new_dict or present > new_dict[n][0] or (present == new_dict[n][0] and index < new_dict[n][1]):
+                    new_dict[n] = (present, index, option1[2] + option2[2])
+        out_dict = new_dict
+        count = count * child[2]
+    if memo is not None:
+        memo["nodes"][id(node)] = out_dict
+    return out_dict
+
+def non_essential_present(node, kterms_set):
+    """
+    Lists the non-essential genes of the tree that are present in the kterms_set, in the order in which
+    pathway_completion_checker would encounter them.
+    """
+    found_list = []
+    find_non_essential_leaves(node, kterms_set, 0, 1, found_list)
+    #Sort by the first combination containing the gene, then by the position in the definition
+    found_list.sort(key=lambda x: (x[0], x[1]))
+    out_list = []
+    for found in found_list:
+        if found[2] not in out_list:
+            out_list.append(found[2])
     return out_list
 
-def find_bracket_pairs(string):
+def find_non_essential_leaves(node, kterms_set, first_index, multiplier, found_list):
     """
-    Returns a dictionary for each bracket pair, where the first bracket
-    is the dict key, and the second is the value
+    Recursively finds the present non-essential leaves of the tree. For each, stores a tuple of
+    (index of the first combination containing the leaf, position of the leaf, gene) in the found_list.
     """
-    match_bracket_index_dict = {}
-    stack_list = []
-    for index, char in enumerate(string):
-        if char == "(":
-            stack_list.append(index)
-        elif char == ")":
-            match_bracket_index_dict[stack_list.pop()] = index
-    return dict(sorted(match_bracket_index_dict.items()))
-    #return match_bracket_index_dict
+    kind = node[0]
+    if node[2] == 0:
+        return
+    if kind == "opt":
+        if node[1] in kterms_set:
+            found_list.append((first_index, len(found_list), node[1]))
+        return
+    if kind == "gene":
+        return
+    if kind == "or":
+        offset = 0
+        for child in node[1]:
+            find_non_essential_leaves(child, kterms_set, first_index + offset * multiplier, multiplier, found_list)
+            offset += child[2]
+    elif kind == "and":
+        for child in node[1]:
+            find_non_essential_leaves(child, kterms_set, first_index, multiplier, found_list)
+            multiplier = multiplier * child[2]
+    else:
+        later_count = node[2]
+        for child in node[1]:
+            later_count = later_count // child[2]
+            find_non_essential_leaves(child, kterms_set, first_index, multiplier * later_count, found_list)
 
-def find_bracket_contents(string):
+def evaluate_compiled_module(compiled_module, kterms_set, memo=None):
     """
-    returns a list of tuples for each bracket pair in the string.
-    Each tuple contains (bracket nestedness level, bracket contents).
+    Finds the most complete combination of a compiled module. Returns the same tuple as
+    pathway_completion_checker: (completion, [genes present], [non-essential genes present]),
+    or None if the module has no combination of essential genes.
     """
-    stack = []
-    bracket_list = []
-    out_dict = {}
-    for index, char in enumerate(string):
-        if char == '(':
-            stack.append(index)
-        elif char == ')' and stack:
-            start = stack.pop()
-            bracket_list.append((len(stack), string[start + 1: index]))
-    return bracket_list
-
-def parse_bracket_possibilities(bracket_string, poss_dict):
-    """
-    If brackets are found, tries to find them in the poss_dict to give 
-    the options they represent. The options are not added to an option list
-    since from the brackets itself its impossible to tell if it is an addition or
-    a branch.
-    """
-    if bracket_string in poss_dict:
-        return poss_dict[bracket_string]
+    highest_completion = -1
+    best_index = 0
+    best_pathway = []
+    for n, option in evaluate_node(compiled_module["tree"], kterms_set, memo).items():
+        if n == 0:
+            continue
+        completion = option[0]/n
+        if completion > highest_completion or (completion == highest_completion and option[1] < best_index):
+            highest_completion = completion
+            best_index = option[1]
+            best_pathway = list(option[2])
+    if highest_completion == -1:
+        return None
+    return (highest_completion, best_pathway, non_essential_present(compiled_module["tree"], kterms_set))
+
+###################
+#Functions for the best-first search of combinations
+###################
+
+#Rather than walking every combination in order, partial combinations are kept in a priority queue, ordered by an upper bound
+#of the completion they can still reach, and then by the index of their first combination. The first complete combination taken
+#from the queue is therefore the one pathway_completion_checker would select: the search stops as soon as a completion of 1.0 is
+#found, or when no partial combination left in the queue can beat it.
+#A partial combination is a tuple of all genes and nodes of a combination in the order of the definition. Each has the weight of
+#its choices in the combination index. The node with the highest weight is chosen first, so that partial combinations are split
+#on the choices that matter most to the combination index, and the first of equally complete combinations is found directly.
+
+def bound_node(node, kterms_set, bound_dict):
+    """
+    Returns an upper bound of the completion of any combination of the node, as a tuple of (most genes present,
+    fewest essential genes, highest completion). The highest completion is -1 if no combination has essential genes.
+    Bounds of (shared) nodes are stored in the bound_dict, which is only valid for a single set of k terms.
+    """
+    kind = node[0]
+    if kind == "opt":
+        return (0, 0, -1)
+    if kind == "gene":
+        if node[1] in kterms_set:
+            return (1, 1, 1.0)
+        return (0, 1, 0.0)
+    if id(node) in bound_dict:
+        return bound_dict[id(node)]
+    present = None
+    essential = None
+    completion = -1
+    for child in node[1]:
+        if child[2] == 0:
+            continue
+        child_bound = bound_node(child, kterms_set, bound_dict)
+        if present is None:
+            present = child_bound[0]
+            essential = child_bound[1]
+        elif kind == "or":
+            present = max(present, child_bound[0])
+            essential = min(essential, child_bound[1])
+        else:
+            present += child_bound[0]
+            essential += child_bound[1]
+        #The completion of a combination of parts is never higher than the highest completion of its parts
+        completion = max(completion, child_bound[2])
+    if present is None:
+        present = 0
+        essential = 0
+    if essential > 0:
+        completion = min(completion, present/essential)
+    bound_dict[id(node)] = (present, essential, completion)
+    return bound_dict[id(node)]
+
+def is_leaf(node):
+    """
+    Returns whether the node is a gene or non-essential gene
+    """
+    return node[0] == "gene" or node[0] == "opt"
+
+def bound_partial(pending, present, essential, kterms_set, bound_dict):
+    """
+    Returns the upper bound of the completion of a partial combination, or -1 if none of its combinations has essential genes.
+    The genes of the partial combination are already counted in present and essential.
+    """
+    completion = -1
+    if essential > 0:
+        completion = present/essential
+    for node, weight in pending:
+        if is_leaf(node):
+            continue
+        node_bound = bound_node(node, kterms_set, bound_dict)
+        present += node_bound[0]
+        essential += node_bound[1]
+        completion = max(completion, node_bound[2])
+    if essential > 0:
+        completion = min(completion, present/essential)
+    return completion
+
+def choose_partial_node(pending):
+    """
+    Returns the position of the node with the highest weight in the partial combination, or -1 if it only contains genes
+    """
+    position = -1
+    for i in range(len(pending)):
+        if not is_leaf(pending[i][0]) and (position == -1 or pending[i][1] > pending[position][1]):
+            position = i
+    return position
+
+def expand_partial(pending, position, index):
+    """
+    Chooses the node at the position in a partial combination. Returns a list of (pending nodes, index, added nodes) tuples:
+    one per child of an "or" node, or a single one in which an "and" or "all" node is replaced by its children.
+    """
+    node, weight = pending[position]
+    before = pending[:position]
+    after = pending[position + 1:]
+    kind = node[0]
+    if kind == "or":
+        out_list = []
+        offset = 0
+        for child in node[1]:
+            if child[2] > 0:
+                out_list.append((before + ((child, weight),) + after, index + offset * weight, (child,)))
+            offset += child[2]
+        return out_list
+    children = []
+    if kind == "and":
+        #Within a definition the later genes are enumerated in the outer loop
+        for child in node[1]:
+            children.append((child, weight))
+            weight = weight * child[2]
     else:
-        print("Error, could not find {} in poss_dict".format(bracket_string))
+        #Of multiple definitions the first one is enumerated in the outer loop
+        later_count = node[2]
+        for child in node[1]:
+            later_count = later_count // child[2]
+            children.append((child, weight * later_count))
+    return [(before + tuple(children) + after, index, node[1])]
 
-def empty_brackets(string):
+def best_first_combinations(tree, kterms_set, bound_dict=None):
     """
-    Returns the provided string, but with the brackets replaced with empty brackets. In addition, 
-    returns a list containing the removed bracketed contents, so these can be retrieved later from 
-    the poss_dict
-    
-    Only considers the lowest level of bracket present, assuming nested brackets are already included in 
-    its possibilities
+    Generator yielding the combinations of the tree from most to least complete, where equally complete combinations
+    are yielded in the order of pathway_completion_checker. Combinations without essential genes are skipped.
+    Yields a tuple of (completion, combination index, genes present, genes missing) per combination.
+    Only the queue of partial combinations is kept in memory, so the combinations are never all listed.
     """
-    out_list = []
-    #Make dictionary of bracket pairs
-    bracket_dict = find_bracket_pairs(string)
-    #Only consider the lowest level of brackets, ignoring any nested ones
-    lowest_list = []
-    for key in bracket_dict:
-        lower_exists = False
-        for key2 in bracket_dict:
-            if key > key2 and bracket_dict[key] < bracket_dict[key2]:
-                lower_exists = True
-        if not lower_exists:
-            lowest_list.append(key)
-    #Store the lowest brackets in the out_list, so they can be called later
-    for key in lowest_list:
-        out_list.append(string[key:bracket_dict[key]+1])
-    #Replace the lowest level brackets with empty brackets
-    for key in reversed(lowest_list):
-        string = string.replace(string[key:bracket_dict[key]+1], "()")
-    return string, out_list
+    if bound_dict is None:
+        bound_dict = {}
+    if tree[2] == 0:
+        return
+    #Each entry in the queue is (-bound, index of the first combination, counter, partial combination,
+    #number of genes present, number of essential genes)
+    counter = 0
+    queue = [(-bound_partial(((tree, 1),), 0, 0, kterms_set, bound_dict), 0, counter, ((tree, 1),), 0, 0)]
+    while queue:
+        bound, index, order, pending, present, essential = heapq.heappop(queue)
+        position = choose_partial_node(pending)
+        if position == -1:
+            genes_present = []
+            genes_missing = []
+            for leaf, weight in pending:
+                if leaf[0] == "gene" and leaf[1] in kterms_set:
+                    genes_present.append(leaf[1])
+                elif leaf[0] == "gene":
+                    genes_missing.append(leaf[1])
+            yield (present/essential, index, genes_present, genes_missing)
+            continue
+        for new_pending, new_index, added in expand_partial(pending, position, index):
+            new_present = present
+            new_essential = essential
+            for node in added:
+                if node[0] == "gene":
+                    new_essential += 1
+                    if node[1] in kterms_set:
+                        new_present += 1
+            new_bound = bound_partial(new_pending, new_present, new_essential, kterms_set, bound_dict)
+            if new_bound < 0:
+                continue
+            counter += 1
+            heapq.heappush(queue, (-new_bound, new_index, counter, new_pending, new_present, new_essential))
 
-def non_essential_finder(KEGG_definition):
+def best_first_module(compiled_module, kterms_set, bound_dict=None):
     """
-    In KEGG definitions, minuses denote non-essential genes. These will be parsed here, and returned as a list.
+    Finds the most complete combination of a compiled module using a best-first search. Returns the same
+    tuple as evaluate_compiled_module, or None if the module has no combination of essential genes.
+    """
+    for completion, index, genes_present, genes_missing in best_first_combinations(compiled_module["tree"], kterms_set, bound_dict):
+        return (completion, genes_present, non_essential_present(compiled_module["tree"], kterms_set))
+    return None
+
+def top_pathways_module(compiled_module, kterms_set, top_k, bound_dict=None):
+    """
+    Returns the top_k most complete combinations of a compiled module that consist of a distinct set of genes,
+    as a list of tuples: (completion, [genes present], [genes missing]). Non-essential genes are not included.
     """
     out_list = []
-    if "-" in KEGG_definition:
-        #Find all minuses in the string
-        i = 0
-        minus_indices = []
-        while i < len(KEGG_definition):
-            if KEGG_definition[i] == "-":
-                minus_indices.append(i)
-            i+= 1
-        #Find the genes after the minus, counting multiple if they are bracketed. 
-        for i in minus_indices:
-            string = KEGG_definition[i+1:]
-            #If the minus is followed by brackets, inside are all non-essential genes
-            if string.startswith("("):
-                string = string.partition(")")[0].strip("(")
-                splt = string.split(",")
-                for comma_split in splt:
-                    for plus_split in comma_split.split("+"):
-                        out_list.append(plus_split)
-            #Several instances of double minuses exist, such as M00814, M00840 or M00890.
-            #Their meaning is unclear, but they do not seem to denote non-essential genes
-            elif string.startswith("-"):
-                continue
-            #If it is not followed by brackets or minus, simply take the gene following the minus
-            else:
-                string = string.partition("+")[0].partition(",")[0].partition(" ")[0].partition("(")[0].partition(")")[0].partition("-")[0]
-                if string.strip():
-                    out_list.append(string)
+    seen_set = set()
+    for completion, index, genes_present, genes_missing in best_first_combinations(compiled_module["tree"], kterms_set, bound_dict):
+        if len(out_list) >= top_k:
+            break
+        gene_set = frozenset(genes_present + genes_missing)
+        if gene_set in seen_set:
+            continue
+        seen_set.add(gene_set)
+        out_list.append((completion, genes_present, genes_missing))
     return out_list
-    
+
+def top_pathways_checker(compiled_dict, kterms_list, top_k):
+    """
+    Finds the top_k most complete distinct combinations of every compiled module. Returns a dictionary with
+    the module name as key, and the list of top_pathways_module as value. Modules without any combination of
+    essential genes are left out. For modules that can not be evaluated exactly (see compile_module), a non-essential
+    gene is not counted in any position of a combination, which may differ from pathway_completion_checker.
+    """
+    out_dict = {}
+    kterms_set = set(kterms_list)
+    bound_dict = {}
+    for module_name in compiled_dict:
+        top_list = top_pathways_module(compiled_dict[module_name], kterms_set, top_k, bound_dict)
+        if top_list:
+            out_dict[module_name] = top_list
+    return out_dict
+
+def best_first_completion_checker(KEGG_dict, kterms_list):
+    """
+    Finds the highest completion per module in the KEGG_dict using a best-first search. Returns the same
+    dictionary as pathway_completion_checker, but does not alter the KEGG_dict.
+    """
+    out_dict = {}
+    kterms_set = set(kterms_list)
+    bound_dict = {}
+    compiled_dict = compile_KEGG_modules(KEGG_dict)
+    for module_name in compiled_dict:
+        compiled_module = compiled_dict[module_name]
+        if compiled_module["exact"]:
+            result = best_first_module(compiled_module, kterms_set, bound_dict)
+        else:
+            #The search can not reproduce these modules, so all their combinations are enumerated
+            result = pathway_completion_checker({module_name: compiled_module["definition"][:]}, kterms_list).get(module_name)
+        if result is not None:
+            out_dict[module_name] = result
+    return out_dict
+
+###################
+#Analysis wrapper function
 ###################
-#Analysis wrapper function 
-###################   
 
-def pathway_completion_checker(KEGG_dict, kterms_list):
+def pathway_completion_checker(KEGG_dict, kterms_list, search="exhaustive"):
     """
     Uses several functions to find all potential combinations of genes that complete a KEGG module.
     Then find which of those combinations is most complete for the given genes in kterms_list.
+    With search="best_first", best_first_completion_checker is used instead of checking every combination.
     
     Returns a dictionary with the KEGG module name as key, and a tuple as value. The tuple
     contains the highest completion value found (as a 0-1 float),the combination of genes
     amounting to that completion as a list, and a list genes missing from the pathway that were still
     included during completion calculation because they were non-essential: (0.5, [gene1,gene2,gene3], [gene2])
     """
+    if search == "best_first":
+        return best_first_completion_checker(KEGG_dict, kterms_list)
     out_dict = {}
     #Make a dictionary containing lists of all non-essential genes per module
     non_essential_dict = {}
@@ -410,7 +906,581 @@ def pathway_completion_checker(KEGG_dict, kterms_list):
                 best_pathway = gene_is_present[:]
                 out_dict[module_name] = (highest_completion, best_pathway, non_essential_found)
     return out_dict
+
+def compiled_completion_checker(compiled_dict, kterms_list, kterm_index=None, memo_stats=None, module_times=None):
+    """
+    Finds the highest completion per module from the modules compiled by compile_KEGG_modules, without
+    enumerating every combination of genes. Returns the same dictionary as pathway_completion_checker.
+
+    If the kterm_index made by build_kterm_index is given, only modules containing at least one of the
+    k terms are evaluated. The other modules are given their stored result for a genome without hits.
+
+    Nodes shared between modules are evaluated only once. If a memo_stats dictionary ({"hits": 0, "misses": 0})
+    is given, the number of reused (hits) and newly evaluated (misses) nodes are added to it.
+    If a module_times dictionary is given, the time in seconds spent on each evaluated module is stored in it.
+    """
+    out_dict = {}
+    kterms_set = set(kterms_list)
+    memo = new_memo()
+    hit_modules = None
+    if kterm_index is not None:
+        hit_modules = set()
+        for kterm in kterms_set:
+            if kterm in kterm_index:
+                hit_modules.update(kterm_index[kterm])
+    for module_name in compiled_dict:
+        compiled_module = compiled_dict[module_name]
+        if module_times is not None:
+            start = time.perf_counter()
+        if compiled_module["exact"] and hit_modules is not None and module_name not in hit_modules:
+            result = compiled_module["empty_result"]
+            if result is not None:
+                out_dict[module_name] = (result[0], [], [])
+        elif compiled_module["exact"]:
+            result = evaluate_compiled_module(compiled_module, kterms_set, memo)
+            if result is not None:
+                out_dict[module_name] = result
+        else:
+            #Fall back on enumerating all combinations. A new dictionary is given since pathway_completion_checker alters it
+            fallback_dict = pathway_completion_checker({module_name: compiled_module["definition"][:]}, kterms_list)
+            if module_name in fallback_dict:
+                out_dict[module_name] = fallback_dict[module_name]
+        if module_times is not None:
+            module_times[module_name] = time.perf_counter() - start
+    if memo_stats is not None:
+        memo_stats["hits"] += memo["hits"]
+        memo_stats["misses"] += memo["misses"]
+    return out_dict
+
+def print_memo_stats(memo_stats):
+    """
+    Prints how often the results of shared nodes were reused
+    """
+    total = memo_stats["hits"] + memo_stats["misses"]
+    if total > 0:
+        print("Shared node results reused {} times, evaluated {} times ({:.1%} hit rate)".format(memo_stats["hits"], memo_stats["misses"], memo_stats["hits"]/total))
     
+###################
+#Functions for the marginal gain of missing k terms
+###################
+
+#Adding a k term to a genome only changes the completion of the modules containing it. Rather than evaluating those modules again
+#for every absent k term, gain_profiles finds the effect of every single added k term in one bottom-up pass over the compiled trees.
+#Per node, the "profile" is a dictionary: {number of essential genes: highest number of genes present}, which is all the completion
+#depends on. Next to the profile of the genome itself, each node stores for every absent k term below it the entries of the profile
+#that the k term raises. Adding a k term never lowers an entry, so these few entries are all that has to be combined further up.
+#Nodes are interned, so the profiles of a node shared by several modules are calculated once per genome.
+
+def combine_profiles(profile1, profile2):
+    """
+    Combines the profiles of two parts of an "and" or "all" node: every option of the first is joined with every option of the second
+    """
+    out_dict = {}
+    for n1, present1 in profile1.items():
+        for n2, present2 in profile2.items():
+            n = n1 + n2
+            if n not in out_dict or present1 + present2 > out_dict[n]:
+                out_dict[n] = present1 + present2
+    return out_dict
+
+def raised_entries(new_profile, profile):
+    """
+    Returns the entries of the new_profile that are higher than those of the profile
+    """
+    out_dict = {}
+    for n, present in new_profile.items():
+        if present > profile[n]:
+            out_dict[n] = present
+    return out_dict
+
+def gain_profiles(node, kterms_set, memo):
+    """
+    Returns a tuple of (profile of the node for the kterms_set, {absent k term: entries of the profile raised by adding the k term}).
+    K terms that do not raise any entry are left out. The memo is a dictionary {id of node: result}, only valid for a single set of k terms.
+    """
+    kind = node[0]
+    if kind == "opt":
+        return ({0: 0}, {})
+    if kind == "gene":
+        if node[1] in kterms_set:
+            return ({1: 1}, {})
+        return ({1: 0}, {node[1]: {1: 1}})
+    if id(node) in memo:
+        return memo[id(node)]
+    child_results = [gain_profiles(child, kterms_set, memo) for child in node[1]]
+    kterm_children = {}
+    for i, child_result in enumerate(child_results):
+        for kterm in child_result[1]:
+            if kterm not in kterm_children:
+                kterm_children[kterm] = []
+            kterm_children[kterm].append(i)
+    gain_dict = {}
+    if kind == "or":
+        profile = {}
+        for child_result in child_results:
+            for n, present in child_result[0].items():
+                if n not in profile or present > profile[n]:
+                    profile[n] = present
+        for kterm in kterm_children:
+            raised = {}
+            for i in kterm_children[kterm]:
+                for n, present in child_results[i][1][kterm].items():
+                    if present > profile[n] and (n not in raised or present > raised[n]):
+                        raised[n] = present
+            if raised:
+                gain_dict[kterm] = raised
+    else:
+        #For every child, the profile of all other children combined is calculated from the profiles of the children
+        #before and after it. A k term found in a single child then only needs its raised entries combined with it.
+        before_list = [{0: 0}]
+        for child_result in child_results:
+            before_list.append(combine_profiles(before_list[-1], child_result[0]))
+        after_list = [{0: 0}]
+        for child_result in reversed(child_results):
+            after_list.append(combine_profiles(child_result[0], after_list[-1]))
+        after_list.reverse()
+        profile = before_list[-1]
+        others_dict = {}
+        for kterm in kterm_children:
+            if len(kterm_children[kterm]) == 1:
+                i = kterm_children[kterm][0]
+                if i not in others_dict:
+                    others_dict[i] = combine_profiles(before_list[i], after_list[i + 1])
+                raised = raised_entries(combine_profiles(others_dict[i], child_results[i][1][kterm]), profile)
+            else:
+                #A k term found in several children is added to all of them at once
+                kterm_profile = {0: 0}
+                for child_result in child_results:
+                    child_profile = dict(child_result[0])
+                    child_profile.update(child_result[1].get(kterm, {}))
+                    kterm_profile = combine_profiles(kterm_profile, child_profile)
+                raised = raised_entries(kterm_profile, profile)
+            if raised:
+                gain_dict[kterm] = raised
+    memo[id(node)] = (profile, gain_dict)
+    return memo[id(node)]
+
+def enumerated_gain_profiles(KEGG_definition, kterms_set):
+    """
+    Returns the same tuple as gain_profiles for a module that can not be evaluated exactly (see compile_module), by listing
+    its combinations once, as in pathway_completion_checker. Adding a k term that is not non-essential raises the number
+    of genes present in every combination by the number of times it occurs in it.
+    """
+    non_essential_list = []
+    for reaction in KEGG_definition:
+        non_essential_list.extend(non_essential_finder(reaction))
+    profile = {}
+    option_list = []
+    for combination in retrieve_all_possible_pathways(KEGG_definition):
+        present = 0
+        for gene in combination:
+            if gene not in non_essential_list and gene in kterms_set:
+                present += 1
+        for gene in non_essential_list:
+            if gene in combination:
+                combination.remove(gene)
+        n = len(combination)
+        if n == 0:
+            continue
+        if n not in profile or present > profile[n]:
+            profile[n] = present
+        option_list.append((n, present, combination))
+    gain_dict = {}
+    for n, present, combination in option_list:
+        for kterm in set(combination):
+            if kterm in kterms_set or kterm in non_essential_list:
+                continue
+            kterm_present = present + combination.count(kterm)
+            if kterm_present > profile[n]:
+                if kterm not in gain_dict:
+                    gain_dict[kterm] = {}
+                if n not in gain_dict[kterm] or kterm_present > gain_dict[kterm][n]:
+                    gain_dict[kterm][n] = kterm_present
+    return (profile, gain_dict)
+
+def profile_completion(profile):
+    """
+    Returns the highest completion of the entries of a profile, calculated as in evaluate_compiled_module
+    """
+    highest_completion = -1
+    for n, present in profile.items():
+        if n > 0 and present/n > highest_completion:
+            highest_completion = present/n
+    return highest_completion
+
+def marginal_gain_checker(compiled_dict, kterms_list, kterm_index, completion_dict=None):
+    """
+    Calculates for every k term in the modules but absent from the genome how much it would raise the completion of
+    the modules. The completion_dict of compiled_completion_checker for the genome is calculated if not given.
+    Returns a list of tuples: (total completion gain, number of modules it completes, k term, [(module name, gain)]),
+    ranked from the highest to the lowest total gain. K terms that do not raise the completion of any module are left out.
+    """
+    kterms_set = set(kterms_list)
+    if completion_dict is None:
+        completion_dict = compiled_completion_checker(compiled_dict, kterms_list, kterm_index)
+    memo = {}
+    gain_dict = {}
+    for module_name in compiled_dict:
+        if module_name not in completion_dict:
+            continue
+        compiled_module = compiled_dict[module_name]
+        if compiled_module["exact"]:
+            raised_dict = gain_profiles(compiled_module["tree"], kterms_set, memo)[1]
+        else:
+            raised_dict = enumerated_gain_profiles(compiled_module["definition"], kterms_set)[1]
+        for kterm in raised_dict:
+            #Definitions can refer to other modules (M numbers), which are not genes that can be found
+            if not kterm.startswith("K"):
+                continue
+            #Only the raised entries can give a higher completion than that of the genome
+            completion = profile_completion(raised_dict[kterm])
+            gain = completion - completion_dict[module_name][0]
+            if gain > 0:
+                if kterm not in gain_dict:
+                    gain_dict[kterm] = [0, []]
+                gain_dict[kterm][1].append((module_name, round(gain, 9)))
+                if completion == 1 and completion_dict[module_name][0] < 1:
+                    gain_dict[kterm][0] += 1
+    out_list = []
+    for kterm in gain_dict:
+        completed, gain_list = gain_dict[kterm]
+        total_gain = round(sum(gain for module_name, gain in gain_list), 9)
+        out_list.append((total_gain, completed, kterm, gain_list))
+    out_list.sort(key=lambda gain: (-gain[0], -gain[1], gain[2]))
+    return out_list
+
+def output_marginal_gain_tsv(outputname, gain_list):
+    """
+    Outputs a tsv ranking the absent k terms by their total completion gain, as given by marginal_gain_checker.
+    For each, the number of modules it would complete and the gain per module are given.
+    """
+    out = open(outputname, "w")
+    out.write("#Rank\tK_term\tTotal_gain\tModules_completed\tModule_gains\n")
+    for rank, gain in enumerate(gain_list):
+        out.write("{}\t{}\t{}\t{}\t".format(rank + 1, gain[2], gain[0], gain[1]))
+        out.write(",".join("{}:+{}".format(module_name.partition(" ")[0], module_gain) for module_name, module_gain in gain[3]))
+        out.write("\n")
+    out.close()
+
+###################
+#Functions for incremental recalculation
+###################
+
+#Next to each _KEGG_completion.tsv, a _KEGG_completion_hashes.tsv file stores the hash of the k terms of the genome and the hash of the
+#definitions of every module. When rerunning with a refreshed module database, only the modules whose definition changed are recalculated.
+#The other rows are read back from the existing _KEGG_completion.tsv. If the k terms of the genome changed, all modules are recalculated.
+
+def kterms_hash(kterms_list):
+    """
+    Returns the sha256 hash of the set of k terms of a genome
+    """
+    return hashlib.sha256("\n".join(sorted(set(kterms_list))).encode()).hexdigest()
+
+def write_completion_hashes(outprefix, kterms_list, compiled_dict):
+    """
+    Writes the hashes of the k terms and of the definition of every module next to the completion output
+    """
+    out = open(outprefix + "_KEGG_completion_hashes.tsv", "w")
+    out.write("#Version\t{}\n".format(COMPILED_DB_VERSION))
+    out.write("#K_terms\t{}\n".format(kterms_hash(kterms_list)))
+    for module_name in compiled_dict:
+        out.write("{}\t{}\n".format(module_name, compiled_dict[module_name]["hash"]))
+    out.close()
+
+def read_completion_hashes(outprefix):
+    """
+    Reads the hashes written by write_completion_hashes. Returns a tuple of (version, k term hash,
+    {module name: definition hash}), or None if there is no hash file.
+    """
+    hash_path = outprefix + "_KEGG_completion_hashes.tsv"
+    if not os.path.isfile(hash_path):
+        return None
+    version = None
+    kterm_hash = None
+    hash_dict = {}
+    for line in gen_line_reader(hash_path):
+        line = line.rstrip("\n").split("\t")
+        if line[0] == "#Version":
+            version = int(line[1])
+        elif line[0] == "#K_terms":
+            kterm_hash = line[1]
+        elif len(line) == 2:
+            hash_dict[line[0]] = line[1]
+    return (version, kterm_hash, hash_dict)
+
+def read_completion_tsv(tsv_path):
+    """
+    Reads a _KEGG_completion.tsv file written by output_tsv back into the dictionary of pathway_completion_checker
+    """
+    out_dict = {}
+    for line in gen_line_reader(tsv_path):
+        if line.startswith("#"):
+            continue
+        line = line.rstrip("\n").split("\t")
+        best_pathway = []
+        if line[3]:
+            best_pathway = line[3].split(",")
+        non_essential_found = []
+        if line[4] != "None":
+            non_essential_found = line[4].split(",")
+        out_dict[line[0] + " " + line[1]] = (float(line[2]), best_pathway, non_essential_found)
+    return out_dict
+
+def incremental_completion_checker(compiled_dict, kterms_list, outprefix, kterm_index=None, memo_stats=None):
+    """
+    Returns the same dictionary as compiled_completion_checker, but reuses the results in the existing output
+    of outprefix for modules whose definition did not change. Returns a tuple of (completion dictionary,
+    number of recalculated modules).
+    """
+    previous_dict = {}
+    hashes = read_completion_hashes(outprefix)
+    if hashes is not None and hashes[0] == COMPILED_DB_VERSION and hashes[1] == kterms_hash(kterms_list) and os.path.isfile(outprefix + "_KEGG_completion.tsv"):
+        previous_dict = read_completion_tsv(outprefix + "_KEGG_completion.tsv")
+        hash_dict = hashes[2]
+    else:
+        hash_dict = {}
+    changed_dict = {}
+    for module_name in compiled_dict:
+        if hash_dict.get(module_name) != compiled_dict[module_name]["hash"]:
+            changed_dict[module_name] = compiled_dict[module_name]
+    changed_completion = compiled_completion_checker(changed_dict, kterms_list, kterm_index, memo_stats)
+    #Keep the order of the module database. Modules without a combination of essential genes are not in either dictionary
+    out_dict = {}
+    for module_name in compiled_dict:
+        if module_name in changed_dict:
+            if module_name in changed_completion:
+                out_dict[module_name] = changed_completion[module_name]
+        elif module_name in previous_dict:
+            out_dict[module_name] = previous_dict[module_name]
+    return out_dict, len(changed_dict)
+
+###################
+#Batch mode functions
+###################
+
+#The compiled modules are given to each worker process once when the pool starts, rather than with every annotation file
+batch_compiled_dict = None
+batch_kterm_index = None
+batch_top_k = 0
+batch_incremental = False
+batch_marginal_gain = False
+
+def batch_worker_init(compiled_dict, kterm_index, top_k=0, incremental=False, marginal_gain=False):
+    """
+    Initializer for the worker processes of the batch mode
+    """
+    global batch_compiled_dict
+    global batch_kterm_index
+    global batch_top_k
+    global batch_incremental
+    global batch_marginal_gain
+    batch_compiled_dict = compiled_dict
+    batch_kterm_index = kterm_index
+    batch_top_k = top_k
+    batch_incremental = incremental
+    batch_marginal_gain = marginal_gain
+
+def batch_worker(job):
+    """
+    Calculates and writes the module completion of a single annotation file. The job is a tuple of
+    (annotation file, output prefix). Returns the annotation file and the memo statistics.
+    """
+    eggnog_input, outprefix = job
+    memo_stats = {"hits": 0, "misses": 0}
+    kterms_list = ap.eggnog_parser(eggnog_input)
+    if batch_incremental:
+        completion_dict = incremental_completion_checker(batch_compiled_dict, kterms_list, outprefix, batch_kterm_index, memo_stats)[0]
+    else:
+        completion_dict = compiled_completion_checker(batch_compiled_dict, kterms_list, batch_kterm_index, memo_stats)
+    write_completion_output(outprefix, completion_dict)
+    write_completion_hashes(outprefix, kterms_list, batch_compiled_dict)
+    if batch_top_k > 0:
+        output_top_tsv(outprefix + "_KEGG_top_pathways.tsv", top_pathways_checker(batch_compiled_dict, kterms_list, batch_top_k))
+    if batch_marginal_gain:
+        gain_list = marginal_gain_checker(batch_compiled_dict, kterms_list, batch_kterm_index, completion_dict)
+        output_marginal_gain_tsv(outprefix + "_KEGG_marginal_gain.tsv", gain_list)
+    return eggnog_input, memo_stats
+
+def batch_completion(annotation_files, compiled_dict, kterm_index, outdir, threads, top_k=0, incremental=False, marginal_gain=False):
+    """
+    Calculates the module completion for every annotation file, spread over the given number of processes.
+    Output files are written to outdir, using the name of the annotation file as prefix. If top_k is above 0,
+    the top_k most complete combinations per module are written as well. If incremental is True, the results
+    of unchanged modules are read from earlier output in outdir (see incremental_completion_checker).
+    If marginal_gain is True, the absent k terms ranked by marginal_gain_checker are written as well.
+    Returns the memo statistics summed over all annotation files.
+    """
+    total_stats = {"hits": 0, "misses": 0}
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    jobs = []
+    for eggnog_input in annotation_files:
+        jobs.append((eggnog_input, os.path.join(outdir, os.path.basename(eggnog_input))))
+    if threads <= 1:
+        batch_worker_init(compiled_dict, kterm_index, top_k, incremental, marginal_gain)
+        results = map(batch_worker, jobs)
+    else:
+        pool = multiprocessing.Pool(threads, initializer=batch_worker_init, initargs=(compiled_dict, kterm_index, top_k, incremental, marginal_gain))
+        results = pool.imap_unordered(batch_worker, jobs)
+    for done, memo_stats in results:
+        print(done)
+        total_stats["hits"] += memo_stats["hits"]
+        total_stats["misses"] += memo_stats["misses"]
+    if threads > 1:
+        pool.close()
+        pool.join()
+    return total_stats
+
+#In sharded batch mode, every shard writes to its own subdirectory of the output directory, ending with a manifest listing the annotation
+#files of the shard. The manifest is written last, so KEGGstimate_shard_merge.py can tell finished shards from unfinished ones.
+SHARD_MANIFEST = "shard_manifest.txt"
+
+def parse_shard(shard_string):
+    """
+    Parses a shard given as "i/N" (shard i of N, counting from 1). Returns a tuple of (i, N).
+    """
+    shard, partition, shards = shard_string.partition("/")
+    if not partition or not shard.isdigit() or not shards.isdigit() or not 1 <= int(shard) <= int(shards):
+        sys.exit("Invalid shard: {}. Use i/N, where i is between 1 and N".format(shard_string))
+    return int(shard), int(shards)
+
+def shard_files(annotation_files, shard, shards):
+    """
+    Returns the annotation files of shard (counting from 1) out of shards. Files are divided by size: from largest to
+    smallest, each file goes to the shard with the least data so far. Since the files are sorted by size and path first,
+    every shard divides the same input in the same way.
+    """
+    size_list = []
+    for eggnog_input in annotation_files:
+        size_list.append((-os.path.getsize(eggnog_input), eggnog_input))
+    size_list.sort()
+    shard_sizes = [0] * shards
+    out_list = []
+    for size, eggnog_input in size_list:
+        smallest = shard_sizes.index(min(shard_sizes))
+        shard_sizes[smallest] -= size
+        if smallest == shard - 1:
+            out_list.append(eggnog_input)
+    out_list.sort()
+    return out_list
+
+def shard_output_dir(outdir, shard, shards):
+    """
+    Returns the subdirectory of the output directory a shard writes to
+    """
+    return os.path.join(outdir, "shard_{}_of_{}".format(shard, shards))
+
+def write_shard_manifest(shard_dir, shard, shards, annotation_files):
+    """
+    Writes the manifest of a finished shard, listing its annotation files. The file is first written under a temporary name
+    and then renamed, so that KEGGstimate_shard_merge.py never reads a partially written manifest.
+    """
+    manifest_path = os.path.join(shard_dir, SHARD_MANIFEST)
+    temp_path = "{}.{}.tmp".format(manifest_path, os.getpid())
+    out = open(temp_path, "w")
+    out.write("#Shard\t{}/{}\n".format(shard, shards))
+    for eggnog_input in annotation_files:
+        out.write(eggnog_input + "\n")
+    out.close()
+    os.replace(temp_path, manifest_path)
+
+###################
+#Profiling functions
+###################
+
+#Number of modules listed in the profile
+PROFILE_MODULES = 20
+
+def slowest_modules(compiled_dict, module_times=None):
+    """
+    Lists the modules with the most combinations, with their number of combinations and
+    evaluation time in seconds (if measured), as a list of dictionaries for the profile
+    """
+    out_list = []
+    for module_name in sorted(compiled_dict, key=lambda x: -compiled_dict[x]["tree"][2])[:PROFILE_MODULES]:
+        seconds = None
+        if module_times is not None and module_name in module_times:
+            seconds = module_times[module_name]
+        out_list.append({"module": module_name.partition(" ")[0], "combinations": compiled_dict[module_name]["tree"][2], "time": seconds})
+    return out_list
+
+###################
+#Importable engine
+###################
+
+def completion_results(completion_dict):
+    """
+    Converts the dictionary of pathway_completion_checker into a list with a dictionary per module:
+    {"module": entry code, "name": module name, "completion": highest completion, "best_pathway": [genes present],
+    "non_essential_found": [non-essential genes present]}
+    """
+    out_list = []
+    for module_name in completion_dict:
+        result = completion_dict[module_name]
+        out_list.append({"module": module_name.partition(" ")[0], "name": module_name.partition(" ")[2],
+                         "completion": result[0], "best_pathway": list(result[1]), "non_essential_found": list(result[2])})
+    return out_list
+
+class ModuleCompletionEngine:
+    """
+    Calculates the module completion of many sets of k terms from Python, without going through files.
+    The module database is compiled (or loaded from the cache) once, when the engine is made:
+
+        import KEGGstimate_module_checker as mc
+        engine = mc.ModuleCompletionEngine("path/to/KEGG_module_db")
+        for result in engine.run(["K00844", "K01810", "K00850"]):
+            print(result["module"], result["completion"])
+
+    Output files are only written when an output prefix is given.
+    """
+    def __init__(self, KEGG_db, cache_path=None, use_cache=True):
+        self.compiled_dict, self.kterm_index = load_compiled_db(KEGG_db, cache_path, use_cache)
+        self.memo_stats = {"hits": 0, "misses": 0}
+
+    def completion_dict(self, kterms):
+        """
+        Returns the same dictionary as pathway_completion_checker for an iterable of k terms
+        """
+        return compiled_completion_checker(self.compiled_dict, list(kterms), self.kterm_index, self.memo_stats)
+
+    def run(self, kterms, outprefix=None):
+        """
+        Returns the completion of every module for an iterable of k terms, as a list of dictionaries (see completion_results).
+        If an output prefix is given, the _KEGG_completion.tsv and _KEGG_complete_modules.tsv files are written as well.
+        """
+        kterms_list = list(kterms)
+        completion_dict = self.completion_dict(kterms_list)
+        if outprefix is not None:
+            write_completion_output(outprefix, completion_dict)
+            write_completion_hashes(outprefix, kterms_list, self.compiled_dict)
+        return completion_results(completion_dict)
+
+    def run_annotation(self, eggnog_path, outprefix=None):
+        """
+        Returns the completion of every module for the k terms in an eggnog .annotations file
+        """
+        return self.run(ap.eggnog_parser(eggnog_path), outprefix)
+
+    def top_pathways(self, kterms, top_k, outprefix=None):
+        """
+        Returns the top_k most complete distinct combinations per module, as given by top_pathways_checker.
+        If an output prefix is given, the _KEGG_top_pathways.tsv file is written as well.
+        """
+        top_dict = top_pathways_checker(self.compiled_dict, list(kterms), top_k)
+        if outprefix is not None:
+            output_top_tsv(outprefix + "_KEGG_top_pathways.tsv", top_dict)
+        return top_dict
+
+    def marginal_gain(self, kterms, outprefix=None):
+        """
+        Returns the absent k terms ranked by how much they would raise the completion of the modules, as given by
+        marginal_gain_checker. If an output prefix is given, the _KEGG_marginal_gain.tsv file is written as well.
+        """
+        gain_list = marginal_gain_checker(self.compiled_dict, list(kterms), self.kterm_index)
+        if outprefix is not None:
+            output_marginal_gain_tsv(outprefix + "_KEGG_marginal_gain.tsv", gain_list)
+        return gain_list
+
 ####################################################################
 #MAIN
 ####################################################################    
@@ -419,12 +1489,99 @@ if __name__ == "__main__":
     eggnog_input = sys.argv[1]
     outprefix= sys.argv[2]
     KEGG_db = sys.argv[3]
-    #Read in the KEGG module DB
-    KEGG_dict = KEGG_module_reader(KEGG_db)
+    #Optional arguments for the compiled module cache
+    cache_path = None
+    use_cache = True
+    if "--cache" in sys.argv:
+        cache_path = sys.argv[sys.argv.index("--cache") + 1]
+    if "--no_cache" in sys.argv:
+        use_cache = False
+    #Optional arguments for batch mode
+    batch = False
+    threads = ap.available_threads()
+    if "--batch" in sys.argv:
+        batch = True
+    if "--threads" in sys.argv:
+        threads = int(sys.argv[sys.argv.index("--threads") + 1])
+    shard = None
+    if "--shard" in sys.argv:
+        shard, shards = parse_shard(sys.argv[sys.argv.index("--shard") + 1])
+    show_memo_stats = False
+    if "--memo_stats" in sys.argv:
+        show_memo_stats = True
+    search = "compiled"
+    if "--search" in sys.argv:
+        search = sys.argv[sys.argv.index("--search") + 1]
+        if search not in ("compiled", "best_first", "exhaustive"):
+            sys.exit("Unknown search: {}. Use compiled, best_first or exhaustive".format(search))
+    top_k = 0
+    if "--top_k" in sys.argv:
+        top_k = int(sys.argv[sys.argv.index("--top_k") + 1])
+    incremental = False
+    if "--incremental" in sys.argv:
+        incremental = True
+    marginal_gain = False
+    if "--marginal_gain" in sys.argv:
+        marginal_gain = True
+    #Optional profiling of the run
+    profile = None
+    module_times = None
+    if "--profile" in sys.argv:
+        profile_path = sys.argv[sys.argv.index("--profile") + 1]
+        profile = profiler.new_profile("KEGGstimate_module_checker.py")
+        module_times = {}
+    #Read in the KEGG module DB and compile the module definitions into expression trees, or load them from the cache
+    compiled_dict, kterm_index = load_compiled_db(KEGG_db, cache_path, use_cache, profile)
+    #In batch mode, the input is a directory or list of annotation files, and the output prefix is the output directory
+    if batch:
+        #The annotation files are parsed, scored and written by the worker processes, so these are a single phase
+        annotation_files = ap.batch_input_files(eggnog_input)
+        #Checked over all annotation files, so that the shards cannot overwrite each other's output either
+        ap.check_unique_file_names(annotation_files)
+        #A shard only processes its part of the annotation files, and writes to its own subdirectory
+        if shard is not None:
+            annotation_files = shard_files(annotation_files, shard, shards)
+            outprefix = shard_output_dir(outprefix, shard, shards)
+            #The manifest of an earlier run of the shard is removed first, so that the shard only counts as finished once this run is
+            manifest_path = os.path.join(outprefix, SHARD_MANIFEST)
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+        with profiler.profile_phase(profile, "batch"):
+            memo_stats = batch_completion(annotation_files, compiled_dict, kterm_index, outprefix, threads, top_k, incremental, marginal_gain)
+        if shard is not None:
+            write_shard_manifest(outprefix, shard, shards, annotation_files)
+        if show_memo_stats:
+            print_memo_stats(memo_stats)
+        if profile is not None:
+            profiler.write_profile(profile, profile_path, KEGG_db, {"slowest_modules": slowest_modules(compiled_dict)})
+        sys.exit()
     #Parse out the K terms from eggnog output_name
-    kterms_list = eggnog_parser(eggnog_input)
+    with profiler.profile_phase(profile, "annotation_parse"):
+        kterms_list = ap.eggnog_parser(eggnog_input)
     #Check per pathway how complete it is based on the eggnog K terms
-    completion_dict = pathway_completion_checker(KEGG_dict, kterms_list)
+    with profiler.profile_phase(profile, "scoring"):
+        if search == "compiled":
+            memo_stats = {"hits": 0, "misses": 0}
+            if incremental:
+                completion_dict, recalculated = incremental_completion_checker(compiled_dict, kterms_list, outprefix, kterm_index, memo_stats)
+                print("Recalculated {} of {} modules".format(recalculated, len(compiled_dict)))
+            else:
+                completion_dict = compiled_completion_checker(compiled_dict, kterms_list, kterm_index, memo_stats, module_times)
+            if show_memo_stats:
+                print_memo_stats(memo_stats)
+        else:
+            KEGG_dict = {}
+            for module_name in compiled_dict:
+                KEGG_dict[module_name] = compiled_dict[module_name]["definition"][:]
+            completion_dict = pathway_completion_checker(KEGG_dict, kterms_list, search)
     #Output the found completion
-    output_tsv(outprefix + "_KEGG_completion.tsv",completion_dict, 0)
-    output_tsv(outprefix + "_KEGG_complete_modules.tsv",completion_dict, 1)
+    with profiler.profile_phase(profile, "output"):
+        write_completion_output(outprefix, completion_dict)
+        write_completion_hashes(outprefix, kterms_list, compiled_dict)
+        if top_k > 0:
+            output_top_tsv(outprefix + "_KEGG_top_pathways.tsv", top_pathways_checker(compiled_dict, kterms_list, top_k))
+    if marginal_gain:
+        with profiler.profile_phase(profile, "marginal_gain"):
+            output_marginal_gain_tsv(outprefix + "_KEGG_marginal_gain.tsv", marginal_gain_checker(compiled_dict, kterms_list, kterm_index, completion_dict))
+    if profile is not None:
+        profiler.write_profile(profile, profile_path, KEGG_db, {"slowest_modules": slowest_modules(compiled_dict, module_times)})
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Calculates the KEGG module completion of many genomes at once. The k terms of every genome are stored as one row of a
+boolean genome x k term matrix. Each module compiled by KEGGstimate_module_checker.py is then evaluated for all genomes
+at the same time, using NumPy array operations rather than a Python loop per genome. Gives the same output as
+KEGGstimate_module_checker.py.
+
+Requires numpy. KEGGstimate_module_checker.py needs to be in the same directory as this script.
+
+Usage: (python) KEGGstimate_module_matrix.py input_dir_or_list output_dir path/to/KEGG_module_db [arguments]
+
+The input is a directory containing .emapper.annotations files, or a text file listing them (one per line).
+
+Optional arguments:
+    --cache: Path of the compiled module cache. Default is the module database path followed by ".compiled"
+    --no_cache: Always read and compile the module database, without reading or writing the cache
+    --memo_stats: Report how often results of parts shared between modules were reused
+
+Output:
+Per annotation file, writes the same *_KEGG_completion.tsv and *_KEGG_complete_modules.tsv files as
+KEGGstimate_module_checker.py to the output directory, using the annotation file name as prefix.
+"""
+###################
+#Import statements
+###################
+
+import sys
+import os
+import numpy as np
+import KEGGstimate_module_checker as mc
+import KEGGstimate_annotation_parser as ap
+
+###################
+#Functions for building the genome x k term matrix
+###################
+
+def build_kterm_matrix(kterms_lists, compiled_dict):
+    """
+    Creates a boolean matrix with a row per genome and a column per k term. Only k terms used in
+    the compiled modules are included. Returns the matrix, and a dictionary with the column of each k term.
+    """
+    gene_set = set()
+    for module_name in compiled_dict:
+        mc.tree_genes(compiled_dict[module_name]["tree"], gene_set)
+    columns = {}
+    for gene in sorted(gene_set):
+        columns[gene] = len(columns)
+    matrix = np.zeros((len(kterms_lists), len(columns)), dtype=bool)
+    for row, kterms_list in enumerate(kterms_lists):
+        for kterm in kterms_list:
+            if kterm in columns:
+                matrix[row, columns[kterm]] = True
+    return matrix, columns
+
+###################
+#Functions for evaluating compiled trees on the matrix
+###################
+
+#These functions follow evaluate_node in KEGGstimate_module_checker.py, but for all genomes at once. Per node, P is an array
+#of (number of essential genes, genomes) with the number of genes present, or -1 if there is no combination with that many
+#essential genes. Rather than the combination index itself, which can be larger than fits in an array, K holds the rank of
+#the combination index among the options of the node, which is sufficient to find the first of two equally complete options.
+#The choices made at each node are kept in a trace, which is used afterwards to find the genes of the best combination.
+#Traces are not changed after they are made, so the trace of a node shared between modules (see intern_node) can be kept
+#in a memo and reused. To limit memory use, only traces of nodes occurring more than once are kept.
+
+def shared_nodes(compiled_dict):
+    """
+    Returns the set of ids of the internal nodes that occur more than once in the compiled modules
+    """
+    seen_set = set()
+    shared_set = set()
+    stack = []
+    for module_name in compiled_dict:
+        stack.append(compiled_dict[module_name]["tree"])
+    while stack:
+        node = stack.pop()
+        if node[0] == "gene" or node[0] == "opt":
+            continue
+        if id(node) in seen_set:
+            shared_set.add(id(node))
+            continue
+        seen_set.add(id(node))
+        for child in node[1]:
+            stack.append(child)
+    return shared_set
+
+def rank_keys(P, key):
+    """
+    Converts the keys of the options of a node into ranks (0 being the first combination), per genome
+    """
+    key = np.where(P >= 0, key, np.iinfo(np.int64).max)
+    order = np.argsort(key, axis=0, kind="stable")
+    ranks = np.empty(order.shape, dtype=np.int64)
+    np.put_along_axis(ranks, order, np.arange(order.shape[0], dtype=np.int64)[:, None] + np.zeros(order.shape, dtype=np.int64), axis=0)
+    return ranks
+
+def evaluate_matrix_node(node, matrix, columns, memo=None):
+    """
+    Evaluates a compiled node for all genomes in the matrix. Returns a trace: a tuple of (P, K, choices, child traces).
+    If a memo is given, traces of the nodes listed in memo["shared"] are stored and reused.
+    """
+    kind = node[0]
+    samples = matrix.shape[0]
+    if kind == "opt":
+        return (np.zeros((1, samples), dtype=np.int32), np.zeros((1, samples), dtype=np.int64), None, None)
+    if kind == "gene":
+        P = np.full((2, samples), -1, dtype=np.int32)
+        P[1] = matrix[:, columns[node[1]]]
+        return (P, np.zeros((2, samples), dtype=np.int64), None, None)
+    if memo is not None and id(node) in memo["nodes"]:
+        memo["hits"] += 1
+        return memo["nodes"][id(node)]
+    child_traces = []
+    for child in node[1]:
+        child_traces.append(evaluate_matrix_node(child, matrix, columns, memo))
+    if kind == "or":
+        trace = evaluate_matrix_or(child_traces, samples)
+    else:
+        trace = evaluate_matrix_and(kind, child_traces, samples)
+    if memo is not None:
+        memo["misses"] += 1
+        if id(node) in memo["shared"]:
+            memo["nodes"][id(node)] = trace
+    return trace
+
+def evaluate_matrix_or(child_traces, samples):
+    """
+    Combines the child traces of an "or" node. Per number of essential genes, the first child with the
+    most genes present is chosen, since its combinations come first.
+    """
+    F = 1
+    for trace in child_traces:
+        F = max(F, trace[0].shape[0])
+    P = np.full((F, samples), -1, dtype=np.int32)
+    key = np.zeros((F, samples), dtype=np.int64)
+    choice = np.full((F, samples), -1, dtype=np.int32)
+    for i, trace in enumerate(child_traces):
+        rows = trace[0].shape[0]
+        better = trace[0] > P[:rows]
+        P[:rows] = np.where(better, trace[0], P[:rows])
+        key[:rows] = np.where(better, i * F + trace[1], key[:rows])
+        choice[:rows] = np.where(better, i, choice[:rows])
+    return (P, rank_keys(P, key), choice, child_traces)
+
+def evaluate_matrix_and(kind, child_traces, samples):
+    """
+    Combines the child traces of an "and" or "all" node, adding one child at a time.
+    The choices store per step how many essential genes were taken from the added child.
+    """
+    P = np.zeros((1, samples), dtype=np.int32)
+    K = np.zeros((1, samples), dtype=np.int64)
+    choices = []
+    for trace in child_traces:
+        CP = trace[0]
+        CK = trace[1]
+        FR = P.shape[0]
+        Fc = CP.shape[0]
+        new_P = np.full((FR + Fc - 1, samples), -1, dtype=np.int32)
+        new_key = np.zeros((FR + Fc - 1, samples), dtype=np.int64)
+        choice = np.zeros((FR + Fc - 1, samples), dtype=np.int32)
+        for nc in range(Fc):
+            if not (CP[nc] >= 0).any():
+                continue
+            cand_P = np.where((P >= 0) & (CP[nc] >= 0), P + CP[nc], -1)
+            #Within a definition the added child is enumerated in the outer loop, whereas for multiple definitions
+            #the earlier definitions are enumerated in the outer loop
+            if kind == "and":
+                cand_key = CK[nc] * FR + K
+            else:
+                cand_key = K * Fc + CK[nc]
+            window_P = new_P[nc:nc + FR]
+            window_key = new_key[nc:nc + FR]
+            better = (cand_P > window_P) | ((cand_P == window_P) & (cand_P >= 0) & (cand_key < window_key))
+            new_P[nc:nc + FR] = np.where(better, cand_P, window_P)
+            new_key[nc:nc + FR] = np.where(better, cand_key, window_key)
+            choice[nc:nc + FR] = np.where(better, nc, choice[nc:nc + FR])
+        P = new_P
+        K = rank_keys(P, new_key)
+        choices.append(choice)
+    return (P, K, choices, child_traces)
+
+def evaluate_matrix_completion(node, matrix, columns):
+    """
+    Evaluates a compiled node for all genomes in the matrix like evaluate_matrix_node, but only returns P. Without the
+    ranks and choices needed to find the genes of the best combination, only the P arrays of the nodes being combined are kept.
+    """
+    kind = node[0]
+    samples = matrix.shape[0]
+    if kind == "opt":
+        return np.zeros((1, samples), dtype=np.int32)
+    if kind == "gene":
+        P = np.full((2, samples), -1, dtype=np.int32)
+        P[1] = matrix[:, columns[node[1]]]
+        return P
+    if kind == "or":
+        P = None
+        for child in node[1]:
+            CP = evaluate_matrix_completion(child, matrix, columns)
+            if P is None:
+                P = CP
+                continue
+            if CP.shape[0] > P.shape[0]:
+                P, CP = CP, P
+            P[:CP.shape[0]] = np.maximum(P[:CP.shape[0]], CP)
+        return P
+    P = np.zeros((1, samples), dtype=np.int32)
+    for child in node[1]:
+        CP = evaluate_matrix_completion(child, matrix, columns)
+        FR = P.shape[0]
+        new_P = np.full((FR + CP.shape[0] - 1, samples), -1, dtype=np.int32)
+        for nc in range(CP.shape[0]):
+            if not (CP[nc] >= 0).any():
+                continue
+            cand_P = np.where((P >= 0) & (CP[nc] >= 0), P + CP[nc], -1)
+            new_P[nc:nc + FR] = np.maximum(new_P[nc:nc + FR], cand_P)
+        P = new_P
+    return P
+
+def backtrack_matrix_node(node, trace, target, matrix, columns, found_list):
+    """
+    Follows the choices in the trace to find the genes of the selected combination per genome. The target holds
+    per genome the number of essential genes selected from this node, or -1 if the node is not part of the selected
+    combination. Adds a tuple of (gene, boolean array of genomes for which the gene is selected and present) to the found_list.
+    """
+    kind = node[0]
+    if kind == "opt":
+        return
+    if kind == "gene":
+        found_list.append((node[1], (target == 1) & matrix[:, columns[node[1]]]))
+        return
+    samples = np.arange(matrix.shape[0])
+    selected = target >= 0
+    safe_target = np.where(selected, target, 0)
+    if kind == "or":
+        chosen = trace[2][safe_target, samples]
+        for i, child in enumerate(node[1]):
+            child_target = np.where(selected & (chosen == i), target, -1)
+            backtrack_matrix_node(child, trace[3][i], child_target, matrix, columns, found_list)
+        return
+    child_targets = [None] * len(node[1])
+    for i in reversed(range(len(node[1]))):
+        taken = trace[2][i][safe_target, samples]
+        child_targets[i] = np.where(selected, taken, -1)
+        target = np.where(selected, target - taken, -1)
+        safe_target = np.where(selected, target, 0)
+    for i, child in enumerate(node[1]):
+        backtrack_matrix_node(child, trace[3][i], child_targets[i], matrix, columns, found_list)
+
+def evaluate_matrix_module(compiled_module, matrix, columns, memo=None):
+    """
+    Finds the most complete combination of a compiled module for every genome in the matrix. Returns a list with
+    per genome the same tuple as evaluate_compiled_module, or None if the module has no combination of essential genes.
+    """
+    samples = matrix.shape[0]
+    trace = evaluate_matrix_node(compiled_module["tree"], matrix, columns, memo)
+    P = trace[0]
+    K = trace[1]
+    n = np.arange(P.shape[0])[:, None]
+    completion = np.where((P >= 0) & (n > 0), P / np.maximum(n, 1), -1.0)
+    highest = completion.max(axis=0)
+    tied = (completion == highest) & (completion >= 0)
+    best_n = np.argmin(np.where(tied, K, np.iinfo(np.int64).max), axis=0)
+    target = np.where(highest >= 0, best_n, -1)
+    found_list = []
+    backtrack_matrix_node(compiled_module["tree"], trace, target, matrix, columns, found_list)
+    #The order of the non-essential genes does not depend on the genome, only which of them are present
+    non_essential_order = mc.non_essential_present(compiled_module["tree"], set(compiled_module["non_essential"]))
+    out_list = []
+    for sample in range(samples):
+        if highest[sample] < 0:
+            out_list.append(None)
+            continue
+        best_pathway = []
+        for gene, present in found_list:
+            if present[sample]:
+                best_pathway.append(gene)
+        non_essential_found = []
+        for gene in non_essential_order:
+            if matrix[sample, columns[gene]]:
+                non_essential_found.append(gene)
+        out_list.append((int(P[best_n[sample], sample])/int(best_n[sample]), best_pathway, non_essential_found))
+    return out_list
+
+def matrix_completion_checker(compiled_dict, kterms_lists, kterm_index=None, memo_stats=None):
+    """
+    Calculates the module completion for every list of k terms in kterms_lists. Returns a list with, per list of
+    k terms, the same dictionary as pathway_completion_checker gives.
+
+    If the kterm_index made by build_kterm_index is given, modules without hits in any genome are not evaluated.
+    If a memo_stats dictionary ({"hits": 0, "misses": 0}) is given, the number of reused and newly evaluated nodes are added to it.
+    """
+    matrix, columns = build_kterm_matrix(kterms_lists, compiled_dict)
+    memo = {"nodes": {}, "shared": shared_nodes(compiled_dict), "hits": 0, "misses": 0}
+    hit_modules = None
+    if kterm_index is not None:
+        hit_modules = set()
+        for kterm in columns:
+            if kterm in kterm_index and matrix[:, columns[kterm]].any():
+                hit_modules.update(kterm_index[kterm])
+    out_list = []
+    for kterms_list in kterms_lists:
+        out_list.append({})
+    for module_name in compiled_dict:
+        compiled_module = compiled_dict[module_name]
+        if compiled_module["exact"] and hit_modules is not None and module_name not in hit_modules:
+            results = []
+            for kterms_list in kterms_lists:
+                if compiled_module["empty_result"] is None:
+                    results.append(None)
+                else:
+                    results.append((compiled_module["empty_result"][0], [], []))
+        elif compiled_module["exact"]:
+            results = evaluate_matrix_module(compiled_module, matrix, columns, memo)
+        else:
+            #Fall back on the single genome functions, which enumerate the combinations for these modules
+            results = []
+            for kterms_list in kterms_lists:
+                results.append(mc.compiled_completion_checker({module_name: compiled_module}, kterms_list).get(module_name))
+        for sample, result in enumerate(results):
+            if result is not None:
+                out_list[sample][module_name] = result
+    if memo_stats is not None:
+        memo_stats["hits"] += memo["hits"]
+        memo_stats["misses"] += memo["misses"]
+    return out_list
+
+####################################################################
+#MAIN
+####################################################################
+if __name__ == "__main__":
+    #Obtain inputs
+    eggnog_input = sys.argv[1]
+    outdir = sys.argv[2]
+    KEGG_db = sys.argv[3]
+    cache_path = None
+    use_cache = True
+    if "--cache" in sys.argv:
+        cache_path = sys.argv[sys.argv.index("--cache") + 1]
+    if "--no_cache" in sys.argv:
+        use_cache = False
+    show_memo_stats = False
+    if "--memo_stats" in sys.argv:
+        show_memo_stats = True
+    #Load the compiled modules, and the k terms of every annotation file
+    compiled_dict, kterm_index = mc.load_compiled_db(KEGG_db, cache_path, use_cache)
+    annotation_files = ap.batch_input_files(eggnog_input)
+    ap.check_unique_file_names(annotation_files)
+    kterms_lists = []
+    for annotation_file in annotation_files:
+        kterms_lists.append(ap.eggnog_parser(annotation_file))
+    #Calculate the completion for all genomes at once, and write the output per genome
+    memo_stats = {"hits": 0, "misses": 0}
+    completion_list = matrix_completion_checker(compiled_dict, kterms_lists, kterm_index, memo_stats)
+    if show_memo_stats:
+        mc.print_memo_stats(memo_stats)
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    for annotation_file, kterms_list, completion_dict in zip(annotation_files, kterms_lists, completion_list):
+        outprefix = os.path.join(outdir, os.path.basename(annotation_file))
+        mc.write_completion_output(outprefix, completion_dict)
+        mc.write_completion_hashes(outprefix, kterms_list, compiled_dict)
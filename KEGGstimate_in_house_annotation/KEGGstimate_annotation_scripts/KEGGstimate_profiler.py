@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Opt-in instrumentation for the KEGGstimate checkers. Records the wall time and memory use of each phase of a run
+(for example database load, annotation parsing, scoring and output), and writes them to a JSON file so that runs
+with different database versions can be compared.
+
+Per phase, the wall time, the memory allocated by Python according to tracemalloc (current and peak), and the
+lines allocating the most memory during the phase are recorded. For the whole run, the wall time and peak resident
+memory (RSS) are recorded. Since tracemalloc slows down memory allocation, the timings are higher than without profiling.
+
+This file is imported by KEGGstimate_module_checker.py and KEGGstimate_brite_checker.py, and needs to be in the same directory.
+"""
+###################
+#Import statements
+###################
+
+import sys
+import time
+import json
+import hashlib
+import tracemalloc
+import contextlib
+try:
+    import resource
+except ImportError:
+    resource = None
+
+###################
+#Profiling functions
+###################
+
+#Number of allocating lines stored per phase
+TOP_ALLOCATIONS = 5
+
+def new_profile(script):
+    """
+    Starts profiling a run of the script. Returns the profile dictionary used by the other functions.
+    """
+    tracemalloc.start()
+    return {"script": script, "arguments": sys.argv[1:], "start": time.perf_counter(), "phases": []}
+
+@contextlib.contextmanager
+def profile_phase(profile, name):
+    """
+    Records the code run within a with statement as a phase of the profile. Does nothing if the profile is None,
+    so that it can be used whether or not profiling is switched on:
+
+        with profile_phase(profile, "annotation_parse"):
+            kterms_list = eggnog_parser(eggnog_input)
+    """
+    if profile is None:
+        yield
+        return
+    tracemalloc.reset_peak()
+    start_snapshot = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    yield
+    wall_time = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    top_list = []
+    for stat in tracemalloc.take_snapshot().compare_to(start_snapshot, "lineno")[:TOP_ALLOCATIONS]:
+        frame = stat.traceback[0]
+        top_list.append({"location": "{}:{}".format(frame.filename, frame.lineno), "size_diff": stat.size_diff, "count_diff": stat.count_diff})
+    profile["phases"].append({"name": name, "wall_time": wall_time, "tracemalloc_current": current,
+                              "tracemalloc_peak": peak, "top_allocations": top_list})
+
+def peak_rss_kb():
+    """
+    Returns the peak resident memory of this process in kilobytes, or None if it can not be determined
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #macOS reports bytes rather than kilobytes
+    if sys.platform == "darwin":
+        peak = peak // 1024
+    return peak
+
+def database_hash(database_path):
+    """
+    Returns the sha256 hash of a database file, to identify the database version in the profile
+    """
+    sha = hashlib.sha256()
+    with open(database_path, "rb") as f:
+        for block in iter(lambda: f.read(1048576), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def write_profile(profile, out_path, database_path=None, extra_dict=None):
+    """
+    Stops profiling, and writes the profile as JSON to out_path. The items of extra_dict, such as the slowest
+    modules, are added to the JSON as well.
+    """
+    out_dict = {"script": profile["script"], "arguments": profile["arguments"]}
+    if database_path is not None:
+        out_dict["database"] = database_path
+        out_dict["database_hash"] = database_hash(database_path)
+    out_dict["wall_time"] = time.perf_counter() - profile["start"]
+    out_dict["peak_rss_kb"] = peak_rss_kb()
+    out_dict["phases"] = profile["phases"]
+    if extra_dict is not None:
+        out_dict.update(extra_dict)
+    tracemalloc.stop()
+    with open(out_path, "w") as out:
+        json.dump(out_dict, out, indent=2)
+        out.write("\n")
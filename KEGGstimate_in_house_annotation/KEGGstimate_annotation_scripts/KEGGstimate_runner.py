@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Runs the module checker and the BRITE checker together. Each annotation file is read only once, and the
+k terms found in it are used both to calculate the KEGG module completion and to count the genes per
+BRITE category. The output is the same as running KEGGstimate_module_checker.py and KEGGstimate_brite_checker.py
+separately on the annotation file.
+
+Usage: (python) KEGGstimate_runner.py input.emapper.annotations Output_prefix path/to/KEGG_module_db path/to/KEGG_k_term_database [arguments]
+
+Optional arguments:
+    --cache: Path of the compiled module cache. Default is the module database path followed by ".compiled"
+    --no_cache: Always read and compile the module database, without reading or writing the cache
+    --index: Path of the BRITE index. Default is the k term database path followed by ".index"
+    --no_index: Always parse the k term database, without reading or writing the index
+    --batch: Batch mode. The first argument is a directory containing .emapper.annotations files, or a text file listing
+             them (one per line). The second argument is the output directory, where the output of each file is written
+             using the annotation file name as prefix.
+    --threads: Number of processes used in batch mode. Default is the number of available CPUs.
+    --top_k: Also write the given number of most complete combinations with a distinct set of genes per module
+    --marginal_gain: Also write the k terms absent from the genome, ranked by how much they would raise the completion of all modules
+    --profile: Write the wall time and memory use of each phase as JSON to the given file.
+               See KEGGstimate_profiler.py.
+
+Output:
+The output files of the module checker (*Output_prefix*_KEGG_completion.tsv, _KEGG_complete_modules.tsv and
+_KEGG_completion_hashes.tsv, and the files of --top_k and --marginal_gain), and the output of the BRITE checker
+as *Output_prefix*_pathway_and_BRITE.
+
+KEGGstimate_module_checker.py, KEGGstimate_brite_checker.py, KEGGstimate_annotation_parser.py and KEGGstimate_profiler.py need to be in the same directory.
+"""
+###################
+#Import statements
+###################
+
+import sys
+import os
+import multiprocessing
+import KEGGstimate_module_checker as mc
+import KEGGstimate_brite_checker as bc
+import KEGGstimate_annotation_parser as ap
+import KEGGstimate_profiler as profiler
+
+###################
+#Functions
+###################
+
+def run_annotation(kterms_list, compiled_dict, kterm_index, brite_index, outprefix, top_k=0, marginal_gain=False, profile=None):
+    """
+    Calculates and writes the module completion and the BRITE gene counts for the k terms of an annotation file
+    """
+    with profiler.profile_phase(profile, "scoring"):
+        completion_dict = mc.compiled_completion_checker(compiled_dict, kterms_list, kterm_index)
+    with profiler.profile_phase(profile, "output"):
+        mc.write_completion_output(outprefix, completion_dict)
+        mc.write_completion_hashes(outprefix, kterms_list, compiled_dict)
+        if top_k > 0:
+            mc.output_top_tsv(outprefix + "_KEGG_top_pathways.tsv", mc.top_pathways_checker(compiled_dict, kterms_list, top_k))
+    if marginal_gain:
+        with profiler.profile_phase(profile, "marginal_gain"):
+            gain_list = mc.marginal_gain_checker(compiled_dict, kterms_list, kterm_index, completion_dict)
+            mc.output_marginal_gain_tsv(outprefix + "_KEGG_marginal_gain.tsv", gain_list)
+    with profiler.profile_phase(profile, "brite_counting_and_output"):
+        bc.output_hierarchical_gene_count(brite_index, kterms_list, outprefix + "_pathway_and_BRITE")
+
+###################
+#Batch functions
+###################
+
+batch_compiled_dict = None
+batch_kterm_index = None
+batch_brite_index = None
+batch_top_k = 0
+batch_marginal_gain = False
+
+def batch_worker_init(compiled_dict, kterm_index, k_term_db, index_path=None, use_index=True, top_k=0, marginal_gain=False):
+    """
+    Initializer for the worker processes of the batch mode. The BRITE index is mapped into memory by every process
+    (or, with use_index False, the k term database is parsed by every process).
+    """
+    global batch_compiled_dict
+    global batch_kterm_index
+    global batch_brite_index
+    global batch_top_k
+    global batch_marginal_gain
+    batch_compiled_dict = compiled_dict
+    batch_kterm_index = kterm_index
+    batch_brite_index = bc.load_brite_index(k_term_db, index_path, use_index)
+    batch_top_k = top_k
+    batch_marginal_gain = marginal_gain
+
+def batch_worker(job):
+    """
+    Reads a single annotation file, and writes its module completion and BRITE gene counts. The job is a tuple of
+    (annotation file, output prefix). Returns the annotation file.
+    """
+    eggnog_input, outprefix = job
+    run_annotation(ap.eggnog_parser(eggnog_input), batch_compiled_dict, batch_kterm_index, batch_brite_index, outprefix,
+                   batch_top_k, batch_marginal_gain)
+    return eggnog_input
+
+def batch_run(annotation_files, compiled_dict, kterm_index, k_term_db, outdir, threads, index_path=None, use_index=True, top_k=0,
+              marginal_gain=False):
+    """
+    Runs both checkers for every annotation file, spread over the given number of processes.
+    Output files are written to outdir, using the name of the annotation file as prefix.
+    """
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    jobs = []
+    for eggnog_input in annotation_files:
+        jobs.append((eggnog_input, os.path.join(outdir, os.path.basename(eggnog_input))))
+    initargs = (compiled_dict, kterm_index, k_term_db, index_path, use_index, top_k, marginal_gain)
+    if threads <= 1:
+        batch_worker_init(*initargs)
+        results = map(batch_worker, jobs)
+    else:
+        pool = multiprocessing.Pool(threads, initializer=batch_worker_init, initargs=initargs)
+        results = pool.imap_unordered(batch_worker, jobs)
+    for done in results:
+        print(done)
+    if threads > 1:
+        pool.close()
+        pool.join()
+
+####################################################################
+#MAIN
+####################################################################
+if __name__ == "__main__":
+    #Obtain inputs
+    eggnog_input = sys.argv[1]
+    outprefix = sys.argv[2]
+    KEGG_db = sys.argv[3]
+    k_term_db = sys.argv[4]
+    #Optional arguments for the compiled module cache and the BRITE index
+    cache_path = None
+    use_cache = True
+    if "--cache" in sys.argv:
+        cache_path = sys.argv[sys.argv.index("--cache") + 1]
+    if "--no_cache" in sys.argv:
+        use_cache = False
+    index_path = None
+    use_index = True
+    if "--index" in sys.argv:
+        index_path = sys.argv[sys.argv.index("--index") + 1]
+    if "--no_index" in sys.argv:
+        use_index = False
+    #Optional arguments for batch mode and extra output
+    batch = False
+    threads = ap.available_threads()
+    if "--batch" in sys.argv:
+        batch = True
+    if "--threads" in sys.argv:
+        threads = int(sys.argv[sys.argv.index("--threads") + 1])
+    top_k = 0
+    if "--top_k" in sys.argv:
+        top_k = int(sys.argv[sys.argv.index("--top_k") + 1])
+    marginal_gain = False
+    if "--marginal_gain" in sys.argv:
+        marginal_gain = True
+    #Optional profiling of the run
+    profile = None
+    if "--profile" in sys.argv:
+        profile_path = sys.argv[sys.argv.index("--profile") + 1]
+        profile = profiler.new_profile("KEGGstimate_runner.py")
+    #Load the compiled modules
+    compiled_dict, kterm_index = mc.load_compiled_db(KEGG_db, cache_path, use_cache, profile)
+    if batch:
+        annotation_files = ap.batch_input_files(eggnog_input)
+        ap.check_unique_file_names(annotation_files)
+        #The BRITE index is loaded by every worker process (see batch_worker_init), and the annotation files are read,
+        #scored and written by the workers, so these are a single phase
+        with profiler.profile_phase(profile, "batch"):
+            batch_run(annotation_files, compiled_dict, kterm_index, k_term_db, outprefix, threads,
+                      index_path, use_index, top_k, marginal_gain)
+    else:
+        #Map the BRITE index into memory (building it first if needed)
+        with profiler.profile_phase(profile, "brite_db_load"):
+            brite_index = bc.load_brite_index(k_term_db, index_path, use_index)
+        #Read the k terms of the annotation file once, for both checkers
+        with profiler.profile_phase(profile, "annotation_parse"):
+            kterms_list = ap.eggnog_parser(eggnog_input)
+        run_annotation(kterms_list, compiled_dict, kterm_index, brite_index, outprefix, top_k, marginal_gain, profile)
+    if profile is not None:
+        profiler.write_profile(profile, profile_path, KEGG_db, {"slowest_modules": mc.slowest_modules(compiled_dict)})
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Merges the output of a sharded batch run of KEGGstimate_module_checker.py (--batch --shard i/N). Checks that all N shards
+finished, copies the per genome output files of every shard into a single output directory, and writes a combined
+matrix of the module completion of every genome.
+
+Usage: (python) KEGGstimate_shard_merge.py shard_output_dir merged_output_dir
+
+The shard output directory is the output directory given to the module checker, containing the shard_i_of_N subdirectories.
+
+Output:
+The _KEGG_completion.tsv, _KEGG_complete_modules.tsv, _KEGG_completion_hashes.tsv and (if written) _KEGG_top_pathways.tsv
+and _KEGG_marginal_gain.tsv files of every genome, exactly as written by an unsharded batch run, and KEGG_completion_matrix.tsv:
+a tab-delimited file with a row per module and a column per genome, giving the highest completion.
+
+KEGGstimate_module_checker.py and KEGGstimate_annotation_parser.py need to be in the same directory.
+"""
+###################
+#Import statements
+###################
+
+import sys
+import os
+import shutil
+import KEGGstimate_module_checker as mc
+import KEGGstimate_annotation_parser as ap
+
+###################
+#Merge functions
+###################
+
+#Output files written per annotation file by the module checker
+OUTPUT_SUFFIXES = ["_KEGG_completion.tsv", "_KEGG_complete_modules.tsv", "_KEGG_completion_hashes.tsv", "_KEGG_top_pathways.tsv",
+                  "_KEGG_marginal_gain.tsv"]
+
+def read_shard_manifest(manifest_path):
+    """
+    Reads the manifest of a finished shard. Returns a tuple of (shard, number of shards, list of annotation files).
+    """
+    shard = None
+    annotation_files = []
+    for line in mc.gen_line_reader(manifest_path):
+        line = line.rstrip("\n")
+        if line.startswith("#Shard\t"):
+            shard = mc.parse_shard(line.partition("\t")[2])
+        elif line:
+            annotation_files.append(line)
+    return shard[0], shard[1], annotation_files
+
+def find_shards(shard_root):
+    """
+    Returns a dictionary of {shard: (shard directory, list of annotation files)} for the finished shards in shard_root.
+    Exits if shards of different runs are mixed, or if a shard did not finish.
+    """
+    shard_dict = {}
+    shard_count = None
+    for dir_name in sorted(os.listdir(shard_root)):
+        shard_dir = os.path.join(shard_root, dir_name)
+        if not dir_name.startswith("shard_") or not os.path.isdir(shard_dir):
+            continue
+        manifest_path = os.path.join(shard_dir, mc.SHARD_MANIFEST)
+        if not os.path.isfile(manifest_path):
+            sys.exit("Shard {} has not finished: {} is missing".format(dir_name, manifest_path))
+        shard, shards, annotation_files = read_shard_manifest(manifest_path)
+        if shard_count is not None and shards != shard_count:
+            sys.exit("Shards of runs with {} and {} shards found in {}".format(shard_count, shards, shard_root))
+        shard_count = shards
+        shard_dict[shard] = (shard_dir, annotation_files)
+    if shard_count is None:
+        sys.exit("No shards found in {}".format(shard_root))
+    missing_list = []
+    for shard in range(1, shard_count + 1):
+        if shard not in shard_dict:
+            missing_list.append(str(shard))
+    if missing_list:
+        sys.exit("Missing shards {} of {}".format(",".join(missing_list), shard_count))
+    return shard_dict
+
+def merge_shards(shard_dict, outdir):
+    """
+    Copies the output files of every shard to outdir. Returns a list of (sample name, prefix of the merged output)
+    sorted by annotation file name. Exits if annotation files of different shards have the same file name, since their
+    output would be copied to the same files and their completion merged into a single column of the matrix.
+    """
+    all_files = []
+    for shard in sorted(shard_dict):
+        all_files.extend(shard_dict[shard][1])
+    ap.check_unique_file_names(all_files)
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    sample_list = []
+    for shard in sorted(shard_dict):
+        shard_dir, annotation_files = shard_dict[shard]
+        for eggnog_input in annotation_files:
+            file_name = os.path.basename(eggnog_input)
+            for suffix in OUTPUT_SUFFIXES:
+                if os.path.isfile(os.path.join(shard_dir, file_name + suffix)):
+                    shutil.copyfile(os.path.join(shard_dir, file_name + suffix), os.path.join(outdir, file_name + suffix))
+            #The sample is named as in the tables of KEGGstimate_tsv_maker.py
+            sample_list.append((file_name.partition(".emapper")[0], os.path.join(outdir, file_name)))
+    sample_list.sort()
+    return sample_list
+
+def output_completion_matrix(sample_list, out_file):
+    """
+    Writes a tab-delimited matrix of the highest completion per module (rows) and sample (columns). Modules are in the
+    order of the module database. A module missing from the output of a sample is given a completion of 0.0.
+    """
+    module_list = []
+    module_set = set()
+    completion_list = []
+    for sample, outprefix in sample_list:
+        completion_dict = mc.read_completion_tsv(outprefix + "_KEGG_completion.tsv")
+        completion_list.append(completion_dict)
+        for module_name in completion_dict:
+            if module_name not in module_set:
+                module_set.add(module_name)
+                module_list.append(module_name)
+    out = open(out_file, "w")
+    out.write("#Module")
+    for sample, outprefix in sample_list:
+        out.write("\t" + sample)
+    out.write("\n")
+    for module_name in module_list:
+        out.write(module_name)
+        for completion_dict in completion_list:
+            if module_name in completion_dict:
+                out.write("\t{}".format(completion_dict[module_name][0]))
+            else:
+                out.write("\t0.0")
+        out.write("\n")
+    out.close()
+
+####################################################################
+#MAIN
+####################################################################
+if __name__ == "__main__":
+    #Obtain inputs
+    shard_root = sys.argv[1]
+    outdir = sys.argv[2]
+    shard_dict = find_shards(shard_root)
+    sample_list = merge_shards(shard_dict, outdir)
+    output_completion_matrix(sample_list, os.path.join(outdir, "KEGG_completion_matrix.tsv"))
+    print("Merged {} genomes from {} shards".format(len(sample_list), len(shard_dict)))
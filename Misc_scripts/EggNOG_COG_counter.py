@@ -2,17 +2,41 @@
 """
 Parses all the EggNOG "emapper.annotations" files in the given directory, and counts the COG terms per sample.
 Writes the COG counts per sample to a single tab-delimited file
+If KEGGstimate_annotation_cache.py is in the same directory or on the Python path, and an annotation file has an
+up-to-date binary cache made by it, the COG column is read from the cache. Otherwise the text file is read.
 
 Usage: (python) EggNOG_COG_counter.py Input_dir Output_file
 """
 import sys
 import os
+try:
+    import KEGGstimate_annotation_cache as annotation_cache
+except ImportError:
+    annotation_cache = None
 
 #Generator function that reads file line by line, without reading the full file into memory
 def gen_line_reader(file_path):
     for line in open(file_path, "r"):
         yield line
 
+#Generator function that gives the value of a column for every line not starting with "#", or None for lines lacking the column
+def text_column(file_path, column):
+    for line in gen_line_reader(file_path):
+        if line.startswith("#"):
+            continue
+        splt = line.split("\t")
+        if len(splt) > column:
+            yield splt[column]
+        else:
+            yield None
+
+#Reads a column of an annotation file from its binary cache when KEGGstimate_annotation_cache.py is available
+#and the cache is up to date, and from the text file otherwise
+def annotation_column(file_path, column):
+    if annotation_cache is not None:
+        return annotation_cache.annotation_column(file_path, column)
+    return text_column(file_path, column)
+
 eggnog_dir = sys.argv[1]
 outputfile = sys.argv[2]
 COG_dir = {}
@@ -22,13 +46,10 @@ for subdir, dirs, files in os.walk(eggnog_dir): #iterate over all directories an
         if file.endswith("emapper.annotations"):
             sample = file.partition(".")[0]
             COG_dir[sample] = {}
-            for line in gen_line_reader(os.path.join(subdir,file)):
-                if line.startswith("#"):
-                    continue
-                splt = line.split("\t")
-                if len(splt) > 6:
-                    if splt[6] != "":
-                        COG = splt[6]
+            for COG_column in annotation_column(os.path.join(subdir,file), 6):
+                if COG_column is not None:
+                    if COG_column != "":
+                        COG = COG_column
                         if len(COG.strip()) > 1:
                             COGlst = COG.strip()
                             for COG in COGlst:
@@ -2,17 +2,42 @@
 """
 Reads all the EggNOG .annotations file and extracts the KEGG ko number. Outputs a file similar to the downloaded
 outputs from BLASTkoala. 
+If KEGGstimate_annotation_cache.py is in the same directory or on the Python path, and the EggNOG input (the first file)
+has an up-to-date binary cache made by it, its column is read from the cache. The second file, which can be a
+BLASTkoala-style file, is always read as text.
 
 Usage: (python) EggNOG_to_KEGG.py input.emapper.annotations output_name (optional)
 """
 import sys
 import os
+try:
+    import KEGGstimate_annotation_cache as annotation_cache
+except ImportError:
+    annotation_cache = None
 
 #Generator function that reads file line by line, without reading the full file into memory
 def gen_line_reader(file_path):
     for line in open(file_path, "r"):
         yield line
 
+#Generator function that gives the value of a column for every line not starting with "#", or None for lines lacking the column
+def text_column(file_path, column):
+    for line in gen_line_reader(file_path):
+        if line.startswith("#"):
+            continue
+        splt = line.split("\t")
+        if len(splt) > column:
+            yield splt[column]
+        else:
+            yield None
+
+#Reads a column of an EggNOG annotation file from its binary cache when KEGGstimate_annotation_cache.py is available
+#and the cache is up to date, and from the text file otherwise
+def annotation_column(file_path, column):
+    if annotation_cache is not None:
+        return annotation_cache.annotation_column(file_path, column)
+    return text_column(file_path, column)
+
 #Obtain inputs
 file1 = sys.argv[1]
 file2 = sys.argv[2]
@@ -23,22 +48,17 @@ ko_list2 = []
 not_list1 = []
 not_list2 = []
 #Read over EggNOG file, and write the KEGG KO terms per gene to the output
-for line in gen_line_reader(file1):
-    if line.startswith("#"):
-        continue
-    if len(line.split("\t")) > 1:
-        gene = line.split("\t")[0]
-        ko = line.split("\t")[1].strip()
+for ko_column in annotation_column(file1, 1):
+    if ko_column is not None:
+        ko = ko_column.strip()
         if ko.strip():
             if ko.strip() not in ko_list1:
                 ko_list1.append(ko.strip())
 
-for line in gen_line_reader(file2):
-    if line.startswith("#"):
-        continue
-    if len(line.split("\t")) > 1:
-        gene = line.split("\t")[0]
-        ko = line.split("\t")[1].strip()
+#The second file is not an EggNOG annotation file, so it has no cache
+for ko_column in text_column(file2, 1):
+    if ko_column is not None:
+        ko = ko_column.strip()
         if ko.strip():
             if ko.strip() not in ko_list2:
                 ko_list2.append(ko.strip())  